@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+여러 리롤 DB 파일들 간의 목표 확률 차이를 한 번에 비교하는 스크립트 (compare-reroll-dbs.js의 Python 버전)
+
+모든 DB를 하나의 SQLite 연결에 ATTACH하고, 인접한 DB 쌍마다 같은 젬 상태끼리 조인한 목표별 차이를
+한 번의 쿼리로 fetchmany 묶음 단위로 스트리밍하며 numpy 누적값(최대, 합, 상위 상태)을 갱신한다.
+조인에서는 행 ID와 차이만 가져오고 (Python 튜플 변환이 비용 대부분), 상태 필드와 값은 상위 상태만 다시 읽는다.
+분위수용으로 목표별 절대 차이만 모아 두므로 쌍 하나의 메모리는 상태당 8바이트 x 목표 수이다.
+예전 스키마(gem_states)와 현재 스키마(goal_probabilities)를 섞어서 비교할 수 있다.
+
+사용법: python compare_reroll_dbs.py [db_path ...] [--top 10] [--tolerance 1e-6]
+"""
+
+import argparse
+import glob
+import os
+import re
+import sqlite3
+import sys
+import time
+import numpy as np
+
+# 젬 상태를 식별하는 컬럼 (두 스키마 공통, UNIQUE 인덱스 순서)
+STATE_COLUMNS = ('willpower', 'corePoint', 'dealerA', 'dealerB', 'supportA', 'supportB',
+                 'remainingAttempts', 'currentRerollAttempts', 'costModifier', 'isFirstProcessing')
+
+# 목표 확률 테이블 후보 (현재 스키마 우선)
+STATE_TABLES = ('goal_probabilities', 'gem_states')
+
+# 차이 분포에서 보고하는 분위수
+DELTA_QUANTILES = (0.5, 0.9, 0.99)
+
+# 조인 결과를 한 번에 가져오는 행 수 (fetchmany 묶음 크기)
+FETCH_CHUNK_ROWS = 50_000
+
+def default_db_paths():
+    """현재 디렉터리의 probability_table_reroll_N.db들 (리롤 횟수 순)"""
+    paths = glob.glob('./probability_table_reroll_*.db')
+    return sorted((path for path in paths if re.search(r'reroll_(\d+)\.db$', path)),
+                  key=lambda path: int(re.search(r'reroll_(\d+)\.db$', path).group(1)))
+
+def db_label(path: str) -> str:
+    """표시용 이름 (파일명에 리롤 횟수가 있으면 reroll_N)"""
+    match = re.search(r'reroll_(\d+)', os.path.basename(path))
+    return f"reroll_{match.group(1)}" if match else os.path.basename(path)
+
+def attach_databases(paths):
+    """DB들을 읽기 전용으로 ATTACH -> (연결, [(스키마 이름, 상태 테이블, 확률 컬럼 목록)])"""
+    conn = sqlite3.connect(':memory:')
+    schemas = []
+    for db_idx, path in enumerate(paths):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"DB 파일이 없습니다: {path}")
+        schema = f"db{db_idx}"
+        conn.execute(f"ATTACH DATABASE ? AS {schema}", (f"file:{os.path.abspath(path)}?mode=ro",))
+        tables = {row[0] for row in conn.execute(f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table'")}
+        table = next((name for name in STATE_TABLES if name in tables), None)
+        if table is None:
+            raise ValueError(f"{path}: 목표 확률 테이블({', '.join(STATE_TABLES)})이 없습니다")
+        columns = [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")
+                   if row[1].startswith('prob_')]
+        schemas.append((schema, table, columns))
+    return conn, schemas
+
+def iter_pair_deltas(conn, left, right, columns):
+    """같은 젬 상태끼리 조인한 (왼쪽 행 ID 배열, 오른쪽 - 왼쪽 차이 배열)을 FETCH_CHUNK_ROWS행씩 생성"""
+    (left_schema, left_table, _), (right_schema, right_table, _) = left, right
+    join_condition = ' AND '.join(f"a.{column} = b.{column}" for column in STATE_COLUMNS)
+    select_columns = ', '.join(['a.id', *(f"b.{column} - a.{column}" for column in columns)])
+    cursor = conn.execute(f"""
+        SELECT {select_columns}
+        FROM {left_schema}.{left_table} a
+        JOIN {right_schema}.{right_table} b ON {join_condition}
+    """)
+    while True:
+        rows = cursor.fetchmany(FETCH_CHUNK_ROWS)
+        if not rows:
+            break
+        data = np.array(rows, dtype=np.float64)
+        del rows
+        yield data[:, 0].astype(np.int64), data[:, 1:]
+
+def fetch_state_rows(conn, left, columns, row_ids):
+    """왼쪽 DB에서 행 ID들의 (상태 필드 배열, 값 배열)을 row_ids 순서로"""
+    schema, table, _ = left
+    rows = {row[0]: row[1:] for row in conn.execute(f"""
+        SELECT id, {', '.join(STATE_COLUMNS)}, {', '.join(columns)}
+        FROM {schema}.{table} WHERE id IN ({', '.join('?' * len(row_ids))})
+    """, [int(row_id) for row_id in row_ids])}
+    data = np.array([rows[int(row_id)] for row_id in row_ids], dtype=np.float64).reshape(
+        -1, len(STATE_COLUMNS) + len(columns))
+    return data[:, :len(STATE_COLUMNS)].astype(np.int64), data[:, len(STATE_COLUMNS):]
+
+def accumulate_pair_deltas(chunks, column_count: int, top: int):
+    """묶음들을 스트리밍으로 누적 -> (공통 상태 수, 목표 x 통계 배열, 상위 top개 (행 ID, 차이))
+
+    최대와 평균은 바로 누적하고, 분위수는 모아 둔 절대 차이로 마지막에 계산한다.
+    상위 상태는 묶음마다 지금까지의 후보와 합쳐 top개만 남긴다 (같은 차이면 먼저 나온 행 우선).
+    """
+    state_total = 0
+    max_abs = np.zeros(column_count)
+    sum_abs = np.zeros(column_count)
+    abs_chunks = []
+    top_ids = np.zeros(0, dtype=np.int64)
+    top_deltas = np.zeros((0, column_count))
+    for row_ids, deltas in chunks:
+        abs_deltas = np.abs(deltas)
+        state_total += len(deltas)
+        np.maximum(max_abs, abs_deltas.max(axis=0), out=max_abs)
+        sum_abs += abs_deltas.sum(axis=0)
+        abs_chunks.append(abs_deltas)
+        if top > 0:
+            top_ids = np.concatenate((top_ids, row_ids))
+            top_deltas = np.concatenate((top_deltas, deltas))
+            keep = np.argsort(-np.abs(top_deltas).max(axis=1), kind='stable')[:top]
+            top_ids, top_deltas = top_ids[keep], top_deltas[keep]
+    
+    if state_total == 0:
+        return 0, np.zeros((column_count, 2 + len(DELTA_QUANTILES))), (top_ids, top_deltas)
+    all_abs = np.concatenate(abs_chunks)
+    del abs_chunks
+    stats = np.column_stack((max_abs, sum_abs / state_total,
+                             np.quantile(all_abs, DELTA_QUANTILES, axis=0).T))
+    return state_total, stats, (top_ids, top_deltas)
+
+def print_top_states(states, values, deltas, columns, top):
+    """목표 중 가장 큰 절대 차이 기준 상위 top개 상태 출력"""
+    if top <= 0 or len(deltas) == 0:
+        return
+    max_abs = np.abs(deltas).max(axis=1)
+    worst_columns = np.abs(deltas).argmax(axis=1)
+    order = np.argsort(-max_abs, kind='stable')[:top]
+    order = order[max_abs[order] > 0]
+    if len(order) == 0:
+        return
+    print(f"  가장 많이 달라진 상태 {len(order)}개:")
+    for row in order:
+        column = worst_columns[row]
+        state_key = ','.join(map(str, states[row].tolist()))
+        print(f"    ({state_key}) {columns[column]}: {values[row, column] * 100:.6f}% -> "
+              f"{(values[row, column] + deltas[row, column]) * 100:.6f}% ({deltas[row, column] * 100:+.6f}%)")
+
+def compare_databases(paths, top: int = 10, tolerance: float = 1e-6):
+    """인접한 DB 쌍마다 목표별 차이 통계를 출력하고 마지막 쌍 기준 수렴 여부를 반환"""
+    start_time = time.time()
+    conn, schemas = attach_databases(paths)
+    labels = [db_label(path) for path in paths]
+    
+    # 모든 DB에 있는 확률 컬럼만 비교 (첫 DB의 컬럼 순서)
+    columns = [column for column in schemas[0][2] if all(column in schema[2] for schema in schemas[1:])]
+    if not columns:
+        raise ValueError("모든 DB에 공통인 확률 컬럼이 없습니다")
+    
+    print(f"🎲 리롤 DB 비교: {', '.join(labels)}")
+    for label, (schema, table, _) in zip(labels, schemas):
+        state_count = conn.execute(f"SELECT COUNT(*) FROM {schema}.{table}").fetchone()[0]
+        print(f"  - {label}: {table} {state_count:,}개 상태")
+    print(f"  비교 목표: {', '.join(columns)}")
+    
+    stat_names = ['최대', '평균', *(f"p{int(q * 100)}" for q in DELTA_QUANTILES)]
+    pair_max_deltas = []
+    for pair_idx in range(len(schemas) - 1):
+        chunks = iter_pair_deltas(conn, schemas[pair_idx], schemas[pair_idx + 1], columns)
+        state_total, stats, (top_ids, deltas) = accumulate_pair_deltas(chunks, len(columns), top)
+        states, values = fetch_state_rows(conn, schemas[pair_idx], columns, top_ids)
+        pair_max_deltas.append(stats[:, 0])
+    
+        print(f"\n=== {labels[pair_idx]} → {labels[pair_idx + 1]} ({state_total:,}개 공통 상태, 절대 차이 %) ===")
+        print(f"  {'목표':<24}" + ''.join(f"{name:>12}" for name in stat_names))
+        for column, row in zip(columns, stats):
+            print(f"  {column:<24}" + ''.join(f"{value * 100:>12.6f}" for value in row))
+        print_top_states(states, values, deltas, columns, top)
+    
+    # 수렴: 마지막 인접 쌍의 최대 차이가 허용 오차 이하
+    converged = True
+    if pair_max_deltas:
+        print(f"\n=== 수렴 여부 (인접 쌍 최대 절대 차이, 허용 오차 {tolerance:g}) ===")
+        for column_idx, column in enumerate(columns):
+            history = [max_deltas[column_idx] for max_deltas in pair_max_deltas]
+            column_converged = history[-1] <= tolerance
+            converged &= column_converged
+            print(f"  {column:<24} {' -> '.join(f'{value:.2e}' for value in history)} "
+                  f"{'✅ 수렴' if column_converged else '⚠️ 미수렴'}")
+    
+    conn.close()
+    print(f"\n✨ 비교 완료: {time.time() - start_time:.2f}초")
+    return converged
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='리롤 DB 간 목표 확률 비교')
+    parser.add_argument('db_paths', nargs='*',
+                        help='비교할 DB 파일들 (순서대로 인접 쌍 비교, 기본값: ./probability_table_reroll_*.db)')
+    parser.add_argument('--top', type=int, default=10,
+                        help='쌍마다 출력할 가장 많이 달라진 상태 수 (기본값: 10)')
+    parser.add_argument('--tolerance', type=float, default=1e-6,
+                        help='수렴으로 판단하는 최대 절대 차이 (기본값: 1e-6)')
+    args = parser.parse_args()
+    
+    db_paths = args.db_paths or default_db_paths()
+    if len(db_paths) < 2:
+        print("사용법: python compare_reroll_dbs.py <db_path> <db_path> [...] (2개 이상 필요)")
+        sys.exit(1)
+    
+    sys.exit(0 if compare_databases(db_paths, top=args.top, tolerance=args.tolerance) else 2)
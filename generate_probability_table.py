@@ -8,20 +8,32 @@ import sys
 import inspect
 import threading
 import sqlite3
+import struct
 import numpy as np
 import matplotlib
 import matplotlib.pyplot as plt
 import random
 from matplotlib.colors import LinearSegmentedColormap, ListedColormap
 from typing import Dict, Any, Tuple, List
-from dataclasses import dataclass
-from itertools import combinations, permutations
+from dataclasses import dataclass, replace
+from collections import OrderedDict
+from itertools import combinations, permutations, groupby, repeat
+from concurrent.futures import ThreadPoolExecutor
 from math import comb
+from array import array
 import json
+import ast
+import zlib
+import lzma
+import re
+import asyncio
+import urllib.parse
+import hashlib
 
 # 상수 정의
 MAX_REROLL_ATTEMPTS = 3  # 전체 상태 생성 시 고려하는 최대 리롤 횟수 (0~6)
 MAX_REROLL_FOR_MEMOIZATION = MAX_REROLL_ATTEMPTS - 1  # 메모이제이션 효율성을 위한 리롤 횟수 상한 (6)
+MAX_REMAINING_ATTEMPTS = 9  # 전체 상태 생성 시 고려하는 최대 남은 가공 횟수 (상태 ID 5비트로 31까지)
 
 # 젬 가공 관련 상수
 PROCESSING_COST = 900  # 기본 가공 비용 (골드)
@@ -95,7 +107,7 @@ PROCESSING_POSSIBILITIES = {
     'reroll_+2': {'probability': 0.0075, 'condition': 'remainingAttempts > 1'}
 }
 
-@dataclass
+@dataclass(slots=True)
 class GemState:
     willpower: int
     corePoint: int
@@ -198,59 +210,62 @@ def check_condition(condition: str, gem: GemState) -> bool:
     
     return False
 
+# 옵션별 설명 매핑 (4개 옵션 시스템)
+OPTION_DESCRIPTIONS = {
+    'willpower_+1': '의지력 +1',
+    'willpower_+2': '의지력 +2', 
+    'willpower_+3': '의지력 +3',
+    'willpower_+4': '의지력 +4',
+    'willpower_-1': '의지력 -1',
+    'corePoint_+1': '질서/혼돈 +1',
+    'corePoint_+2': '질서/혼돈 +2',
+    'corePoint_+3': '질서/혼돈 +3',
+    'corePoint_+4': '질서/혼돈 +4',
+    'corePoint_-1': '질서/혼돈 -1',
+    'dealerA_+1': '딜러A 옵션 +1',
+    'dealerA_+2': '딜러A 옵션 +2',
+    'dealerA_+3': '딜러A 옵션 +3', 
+    'dealerA_+4': '딜러A 옵션 +4',
+    'dealerA_-1': '딜러A 옵션 -1',
+    'dealerB_+1': '딜러B 옵션 +1',
+    'dealerB_+2': '딜러B 옵션 +2',
+    'dealerB_+3': '딜러B 옵션 +3',
+    'dealerB_+4': '딜러B 옵션 +4', 
+    'dealerB_-1': '딜러B 옵션 -1',
+    'supportA_+1': '서폿A 옵션 +1',
+    'supportA_+2': '서폿A 옵션 +2',
+    'supportA_+3': '서폿A 옵션 +3', 
+    'supportA_+4': '서폿A 옵션 +4',
+    'supportA_-1': '서폿A 옵션 -1',
+    'supportB_+1': '서폿B 옵션 +1',
+    'supportB_+2': '서폿B 옵션 +2',
+    'supportB_+3': '서폿B 옵션 +3',
+    'supportB_+4': '서폿B 옵션 +4', 
+    'supportB_-1': '서폿B 옵션 -1',
+    'dealerA_change': '딜러A 옵션 변경',
+    'dealerB_change': '딜러B 옵션 변경',
+    'supportA_change': '서폿A 옵션 변경',
+    'supportB_change': '서폿B 옵션 변경',
+    'cost_+100': '가공 비용 +100',
+    'cost_-100': '가공 비용 -100',
+    'maintain': '현재 상태 유지',
+    'reroll_+1': '리롤 횟수 +1',
+    'reroll_+2': '리롤 횟수 +2'
+}
+
+# 옵션 ID: PROCESSING_POSSIBILITIES 순서의 정수 인덱스 (메모이제이션 레코드에 저장)
+OPTION_ACTIONS = list(PROCESSING_POSSIBILITIES)
+OPTION_IDS = {action: option_id for option_id, action in enumerate(OPTION_ACTIONS)}
+
 def get_available_options(gem: GemState) -> list:
     """사용 가능한 옵션들과 그 확률, 설명을 반환"""
     options = []
-    
-    # 옵션별 설명 매핑 (4개 옵션 시스템)
-    descriptions = {
-        'willpower_+1': '의지력 +1',
-        'willpower_+2': '의지력 +2', 
-        'willpower_+3': '의지력 +3',
-        'willpower_+4': '의지력 +4',
-        'willpower_-1': '의지력 -1',
-        'corePoint_+1': '질서/혼돈 +1',
-        'corePoint_+2': '질서/혼돈 +2',
-        'corePoint_+3': '질서/혼돈 +3',
-        'corePoint_+4': '질서/혼돈 +4',
-        'corePoint_-1': '질서/혼돈 -1',
-        'dealerA_+1': '딜러A 옵션 +1',
-        'dealerA_+2': '딜러A 옵션 +2',
-        'dealerA_+3': '딜러A 옵션 +3', 
-        'dealerA_+4': '딜러A 옵션 +4',
-        'dealerA_-1': '딜러A 옵션 -1',
-        'dealerB_+1': '딜러B 옵션 +1',
-        'dealerB_+2': '딜러B 옵션 +2',
-        'dealerB_+3': '딜러B 옵션 +3',
-        'dealerB_+4': '딜러B 옵션 +4', 
-        'dealerB_-1': '딜러B 옵션 -1',
-        'supportA_+1': '서폿A 옵션 +1',
-        'supportA_+2': '서폿A 옵션 +2',
-        'supportA_+3': '서폿A 옵션 +3', 
-        'supportA_+4': '서폿A 옵션 +4',
-        'supportA_-1': '서폿A 옵션 -1',
-        'supportB_+1': '서폿B 옵션 +1',
-        'supportB_+2': '서폿B 옵션 +2',
-        'supportB_+3': '서폿B 옵션 +3',
-        'supportB_+4': '서폿B 옵션 +4', 
-        'supportB_-1': '서폿B 옵션 -1',
-        'dealerA_change': '딜러A 옵션 변경',
-        'dealerB_change': '딜러B 옵션 변경',
-        'supportA_change': '서폿A 옵션 변경',
-        'supportB_change': '서폿B 옵션 변경',
-        'cost_+100': '가공 비용 +100',
-        'cost_-100': '가공 비용 -100',
-        'maintain': '현재 상태 유지',
-        'reroll_+1': '리롤 횟수 +1',
-        'reroll_+2': '리롤 횟수 +2'
-    }
-    
     for action, config in PROCESSING_POSSIBILITIES.items():
         if check_condition(config['condition'], gem):
             options.append({
                 'action': action,
                 'probability': config['probability'],
-                'description': descriptions.get(action, action)
+                'description': OPTION_DESCRIPTIONS.get(action, action)
             })
     return options
 
@@ -388,12 +403,70 @@ def calculate_4combo_probability(combo_indices: List[int], all_weights: List[flo
     
     return combo_total_prob
 
+# 4개 조합 확률의 2단계 캐시 (combo_memo 아래): (뽑힌 가중치 4개 정렬, 전체 가중치 합) -> 조합 확률
+# 조합 확률은 뽑힌 4개의 가중치와 전체 합에만 의존하고 가중치 값 종류는 몇 개뿐이라 패턴이 달라도 같은 값이 반복된다.
+combo_weight_signature_memo: Dict[Tuple[Tuple[float, ...], float], float] = {}
+
+def calculate_4combo_probability_from_signature(chosen_weights: Tuple[float, ...], total_weight: float) -> float:
+    """뽑힌 4개 가중치와 전체 가중치 합만으로 계산한 calculate_4combo_probability (순서 고려)"""
+    combo_total_prob = 0.0
+    for perm in permutations(chosen_weights):
+        perm_prob = 1.0
+        remaining_total = total_weight
+        for weight in perm:
+            if remaining_total <= 0 or weight <= 0:
+                perm_prob = 0
+                break
+            perm_prob *= weight / remaining_total
+            remaining_total -= weight
+        combo_total_prob += perm_prob
+    return combo_total_prob
+
+def cached_4combo_probability(combo_indices, all_weights: List[float], total_weight: float) -> float:
+    """가중치 시그니처 캐시를 거친 calculate_4combo_probability (total_weight는 sum(all_weights))"""
+    signature = (tuple(sorted(all_weights[option_idx] for option_idx in combo_indices)), total_weight)
+    probability = combo_weight_signature_memo.get(signature)
+    if probability is None:
+        probability = combo_weight_signature_memo.setdefault(
+            signature, calculate_4combo_probability_from_signature(*signature))
+    return probability
+
+def calculate_4combo_probability_gradient(combo_indices: List[int], all_weights: List[float]) -> np.ndarray:
+    """calculate_4combo_probability의 각 가중치에 대한 편미분 (all_weights와 같은 길이)
+
+    순서 하나의 확률 p = Π w_i / D_i (D_i는 i번째 뽑기 직전 남은 가중치 합)이므로
+    d p / d w_k = p * (k가 뽑힌 옵션이면 1 / w_k - k가 아직 남아 있던 뽑기들의 Σ 1 / D_i)
+    """
+    gradient = np.zeros(len(all_weights))
+    total = sum(all_weights)
+    
+    for perm in permutations(combo_indices):
+        perm_prob = 1.0
+        remaining_total = total
+        inverse_totals = []
+        for option_idx in perm:
+            if remaining_total <= 0 or all_weights[option_idx] <= 0:
+                perm_prob = 0
+                break
+            perm_prob *= all_weights[option_idx] / remaining_total
+            inverse_totals.append(1 / remaining_total)
+            remaining_total -= all_weights[option_idx]
+        if perm_prob == 0:
+            continue
+        
+        # 모든 옵션은 첫 뽑기부터 남아 있고, 뽑힌 옵션은 자기 차례 이후로는 분모에서 빠짐
+        gradient -= perm_prob * sum(inverse_totals)
+        for position, option_idx in enumerate(perm):
+            gradient[option_idx] += perm_prob * (1 / all_weights[option_idx] + sum(inverse_totals[position + 1:]))
+    
+    return gradient
+
 # 진행 상황 추적을 위한 전역 변수
 calculation_counter = 0
 start_time = None
 
 class ProgressVisualizer:
-    def __init__(self, max_attempts=10, max_rerolls=5):
+    def __init__(self, max_attempts=10, max_rerolls=5, output_filename="gem_calculation_progress.mp4", fps=60):
         self.max_attempts = max_attempts
         self.max_rerolls = max_rerolls
         
@@ -424,8 +497,8 @@ class ProgressVisualizer:
         # 실시간 영상 생성 설정
         self.frame_counter = 0
         self.video_writer = None
-        self.output_filename = "gem_calculation_progress.mp4"
-        self.fps = 60
+        self.output_filename = output_filename
+        self.fps = fps
         
         # OpenCV 비디오 라이터 초기화
         if CV2_AVAILABLE:
@@ -566,110 +639,130 @@ class ProgressVisualizer:
             print(f"🎬 최종 영상 완료: {self.output_filename} ({self.frame_counter}프레임)")
         plt.close(self.fig)
         
-# 전역 시각화 객체
-visualizer = None
+# 진행 상황 이벤트 종류 (이벤트 로그에 1비트로 기록)
+PROGRESS_EVENT_CALCULATED = 0
+PROGRESS_EVENT_MEMO_HIT = 1
 
-# 메모이제이션 히트 버퍼 (배치 처리용)
-memo_hit_buffer = set()  # state_key들을 저장
+# 이벤트 로그 파일 헤더: 매직 + (max_attempts, max_rerolls)
+PROGRESS_LOG_MAGIC = b'GEMPROG1'
+PROGRESS_LOG_HEADER = struct.Struct('<8sHH')
 
-def update_visualization_progress(state_key: str, is_memo_hit: bool = False):
-    """시각화 진행상황 업데이트"""
-    global visualizer
-    
-    if not visualizer:
-        return
-        
-    try:
-        # key에서 상태 정보 파싱: "wp,cp,dealerA,dealerB,supportA,supportB,attempts,reroll,cost,isFirst"
-        parts = state_key.split(',')
-        if len(parts) != 10:
+class ProgressEventLog:
+    """계산 진행 상황을 압축된 바이너리 이벤트로 기록 (영상 렌더링은 render_progress_log에서 별도 수행)
+
+    이벤트 하나는 uint32 하나: (state_id << 1) | 이벤트 종류
+    """
+
+    def __init__(self, path: str, max_attempts: int = 10, max_rerolls: int = 5, flush_every: int = 1 << 16):
+        self.path = path
+        self.flush_every = flush_every
+        self.events = array('I')
+        assert self.events.itemsize == 4
+        self.event_count = 0
+        self.file = open(path, 'wb')
+        self.file.write(PROGRESS_LOG_HEADER.pack(PROGRESS_LOG_MAGIC, max_attempts, max_rerolls))
+
+    def append(self, state_id: int, event_type: int):
+        """이벤트 하나 추가 (생성기 입장에서의 유일한 시각화 비용)"""
+        self.events.append((state_id << 1) | event_type)
+        if len(self.events) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        self.event_count += len(self.events)
+        self.events.tofile(self.file)
+        self.file.flush()
+        del self.events[:]
+
+    def close(self):
+        if self.file.closed:
             return
-            
-        wp, cp, dealerA, dealerB, supportA, supportB, attempts, reroll, cost, _ = map(int, parts)
-        
-        # 서브 인덱스 계산
-        cost_idx = {-100: 0, 0: 1, 100: 2}.get(cost, 1)
-        wp_idx = wp - 1
-        cp_idx = cp - 1
-        
-        # 4개 옵션 조합 인덱스 계산 (정확히 2개만 활성화)
-        active_options = []
-        if dealerA > 0:
-            active_options.append(('dealerA', dealerA))
-        if dealerB > 0:
-            active_options.append(('dealerB', dealerB))
-        if supportA > 0:
-            active_options.append(('supportA', supportA))
-        if supportB > 0:
-            active_options.append(('supportB', supportB))
-        
-        # 활성화된 2개 옵션의 조합 패턴에 따라 인덱스 계산
-        if len(active_options) == 2:
-            opt1_name, opt1_val = active_options[0]
-            opt2_name, opt2_val = active_options[1]
-            
-            # 6가지 조합 패턴
-            combo_patterns = [
-                ('dealerA', 'dealerB'),
-                ('dealerA', 'supportA'), 
-                ('dealerA', 'supportB'),
-                ('dealerB', 'supportA'),
-                ('dealerB', 'supportB'),
-                ('supportA', 'supportB')
-            ]
-            
-            # 현재 조합이 어떤 패턴인지 찾기
-            current_pattern = (opt1_name, opt2_name)
-            if current_pattern in combo_patterns:
-                pattern_idx = combo_patterns.index(current_pattern)
-            else:
-                # 순서가 바뀐 경우
-                reversed_pattern = (opt2_name, opt1_name)
-                if reversed_pattern in combo_patterns:
-                    pattern_idx = combo_patterns.index(reversed_pattern)
-                    opt1_val, opt2_val = opt2_val, opt1_val  # 값도 순서 맞춤
-                else:
-                    pattern_idx = 0  # fallback
-            
-            # 각 패턴 내에서 25가지 조합 (5 * 5)
-            sub_combo_idx = (opt1_val - 1) * 5 + (opt2_val - 1)
-            option_idx = pattern_idx * 25 + sub_combo_idx
-        else:
-            option_idx = 0  # fallback
-        
-        sub_index = (cost_idx * 5 * 5 * 150 + 
-                    wp_idx * 5 * 150 + 
-                    cp_idx * 150 + 
-                    option_idx)
-        
-        # 메모이제이션 히트 여부에 따라 다른 값으로 업데이트
-        if is_memo_hit:
-            visualizer.update_progress(attempts, reroll, sub_index, progress_type='memo_hit')
-        else:
-            visualizer.update_progress(attempts, reroll, sub_index, progress_type='calculated')
-            
-    except Exception as e:
-        # 시각화 오류가 전체 계산을 망가뜨리지 않도록
-        print(f"시각화 업데이트 오류: {e}")
-        pass
+        self.flush()
+        self.file.close()
+        print(f"📝 진행 이벤트 로그 저장: {self.path} ({self.event_count}개 이벤트)")
 
-def flush_memo_hits_to_visualization():
-    """버퍼에 쌓인 메모 히트들을 일괄 시각화 처리"""
-    global memo_hit_buffer
-    
-    if not memo_hit_buffer:
-        return 0
-        
-    memo_hit_count = len(memo_hit_buffer)
-    
-    # 모든 메모 히트를 시각화
-    for state_key in memo_hit_buffer:
-        update_visualization_progress(state_key, is_memo_hit=True)
-    
-    # 버퍼 클리어
-    memo_hit_buffer.clear()
-    
-    return memo_hit_count
+def read_progress_log(path: str) -> Tuple[int, int, np.ndarray]:
+    """이벤트 로그 파일을 읽어 (max_attempts, max_rerolls, 이벤트 배열) 반환"""
+    with open(path, 'rb') as f:
+        magic, max_attempts, max_rerolls = PROGRESS_LOG_HEADER.unpack(f.read(PROGRESS_LOG_HEADER.size))
+        if magic != PROGRESS_LOG_MAGIC:
+            raise ValueError(f"진행 이벤트 로그 형식이 아닙니다: {path}")
+        events = np.fromfile(f, dtype='<u4')
+    return max_attempts, max_rerolls, events
+
+# 시각화 서브그리드에서 활성 옵션 2개의 조합 패턴 순서
+VISUALIZATION_EFFECT_PATTERNS = [
+    ('dealerA', 'dealerB'),
+    ('dealerA', 'supportA'),
+    ('dealerA', 'supportB'),
+    ('dealerB', 'supportA'),
+    ('dealerB', 'supportB'),
+    ('supportA', 'supportB')
+]
+
+def visualization_sub_index(willpower: int, corePoint: int, dealerA: int, dealerB: int,
+                            supportA: int, supportB: int, costModifier: int) -> int:
+    """젬 상태를 (remainingAttempts, reroll) 셀 내부의 서브 인덱스로 변환"""
+    cost_idx = COST_MODIFIER_TO_INDEX.get(costModifier, 1)
+    wp_idx = willpower - 1
+    cp_idx = corePoint - 1
+
+    # 4개 옵션 조합 인덱스 계산 (정확히 2개만 활성화)
+    levels = {'dealerA': dealerA, 'dealerB': dealerB, 'supportA': supportA, 'supportB': supportB}
+    active_options = tuple(name for name, level in levels.items() if level > 0)
+    if active_options in VISUALIZATION_EFFECT_PATTERNS:
+        pattern_idx = VISUALIZATION_EFFECT_PATTERNS.index(active_options)
+        opt1_val, opt2_val = levels[active_options[0]], levels[active_options[1]]
+        # 각 패턴 내에서 25가지 조합 (5 * 5)
+        option_idx = pattern_idx * 25 + (opt1_val - 1) * 5 + (opt2_val - 1)
+    else:
+        option_idx = 0  # fallback
+
+    return (cost_idx * 5 * 5 * 150 +
+            wp_idx * 5 * 150 +
+            cp_idx * 150 +
+            option_idx)
+
+def render_progress_log(log_path: str, output_filename: str = "gem_calculation_progress.mp4",
+                        fps: int = 60, states_per_frame: int = 1, checkpoint_every: int = 10000):
+    """이벤트 로그를 영상으로 렌더링 (오프라인 또는 백그라운드 프로세스에서 실행)
+
+    states_per_frame개의 상태 계산이 끝날 때마다 프레임 하나를 추가하며,
+    그 사이에 발생한 메모이제이션 히트는 해당 프레임에 파란색으로 표시된다.
+    """
+    max_attempts, max_rerolls, events = read_progress_log(log_path)
+    print(f"🎞️ 진행 이벤트 렌더링: {log_path} ({len(events)}개 이벤트, {states_per_frame}상태/프레임, {fps}fps)")
+
+    visualizer = ProgressVisualizer(max_attempts=max_attempts, max_rerolls=max_rerolls,
+                                    output_filename=output_filename, fps=fps)
+    calculated_count = 0
+    try:
+        for event in events.tolist():
+            fields = state_id_to_fields(event >> 1)
+            sub_index = visualization_sub_index(*fields[:6], fields[8])
+            if event & 1 == PROGRESS_EVENT_MEMO_HIT:
+                visualizer.update_progress(fields[6], fields[7], sub_index, progress_type='memo_hit')
+                continue
+
+            visualizer.update_progress(fields[6], fields[7], sub_index, progress_type='calculated')
+            calculated_count += 1
+            if calculated_count % states_per_frame == 0:
+                visualizer.refresh_display()
+            # 중간 영상 저장
+            if checkpoint_every and calculated_count % checkpoint_every == 0:
+                visualizer.save_current_video(f"checkpoint_{calculated_count}")
+
+        # 최종 프레임
+        visualizer.refresh_display()
+    finally:
+        visualizer.close()
+
+# 전역 진행 이벤트 로그 (None이면 시각화 비활성화)
+progress_log = None
+DEFAULT_PROGRESS_LOG_PATH = "gem_calculation_progress.bin"
+
+# 마지막 진행 출력 이후의 메모이제이션 히트 수
+memo_hit_count = 0
 
 def create_generalized_gem_pattern(gem: GemState) -> str:
     """젬 상태를 일반화된 패턴으로 변환 (효과적인 메모이제이션을 위해)"""
@@ -682,6 +775,49 @@ def create_generalized_gem_pattern(gem: GemState) -> str:
     
     return f"{gem.willpower},{gem.corePoint},{effect1},{effect2},{has_attempts},{gem.costModifier}"
 
+# 효과 옵션 슬롯 (일반화 패턴의 effect1~4는 이 슬롯들을 레벨 내림차순으로 다시 배치한 것)
+EFFECT_OPTION_NAMES = ('dealerA', 'dealerB', 'supportA', 'supportB')
+
+def effect_slot_order(gem: GemState) -> Tuple[int, ...]:
+    """레벨 내림차순 효과 슬롯 순서 (동률이면 dealerA, dealerB, supportA, supportB 순) -> effect1~4"""
+    levels = (gem.dealerA, gem.dealerB, gem.supportA, gem.supportB)
+    return tuple(sorted(range(4), key=lambda slot: -levels[slot]))
+
+def _effect_slot_normalization(slot_order: Tuple[int, ...]) -> np.ndarray:
+    """옵션 ID -> 정규화 옵션 ID 배열 (effect k 자리의 슬롯 액션을 EFFECT_OPTION_NAMES[k-1] 액션 ID로)"""
+    normalization = np.arange(len(OPTION_ACTIONS), dtype=np.intp)
+    for rank, slot in enumerate(slot_order):
+        for option_id, action in enumerate(OPTION_ACTIONS):
+            name, _, suffix = action.partition('_')
+            if name == EFFECT_OPTION_NAMES[slot]:
+                normalization[option_id] = OPTION_IDS[f"{EFFECT_OPTION_NAMES[rank]}_{suffix}"]
+    return normalization
+
+# 슬롯 순서(24가지) -> 정규화 배열. 패턴에 캐시된 조합은 정규화 옵션 ID로 저장하고 상태마다 색인만 바꾼다.
+EFFECT_SLOT_NORMALIZATIONS = {slot_order: _effect_slot_normalization(slot_order)
+                              for slot_order in permutations(range(4))}
+
+# 조합 안의 옵션 순서: 정규화 액션 이름(effect1_+1 등)의 사전순 (합산 순서를 기존 결과와 맞춤)
+def _normalized_option_sort_key(action: str) -> str:
+    name, separator, suffix = action.partition('_')
+    if name in EFFECT_OPTION_NAMES:
+        return f"effect{EFFECT_OPTION_NAMES.index(name) + 1}{separator}{suffix}"
+    return action
+
+NORMALIZED_OPTION_SORT_KEYS = [_normalized_option_sort_key(action) for action in OPTION_ACTIONS]
+
+def normalized_option_ids(gem: GemState, option_ids) -> np.ndarray:
+    """이 상태의 옵션 ID들을 일반화 패턴 기준의 정규화 옵션 ID로 변환"""
+    return EFFECT_SLOT_NORMALIZATIONS[effect_slot_order(gem)][option_ids]
+
+def pattern_combo_positions(gem: GemState, option_ids: List[int], pattern_option_ids: np.ndarray,
+                            combo_indices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """패턴의 (정규화 옵션 열, 조합 x 4 열 인덱스) -> (열별 이 상태의 옵션 위치, 조합 x 4 옵션 위치)"""
+    positions = np.empty(len(OPTION_ACTIONS), dtype=np.intp)
+    positions[normalized_option_ids(gem, option_ids)] = np.arange(len(option_ids))
+    column_positions = positions[pattern_option_ids]
+    return column_positions, column_positions[combo_indices]
+
 def state_to_key(gem: GemState) -> str:
     """젬 상태를 키 문자열로 변환 (4개 옵션 시스템, 리롤 횟수는 상한까지만)"""
     # 리롤 횟수는 상한 이상을 모두 상한으로 간주 (메모이제이션 효율성)
@@ -689,197 +825,620 @@ def state_to_key(gem: GemState) -> str:
     first_processing = 1 if gem.isFirstProcessing else 0
     return f"{gem.willpower},{gem.corePoint},{gem.dealerA},{gem.dealerB},{gem.supportA},{gem.supportB},{gem.remainingAttempts},{capped_reroll},{gem.costModifier},{first_processing}"
 
+# costModifier(-100, 0, 100) <-> 상태 ID 내 2비트 인덱스
+COST_MODIFIER_TO_INDEX = {-100: 0, 0: 1, 100: 2}
+INDEX_TO_COST_MODIFIER = (-100, 0, 100)
+
+def state_to_id(gem: GemState, reroll_cap: int = None) -> int:
+    """젬 상태를 31비트 정수 ID로 변환 (state_to_key와 동일하게 리롤 횟수는 상한까지만)
+
+    비트 배치 (하위 비트부터): willpower 3, corePoint 3, dealerA 3, dealerB 3, supportA 3, supportB 3,
+    remainingAttempts 5, currentRerollAttempts 5, costModifier 인덱스 2, isFirstProcessing 1
+    """
+    capped_reroll = min(MAX_REROLL_FOR_MEMOIZATION if reroll_cap is None else reroll_cap, gem.currentRerollAttempts)
+    return (gem.willpower
+            | gem.corePoint << 3
+            | gem.dealerA << 6
+            | gem.dealerB << 9
+            | gem.supportA << 12
+            | gem.supportB << 15
+            | gem.remainingAttempts << 18
+            | capped_reroll << 23
+            | COST_MODIFIER_TO_INDEX[gem.costModifier] << 28
+            | int(gem.isFirstProcessing) << 30)
+
+# 상태 ID는 31비트이므로 최상위 비트가 켜진 값은 어떤 상태의 ID도 아님 (범위 밖 상태의 묶음 조회용)
+INVALID_STATE_ID = 1 << 31
+
+def state_fields_in_range(gem: GemState) -> bool:
+    """state_to_id가 다른 상태의 ID와 겹치지 않게 변환할 수 있는 젬 상태인지 (게임 범위와 필드별 비트 폭)"""
+    return (1 <= gem.willpower <= 5 and 1 <= gem.corePoint <= 5
+            and all(0 <= level <= 5 for level in (gem.dealerA, gem.dealerB, gem.supportA, gem.supportB))
+            and 0 <= gem.remainingAttempts <= 31 and gem.currentRerollAttempts >= 0
+            and gem.costModifier in COST_MODIFIER_TO_INDEX)
+
+def state_id_to_fields(state_id: int) -> Tuple[int, ...]:
+    """state_to_id의 역변환: GemState 필드 순서의 튜플 반환"""
+    return (state_id & 7,
+            state_id >> 3 & 7,
+            state_id >> 6 & 7,
+            state_id >> 9 & 7,
+            state_id >> 12 & 7,
+            state_id >> 15 & 7,
+            state_id >> 18 & 31,
+            state_id >> 23 & 31,
+            INDEX_TO_COST_MODIFIER[state_id >> 28 & 3],
+            state_id >> 30 & 1)
+
+
+def state_id_to_key(state_id: int) -> str:
+    """상태 ID를 state_to_key 형식의 키 문자열로 변환"""
+    return ','.join(map(str, state_id_to_fields(state_id)))
+
+def state_key_to_id(state_key: str) -> int:
+    """state_to_key 형식의 키 문자열을 상태 ID로 변환 (키의 리롤 횟수는 이미 상한이 적용된 값)"""
+    return int(state_ids_from_fields(*map(int, state_key.split(',')), reroll_cap=31))
+
+def state_ids_from_fields(willpower, corePoint, dealerA, dealerB, supportA, supportB,
+                          remainingAttempts, currentRerollAttempts, costModifier=0, isFirstProcessing=False,
+                          reroll_cap: int = None) -> np.ndarray:
+    """state_to_id의 배열 버전: 필드 배열(브로드캐스트 가능)을 uint32 상태 ID 배열로 묶음 변환
+
+    state_fields_in_range를 벗어난 상태는 다른 상태의 ID와 겹치지 않도록 INVALID_STATE_ID로 바꾼다
+    (어떤 테이블에도 없으므로 lookup_many에서 found=False).
+    """
+    fields = np.broadcast_arrays(*(np.asarray(field, dtype=np.int64) for field in (
+        willpower, corePoint, dealerA, dealerB, supportA, supportB,
+        remainingAttempts, currentRerollAttempts, costModifier, isFirstProcessing)))
+    (willpower, corePoint, dealerA, dealerB, supportA, supportB,
+     remainingAttempts, currentRerollAttempts, costModifier, isFirstProcessing) = fields
+    in_range = ((willpower >= 1) & (willpower <= 5) & (corePoint >= 1) & (corePoint <= 5)
+                & (remainingAttempts >= 0) & (remainingAttempts <= 31) & (currentRerollAttempts >= 0)
+                & ((costModifier == -100) | (costModifier == 0) | (costModifier == 100)))
+    for level in (dealerA, dealerB, supportA, supportB):
+        in_range &= (level >= 0) & (level <= 5)
+    capped_reroll = np.minimum(MAX_REROLL_FOR_MEMOIZATION if reroll_cap is None else reroll_cap, currentRerollAttempts)
+    state_ids = (willpower
+                 | corePoint << 3
+                 | dealerA << 6
+                 | dealerB << 9
+                 | supportA << 12
+                 | supportB << 15
+                 | remainingAttempts << 18
+                 | capped_reroll << 23
+                 | (costModifier // 100 + 1) << 28
+                 | (isFirstProcessing != 0) << 30)
+    return np.where(in_range, state_ids, INVALID_STATE_ID).astype(np.uint32)
+
+# 목표 정의: 젬 상태 필드에 대한 조건식 (and/or/not, 비교, +/-/*)
+# 새 목표는 여기에 한 줄 추가하거나 --targets-config JSON 파일로 지정한다.
+# column은 DB 컬럼명이며 생략하면 이름에서 자동 생성된다 (예: 'sum8+' -> prob_sum8)
+TARGET_DEFINITIONS = [
+    {'name': '5/5', 'column': 'prob_5_5', 'condition': 'willpower >= 5 and corePoint >= 5'},
+    {'name': '5/4', 'column': 'prob_5_4', 'condition': 'willpower >= 5 and corePoint >= 4'},
+    {'name': '4/5', 'column': 'prob_4_5', 'condition': 'willpower >= 4 and corePoint >= 5'},
+    {'name': '5/3', 'column': 'prob_5_3', 'condition': 'willpower >= 5 and corePoint >= 3'},
+    {'name': '4/4', 'column': 'prob_4_4', 'condition': 'willpower >= 4 and corePoint >= 4'},
+    {'name': '3/5', 'column': 'prob_3_5', 'condition': 'willpower >= 3 and corePoint >= 5'},
+    {'name': 'sum8+', 'column': 'prob_sum8', 'condition': 'willpower + corePoint >= 8'},
+    {'name': 'sum9+', 'column': 'prob_sum9', 'condition': 'willpower + corePoint >= 9'},
+    {'name': 'relic+', 'column': 'prob_relic',
+     'condition': 'willpower + corePoint + dealerA + dealerB + supportA + supportB >= 16'},
+    {'name': 'ancient+', 'column': 'prob_ancient',
+     'condition': 'willpower + corePoint + dealerA + dealerB + supportA + supportB >= 19'},
+    {'name': 'dealer_complete', 'column': 'prob_dealer_complete',
+     'condition': 'willpower + corePoint + dealerA + dealerB == 20'},
+    {'name': 'support_complete', 'column': 'prob_support_complete',
+     'condition': 'willpower + corePoint + supportA + supportB == 20'},
+]
+
+# 목표 조건식에서 사용할 수 있는 상태 필드와 그 값 범위
+TARGET_FIELDS = {
+    'willpower': range(1, 6),
+    'corePoint': range(1, 6),
+    'dealerA': range(0, 6),
+    'dealerB': range(0, 6),
+    'supportA': range(0, 6),
+    'supportB': range(0, 6),
+}
+
+_TARGET_CONDITION_NODES = (
+    ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub,
+    ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Compare, ast.Eq, ast.NotEq,
+    ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Name, ast.Load, ast.Constant
+)
+
+class _VectorizedConditionTransformer(ast.NodeTransformer):
+    """and/or/not과 연쇄 비교를 배열 연산(&, |, ==)으로 변환"""
+
+    @staticmethod
+    def _combine(values, op):
+        result = values[0]
+        for value in values[1:]:
+            result = ast.BinOp(left=result, op=op, right=value)
+        return result
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        op = ast.BitAnd() if isinstance(node.op, ast.And) else ast.BitOr()
+        # 정수 피연산자도 참/거짓으로 해석되도록 != 0 비교로 감싼다
+        values = [ast.Compare(left=value, ops=[ast.NotEq()], comparators=[ast.Constant(0)]) for value in node.values]
+        return self._combine(values, op)
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return ast.Compare(left=node.operand, ops=[ast.Eq()], comparators=[ast.Constant(0)])
+        return node
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        if len(node.ops) == 1:
+            return node
+        operands = [node.left] + node.comparators
+        pairs = [ast.Compare(left=operands[i], ops=[op], comparators=[operands[i + 1]])
+                 for i, op in enumerate(node.ops)]
+        return self._combine(pairs, ast.BitAnd())
+
+def compile_target_condition(condition: str):
+    """목표 조건식을 상태 필드 배열에 대해 벡터화된 함수로 컴파일"""
+    tree = ast.parse(condition, mode='eval')
+    for node in ast.walk(tree):
+        if not isinstance(node, _TARGET_CONDITION_NODES):
+            raise ValueError(f"목표 조건식에서 지원하지 않는 구문입니다: {type(node).__name__} ({condition})")
+        if isinstance(node, ast.Name) and node.id not in TARGET_FIELDS:
+            raise ValueError(f"목표 조건식에 알 수 없는 필드가 있습니다: {node.id} ({condition})")
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+            raise ValueError(f"목표 조건식에는 숫자 상수만 사용할 수 있습니다: {node.value!r} ({condition})")
+    
+    tree = ast.fix_missing_locations(_VectorizedConditionTransformer().visit(tree))
+    code = compile(tree, f'<target: {condition}>', 'eval')
+    return lambda fields: eval(code, {'__builtins__': {}}, fields)
+
+def build_target_table(definitions: List[Dict[str, str]]) -> np.ndarray:
+    """모든 (willpower, corePoint, dealerA, dealerB, supportA, supportB) 조합에 대한 목표 달성 여부 표
+
+    반환 배열의 모양은 (5, 5, 6, 6, 6, 6, 목표 수)이며 값은 1.0(달성) 또는 0.0
+    """
+    grids = np.meshgrid(*[np.array(values) for values in TARGET_FIELDS.values()], indexing='ij')
+    fields = dict(zip(TARGET_FIELDS, grids))
+    columns = []
+    for definition in definitions:
+        achieved = compile_target_condition(definition['condition'])(fields)
+        columns.append(np.broadcast_to(np.asarray(achieved, dtype=bool), grids[0].shape))
+    return np.stack(columns, axis=-1).astype(float)
+
+def set_target_definitions(definitions: List[Dict[str, str]]):
+    """목표 정의를 설정하고 목표 순서와 달성 여부 표를 다시 만든다 (생성 전에 호출)"""
+    global TARGET_DEFINITIONS, TARGETS, TARGET_INDEX, TARGET_TABLE
+    normalized = []
+    for definition in definitions:
+        name = definition['name']
+        column = definition.get('column') or 'prob_' + re.sub(r'[^0-9A-Za-z]+', '_', name).strip('_')
+        if not re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', column):
+            raise ValueError(f"잘못된 DB 컬럼명입니다: {column}")
+        normalized.append({'name': name, 'column': column, 'condition': definition['condition']})
+    
+    names = [definition['name'] for definition in normalized]
+    columns = [definition['column'] for definition in normalized]
+    if len(set(names)) != len(names) or len(set(columns)) != len(columns):
+        raise ValueError("목표 이름과 DB 컬럼명은 중복될 수 없습니다")
+    
+    TARGET_TABLE = build_target_table(normalized)
+    TARGET_REACH_TABLES.clear()
+    TARGET_DEFINITIONS = normalized
+    TARGETS = names
+    TARGET_INDEX = {target: i for i, target in enumerate(TARGETS)}
+
+def load_target_definitions(path: str) -> List[Dict[str, str]]:
+    """JSON 파일에서 목표 정의 목록을 읽는다 ([{"name": ..., "condition": ..., "column": ...}, ...])"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+# 목표 도달 가능 여부 표 (분석적 상한): TARGET_REACH_TABLES[n]은 가공 n회 이내에 목표를 달성할 수 있는
+# 칸이면 True인 TARGET_TABLE 모양의 bool 표. 옵션 등장 확률은 무시하고 가능한 전이만 따지므로 낙관적이다.
+TARGET_REACH_TABLES: List[np.ndarray] = []
+_target_reach_edges = None  # 가공 한 번의 (출발 칸, 도착 칸) 평탄화 색인 배열 (목표와 무관)
+_target_reach_lock = threading.Lock()
+
+# 목표 순서 (메모이제이션 레코드 배열의 고정 순서)와 목표 달성 여부 표
+TARGETS: List[str] = []
+TARGET_INDEX: Dict[str, int] = {}
+TARGET_TABLE: np.ndarray = np.zeros(0)
+set_target_definitions(TARGET_DEFINITIONS)
+
+def target_achievement_vector(gem: GemState) -> np.ndarray:
+    """TARGETS 순서로 각 목표 달성 여부를 1.0/0.0 배열로 반환"""
+    return TARGET_TABLE[gem.willpower - 1, gem.corePoint - 1, gem.dealerA, gem.dealerB, gem.supportA, gem.supportB]
+
+def target_reach_edges() -> Tuple[np.ndarray, np.ndarray]:
+    """유효한 (willpower, corePoint, 효과 4개) 칸마다 가공 한 번으로 갈 수 있는 칸들 (평탄화 색인)
+
+    사용 가능한 옵션 조건은 이 6개 필드에만 의존하므로 남은 횟수/리롤/비용은 임의 값으로 둔다.
+    옵션 변경은 apply_processing_outcomes로 가능한 결과를 모두 포함한다.
+    """
+    global _target_reach_edges
+    if _target_reach_edges is None:
+        grid_shape = TARGET_TABLE.shape[:-1]
+        sources, destinations = [], []
+        for cell in np.ndindex(grid_shape):
+            willpower, corePoint, dealerA, dealerB, supportA, supportB = cell[0] + 1, cell[1] + 1, *cell[2:]
+            if sum(1 for level in (dealerA, dealerB, supportA, supportB) if level > 0) != 2:
+                continue
+            gem = GemState(willpower, corePoint, dealerA, dealerB, supportA, supportB, 2, 0, 0, False)
+            source = np.ravel_multi_index(cell, grid_shape)
+            for option in get_available_options(gem):
+                for next_gem in apply_processing_outcomes(gem, option['action']):
+                    sources.append(source)
+                    destinations.append(np.ravel_multi_index(
+                        (next_gem.willpower - 1, next_gem.corePoint - 1, next_gem.dealerA, next_gem.dealerB,
+                         next_gem.supportA, next_gem.supportB), grid_shape))
+        _target_reach_edges = (np.array(sources, dtype=np.intp), np.array(destinations, dtype=np.intp))
+    return _target_reach_edges
+
+def target_reach_table(remaining_attempts: int) -> np.ndarray:
+    """TARGET_REACH_TABLES[remaining_attempts] (필요한 만큼 지연 생성, 스레드 안전)"""
+    if remaining_attempts < len(TARGET_REACH_TABLES):
+        return TARGET_REACH_TABLES[remaining_attempts]
+    with _target_reach_lock:
+        sources, destinations = target_reach_edges()
+        target_count = TARGET_TABLE.shape[-1]
+        if not TARGET_REACH_TABLES:
+            TARGET_REACH_TABLES.append(TARGET_TABLE > 0)
+        while len(TARGET_REACH_TABLES) <= remaining_attempts:
+            # n회 이내 도달 = 지금 달성 또는 가공 한 번 후 (n-1)회 이내 도달
+            previous = TARGET_REACH_TABLES[-1].reshape(-1, target_count)
+            reach = previous.copy()
+            np.logical_or.at(reach, sources, previous[destinations])
+            TARGET_REACH_TABLES.append(reach.reshape(TARGET_TABLE.shape))
+    return TARGET_REACH_TABLES[remaining_attempts]
+
+def target_probability_bounds(gem: GemState) -> Tuple[np.ndarray, np.ndarray]:
+    """목표별 최종 달성 확률의 (하한, 상한)
+
+    이미 달성한 목표는 언제든 중단할 수 있으므로 하한 1, 남은 가공 횟수로 달성할 수 있는 칸이 없으면 상한 0이다.
+    하한과 상한이 같은 목표는 조합을 순회하지 않아도 값이 정해진다.
+    """
+    lower = target_achievement_vector(gem)
+    reach = target_reach_table(gem.remainingAttempts)
+    upper = reach[gem.willpower - 1, gem.corePoint - 1, gem.dealerA, gem.dealerB, gem.supportA, gem.supportB]
+    return lower, upper.astype(float)
+
 def check_target_conditions(gem: GemState) -> Dict[str, bool]:
     """현재 젬 상태에서 각 목표 달성 여부 확인"""
-    return {
-        '5/5': gem.willpower >= 5 and gem.corePoint >= 5,
-        '5/4': gem.willpower >= 5 and gem.corePoint >= 4,
-        '4/5': gem.willpower >= 4 and gem.corePoint >= 5,
-        '5/3': gem.willpower >= 5 and gem.corePoint >= 3,
-        '4/4': gem.willpower >= 4 and gem.corePoint >= 4,
-        '3/5': gem.willpower >= 3 and gem.corePoint >= 5,
-        'sum8+': (gem.willpower + gem.corePoint) >= 8,
-        'sum9+': (gem.willpower + gem.corePoint) >= 9,
-        'relic+': (gem.willpower + gem.corePoint + gem.dealerA + gem.dealerB + gem.supportA + gem.supportB) >= 16,
-        'ancient+': (gem.willpower + gem.corePoint + gem.dealerA + gem.dealerB + gem.supportA + gem.supportB) >= 19,
-        'dealer_complete': (gem.willpower + gem.corePoint + gem.dealerA + gem.dealerB) == 20,
-        'support_complete': (gem.willpower + gem.corePoint + gem.supportA + gem.supportB) == 20
-    }
+    return {target: achieved > 0 for target, achieved in zip(TARGETS, target_achievement_vector(gem).tolist())}
+
+# 퍼센타일 격자 (%) - 생성 전에 set_percentile_grid로 변경 가능 (예: 5% 또는 1% 간격)
+PERCENTILE_GRID = [10, 20, 30, 40, 50, 60, 70, 80, 90]
+
+def set_percentile_grid(step: int):
+    """퍼센타일 격자를 step% 간격으로 설정 (step=10이면 10, 20, ..., 90)"""
+    global PERCENTILE_GRID
+    if step <= 0 or 100 % step != 0:
+        raise ValueError(f"퍼센타일 간격은 100의 약수여야 합니다: {step}")
+    PERCENTILE_GRID = list(range(step, 100, step))
+
+class StateRecord:
+    """메모이제이션 레코드 (상태 하나당 float 배열 1개 + 옵션 ID 바이트열)
+
+    values: [확률 T개 | 기대 비용 T개 | 퍼센타일 T*P개 | 옵션별 선택 확률 | (비용 효율 정책 확률 T개 | 기대 비용 T개)]
+    (T = len(TARGETS), P = len(PERCENTILE_GRID), 비용 효율 정책 블록은 COST_OBJECTIVE_SUCCESS_VALUE가 있을 때만)
+    option_ids: 사용 가능한 옵션들의 OPTION_ACTIONS 인덱스
+    기존 dict 형태는 to_dict()로 내보낼 때만 만든다.
+    """
+    __slots__ = ('values', 'option_ids')
+
+    def __init__(self, probabilities: np.ndarray, expected_costs: np.ndarray, percentiles: np.ndarray,
+                 option_ids: List[int], selection_probs: np.ndarray, cost_policy: Tuple[np.ndarray, np.ndarray] = ()):
+        self.values = np.concatenate((probabilities, expected_costs, np.ravel(percentiles), selection_probs, *cost_policy))
+        self.option_ids = bytes(option_ids)
+
+    @property
+    def probabilities(self) -> np.ndarray:
+        return self.values[:len(TARGETS)]
+
+    @property
+    def expected_costs(self) -> np.ndarray:
+        return self.values[len(TARGETS):2 * len(TARGETS)]
+
+    @property
+    def percentiles(self) -> np.ndarray:
+        start = 2 * len(TARGETS)
+        return self.values[start:start + len(TARGETS) * len(PERCENTILE_GRID)].reshape(len(TARGETS), len(PERCENTILE_GRID))
+
+    @property
+    def selection_probs(self) -> np.ndarray:
+        start = len(TARGETS) * (2 + len(PERCENTILE_GRID))
+        return self.values[start:start + len(self.option_ids)]
+
+    @property
+    def has_cost_policy(self) -> bool:
+        return len(self.values) > len(TARGETS) * (2 + len(PERCENTILE_GRID)) + len(self.option_ids)
 
-def calculate_combo_probabilities_for_gem(gem: GemState, available_options: List[Dict], combo_memo: Dict[str, Dict]) -> Dict:
-    """현재 젬 상태에 대한 4combo 확률 계산 및 메모이제이션"""
+    @property
+    def cost_policy_probabilities(self) -> np.ndarray:
+        """비용 효율 정책을 따를 때의 목표 확률"""
+        return self.values[len(self.values) - 2 * len(TARGETS):len(self.values) - len(TARGETS)]
+
+    @property
+    def cost_policy_expected_costs(self) -> np.ndarray:
+        """비용 효율 정책을 따를 때의 기대 비용"""
+        return self.values[len(self.values) - len(TARGETS):]
+
+    def value_blocks(self) -> List[Tuple[str, int, int]]:
+        """values의 구간 목록 [(종류, 시작, 끝), ...] (종류: probability, cost, percentile, selection)"""
+        target_count = len(TARGETS)
+        percentile_end = target_count * (2 + len(PERCENTILE_GRID))
+        blocks = [('probability', 0, target_count),
+                  ('cost', target_count, 2 * target_count),
+                  ('percentile', 2 * target_count, percentile_end),
+                  ('selection', percentile_end, percentile_end + len(self.option_ids))]
+        if self.has_cost_policy:
+            blocks += [('probability', len(self.values) - 2 * target_count, len(self.values) - target_count),
+                       ('cost', len(self.values) - target_count, len(self.values))]
+        return blocks
+
+    def quantized(self, precision: str, report: 'QuantizationReport' = None) -> 'StateRecord':
+        """내보내기 정밀도로 양자화한 값을 가진 복사본 (report가 있으면 목표별 최대 절대 오차 누적)"""
+        cost_mask = np.zeros(len(self.values), dtype=bool)
+        for kind, start, stop in self.value_blocks():
+            cost_mask[start:stop] = kind == 'cost'
+        _, written = quantize_values(self.values, precision, cost_mask)
+        if report is not None:
+            errors = np.abs(written - self.values)
+            selection_start = len(TARGETS) * (2 + len(PERCENTILE_GRID))
+            selection_stop = selection_start + len(self.option_ids)
+            report.update_values(np.concatenate((errors[:selection_start], errors[selection_stop:]))[None],
+                                 self.has_cost_policy)
+            report.update_selection(errors[selection_start:selection_stop])
+        record = StateRecord.__new__(StateRecord)
+        record.values = written
+        record.option_ids = self.option_ids
+        return record
+
+    def to_dict(self) -> Dict[str, Any]:
+        """기존 memo 형태의 dict로 변환 (JSON/DB 내보내기용)"""
+        available_options = []
+        for option_id, selection_prob in zip(self.option_ids, self.selection_probs.tolist()):
+            action = OPTION_ACTIONS[option_id]
+            available_options.append({
+                'action': action,
+                'probability': PROCESSING_POSSIBILITIES[action]['probability'],
+                'description': OPTION_DESCRIPTIONS.get(action, action),
+                'selectionProbability': selection_prob
+            })
+        state_data = {
+            'probabilities': dict(zip(TARGETS, self.probabilities.tolist())),
+            'availableOptions': available_options,
+            'percentiles': {target: dict(zip(PERCENTILE_GRID, row))
+                            for target, row in zip(TARGETS, self.percentiles.tolist())},
+            'expectedCosts': dict(zip(TARGETS, self.expected_costs.tolist()))
+        }
+        if self.has_cost_policy:
+            state_data['costOptimal'] = {
+                'probabilities': dict(zip(TARGETS, self.cost_policy_probabilities.tolist())),
+                'expectedCosts': dict(zip(TARGETS, self.cost_policy_expected_costs.tolist()))
+            }
+        return state_data
+
+def calculate_combo_probabilities_for_gem(gem: GemState, available_options: List[Dict],
+                                          combo_memo: Dict[str, Tuple]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """현재 젬 상태에 대한 4combo 확률 계산 및 메모이제이션
+
+    반환값: (정규화 옵션 ID 열, 조합 x 4 열 인덱스, 조합 확률, 열별 선택 확률). 조합 순서는 패턴을 처음 계산한
+    상태의 combinations 순서이고, 조합 안의 옵션은 정규화 액션 이름순이다. 상태별 옵션 위치는 pattern_combo_positions로 구한다.
+    """
     generalized_gem_pattern = create_generalized_gem_pattern(gem)
-    
-    # 조합 확률들 계산 또는 캐시에서 가져오기
-    combo_probs = {}
     if generalized_gem_pattern in combo_memo:
         # 캐시된 조합 확률들 사용
         return combo_memo[generalized_gem_pattern]
     
-    # dealer/support를 effect로 매핑하기 위한 준비
-    effect_mapping = {}
-    effect_idx = 1
-    
-    # 레벨 높은 순서로 effect 번호 할당
-    for name, level in sorted(
-        [('dealerA', gem.dealerA), ('dealerB', gem.dealerB), 
-         ('supportA', gem.supportA), ('supportB', gem.supportB)],
-        key=lambda x: -x[1]  # 레벨 내림차순
-    ):
-        if level > 0:
-            effect_mapping[name] = f'effect{effect_idx}'
-            effect_idx += 1
-    
-    # 새로운 젬 패턴 - 모든 4개 조합 확률 미리 계산
-    for combo_indices in combinations(range(len(available_options)), 4):
-        combo_prob = calculate_4combo_probability(
-            list(combo_indices), 
-            [opt['probability'] for opt in available_options]
-        )
-        
-        # 액션 이름을 정규화 (dealerA -> effect1 등)
-        normalized_actions = []
-        for i in combo_indices:
-            action = available_options[i]['action']
-            # dealerA_+1 -> effect1_+1 형태로 변환
-            for original, normalized in effect_mapping.items():
-                action = action.replace(original, normalized)
-            normalized_actions.append(action)
-        
-        combo_actions = tuple(sorted(normalized_actions))
-        combo_probs[combo_actions] = combo_prob
-    
-    # 조합 확률들을 메모이제이션에 저장
-    combo_memo[generalized_gem_pattern] = combo_probs
-    return combo_probs
-
-def calculate_percentiles_from_combo_data(target_combo_data: Dict[str, List]) -> Dict[str, Dict]:
-    """combo 데이터로부터 퍼센타일 계산"""
-    target_percentiles = {}
-    for target, combo_data in target_combo_data.items():
-        if not combo_data:
-            target_percentiles[target] = {10: 0.0, 20: 0.0, 30: 0.0, 40: 0.0, 50: 0.0, 
-                                         60: 0.0, 70: 0.0, 80: 0.0, 90: 0.0}
-            continue
-            
-        # combo_progress_value 기준으로 내림차순 정렬
-        sorted_combos = sorted(combo_data, key=lambda x: x[0], reverse=True)
-        
-        # 퍼센타일 계산 (10%, 20%, ..., 90%)
-        cumulative = 0.0
-        percentile_values = {}
-        percentile_thresholds = [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9]
-        threshold_idx = 0
-        
-        for combo_value, combo_prob in sorted_combos:
-            cumulative += combo_prob
-            
-            # 현재 누적확률이 다음 threshold를 넘었는지 확인
-            while threshold_idx < len(percentile_thresholds) and cumulative >= percentile_thresholds[threshold_idx]:
-                percentile_values[int(percentile_thresholds[threshold_idx] * 100)] = combo_value
-                threshold_idx += 1
-            
-            if threshold_idx >= len(percentile_thresholds):
-                break
-        
-        # 남은 percentile들은 마지막 값으로 채움
-        last_value = sorted_combos[-1][0] if sorted_combos else 0.0
-        for i in range(threshold_idx, len(percentile_thresholds)):
-            percentile_values[int(percentile_thresholds[i] * 100)] = last_value
-        
-        target_percentiles[target] = percentile_values
-    
-    return target_percentiles
+    # 레벨 높은 순서로 effect 번호를 매긴 정규화 옵션 ID
+    pattern_option_ids = normalized_option_ids(gem, [OPTION_IDS[opt['action']] for opt in available_options])
+    sort_keys = [NORMALIZED_OPTION_SORT_KEYS[option_id] for option_id in pattern_option_ids]
+    weights = [opt['probability'] for opt in available_options]
+    total_weight = sum(weights)
+    
+    # 새로운 젬 패턴 - 모든 4개 조합 확률 미리 계산 (같은 가중치 시그니처의 조합은 캐시에서)
+    combo_indices = []
+    combo_probs = []
+    for combo in combinations(range(len(available_options)), 4):
+        combo_probs.append(cached_4combo_probability(combo, weights, total_weight))
+        combo_indices.append(sorted(combo, key=sort_keys.__getitem__))
+    
+    combo_indices = np.array(combo_indices, dtype=np.intp).reshape(-1, 4)
+    combo_probs = np.array(combo_probs)
+    
+    # 조합 확률들을 메모이제이션에 저장 (선택 확률은 조합 확률에 대한 고정 선형 사상이므로 패턴마다 한 번만 계산)
+    # 스레드 엔진에서 같은 패턴을 동시에 계산해도 먼저 넣은 항목 하나만 쓰이도록 setdefault 사용
+    return combo_memo.setdefault(generalized_gem_pattern, (
+        pattern_option_ids, combo_indices, combo_probs,
+        combo_incidence_matrix(combo_indices, len(pattern_option_ids)) @ combo_probs))
 
-def calculate_probabilities(gem: GemState, memo: Dict[str, Dict], combo_memo: Dict[str, Dict]) -> Dict[str, float]:
-    """재귀적으로 확률을 계산. 매우 중요: 여기서의 확률은 아직 옵션 4개를 보지 못한 상태임"""
-    global calculation_counter, visualizer
-    
-    key = state_to_key(gem)
-    if key in memo:
-        # 메모이제이션 히트 - 버퍼에 저장 (배치 처리용)
-        global memo_hit_buffer
-        memo_hit_buffer.add(key)
-        return memo[key]
-    
-    # 목표 조건들 확인
-    targets = check_target_conditions(gem)
+def combo_incidence_matrix(combo_indices: np.ndarray, column_count: int) -> np.ndarray:
+    """(패턴 옵션 열 x 조합) 선택 행렬: 조합에 열이 있으면 0.25 (4개 중 균등 선택)
+
+    조합 확률 벡터(또는 조합 x 구성 행렬)에 곱하면 열별 선택 확률(selectionProbability)이 된다.
+    """
+    incidence = np.zeros((column_count, len(combo_indices)))
+    incidence[combo_indices.T, np.arange(len(combo_indices))] = 0.25
+    return incidence
+
+# 조합 확률의 가중치 미분 캐시 (민감도 분석 모드): 일반화 패턴 -> 조합 x 패턴 옵션 열 미분 행렬
+combo_gradient_memo = {}
+
+def calculate_combo_gradients_for_gem(gem: GemState, pattern_option_ids: np.ndarray, combo_indices: np.ndarray) -> np.ndarray:
+    """combo_memo 순서의 각 조합 확률을 패턴 옵션 열의 가중치로 미분 (패턴별 메모이제이션)"""
+    generalized_gem_pattern = create_generalized_gem_pattern(gem)
+    if generalized_gem_pattern in combo_gradient_memo:
+        return combo_gradient_memo[generalized_gem_pattern]
     
-    # 현재 상태에서 각 목표 달성 여부를 기본값으로 설정
-    # (이미 달성한 목표는 확률 1.0으로 시작)
-    base_probabilities = {}
-    for target, achieved in targets.items():
-        base_probabilities[target] = 1.0 if achieved else 0.0
+    # 정규화 옵션의 가중치 (슬롯별 가중치는 같다고 가정)
+    weights = [PROCESSING_POSSIBILITIES[OPTION_ACTIONS[option_id]]['probability'] for option_id in pattern_option_ids]
+    combo_gradients = np.zeros((len(combo_indices), len(weights)))
+    for combo_idx, combo in enumerate(combo_indices.tolist()):
+        combo_gradients[combo_idx] = calculate_4combo_probability_gradient(combo, weights)
     
-    # 사용 가능한 옵션들 가져오기 (설명도 포함)
-    available_options = get_available_options(gem)
+    return combo_gradient_memo.setdefault(generalized_gem_pattern, combo_gradients)
+
+def calculate_percentiles_from_combo_data(combo_values: np.ndarray, combo_weights: np.ndarray,
+                                          columns: np.ndarray = None) -> np.ndarray:
+    """combo 데이터(조합 x 목표 진행 확률, 조합 확률)로부터 퍼센타일 계산 -> (목표 x 퍼센타일) 배열
+
+    모든 목표를 한 번에 내림차순 정렬한 뒤 누적 확률에서 PERCENTILE_GRID 위치를 searchsorted로 찾는다.
+    누적 확률이 끝까지 도달하지 못한 퍼센타일은 가장 작은 값으로 채운다.
+    columns를 주면 그 목표 열만 계산하고 나머지는 0으로 둔다 (진행 확률이 모두 0인 도달 불가 목표용).
+    """
+    target_count = combo_values.shape[1]
+    target_percentiles = np.zeros((target_count, len(PERCENTILE_GRID)))
+    if len(combo_weights) == 0:
+        return target_percentiles
+    if columns is None:
+        columns = np.arange(target_count)
+    
+    # combo_progress_value 기준으로 내림차순 정렬 (동률은 원래 순서 유지)
+    column_values = combo_values[:, columns]
+    order = np.argsort(-column_values, axis=0, kind='stable')
+    sorted_values = np.take_along_axis(column_values, order, axis=0)
+    cumulative = np.cumsum(combo_weights[order], axis=0)
+    
+    # 누적확률이 각 threshold 이상이 되는 첫 위치
+    thresholds = np.asarray(PERCENTILE_GRID) / 100
+    last_idx = len(combo_weights) - 1
+    for column_idx, target_idx in enumerate(columns.tolist()):
+        positions = np.searchsorted(cumulative[:, column_idx], thresholds, side='left')
+        target_percentiles[target_idx] = sorted_values[np.minimum(positions, last_idx), column_idx]
     
-    # 기저 조건: 남은 시도 횟수가 0 또는 사용 가능한 옵션이 없음
+    return target_percentiles
+
+# 조합별 최적 선택 코드 (2비트)
+DECISION_STOP = 0
+DECISION_PROGRESS = 1
+DECISION_REROLL = 2
+DECISION_NAMES = ('stop', 'progress', 'reroll')
+
+# 조합별 최적 선택 기록 (None이면 기록하지 않음): 상태 ID -> (옵션 수, 압축된 2비트 배열)
+decision_store = None
+
+# 비용 효율 목표 (None이면 계산하지 않음): 목표 달성 1회의 가치(골드).
+# 조합마다 (가치 * 달성 확률 - 기대 비용)이 가장 큰 선택을 하는 두 번째 정책의 확률과 기대 비용을 같은 순회에서 계산한다.
+# 가치가 클수록 확률 최대화 정책에 가까워지고, 작을수록 골드를 아끼는 쪽으로 일찍 중단한다.
+COST_OBJECTIVE_SUCCESS_VALUE = None
+
+# 가중치 민감도 기록 (None이면 계산하지 않음): 상태 ID -> (목표 x OPTION_ACTIONS) float32 미분 배열
+# 최적 선택(정책)은 고정된 것으로 보고 순방향 미분한다: 조합 확률의 미분 + 선택된 다음 상태 미분의 가중합
+sensitivity_store = None
+
+# 근사 생성 (None이면 정확 계산): 상태마다 확률 큰 조합부터 순회하다가 남은 조합 질량이 이 값보다 작아지면 멈춘다.
+# 생략한 조합의 값은 [0, 1]이므로 목표 확률은 최대 (생략 질량 + 후속 상태 오차 상한)만큼 작게 나온다 (기대 비용은 상한 없음).
+APPROXIMATION_EPSILON = None
+
+# 근사 오차 상한 기록 (None이면 기록하지 않음): 상태 ID -> 목표 확률 절대 오차 상한
+approximation_error_store = None
+
+# 근사 모드의 패턴별 순회 조합 캐시: (일반화 패턴, 엡실론) -> (남길 조합 색인 오름차순, 생략 질량)
+approximate_combo_memo = {}
+
+def approximate_combo_selection(gem: GemState, combo_probs: np.ndarray) -> Tuple[np.ndarray, float]:
+    """확률 내림차순으로 남은 질량이 APPROXIMATION_EPSILON 미만이 될 때까지의 조합 (원래 순서의 색인, 생략 질량)"""
+    memo_key = (create_generalized_gem_pattern(gem), APPROXIMATION_EPSILON)
+    cached = approximate_combo_memo.get(memo_key)
+    if cached is not None:
+        return cached
+    
+    order = np.argsort(-combo_probs, kind='stable')
+    cumulative = np.cumsum(combo_probs[order])
+    total = cumulative[-1]
+    kept_count = min(len(order), int(np.searchsorted(cumulative, total - APPROXIMATION_EPSILON, side='right')) + 1)
+    omitted_mass = max(0.0, float(total - cumulative[kept_count - 1]))
+    return approximate_combo_memo.setdefault(memo_key, (np.sort(order[:kept_count]), omitted_mass))
+
+def evaluate_combo_choices(positions: np.ndarray, combo_probs: np.ndarray, option_values: np.ndarray,
+                           option_costs: np.ndarray, processing_cost: float, stop_values: np.ndarray,
+                           reroll_choice: Tuple[np.ndarray, np.ndarray] = None,
+                           objective: float = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """조합별 최적 선택(중단, 진행, 리롤)을 (선택 x 조합 x 목표) 배열로 한 번에 계산
+
+    compute_state_record의 조합 순회와 같은 계산이다. option_values/option_costs는 옵션 위치별 후속 상태 값,
+    reroll_choice는 (리롤 확률, 리롤 비용) 또는 None. objective가 있으면 (가치 * 확률 - 비용)이 가장 큰
+    선택(비용 효율 정책), 없으면 확률이 가장 큰 선택이며 동률이면 앞선 선택이다.
+    반환값: (조합 확률 가중 목표 확률, 조합 확률 가중 기대 비용, 조합 x 목표 진행 확률)
+    """
+    progress_values = np.zeros((len(positions), option_values.shape[1]))
+    progress_costs = np.full(progress_values.shape, processing_cost)
+    for column in range(4):
+        progress_values += option_values[positions[:, column]] * 0.25
+        progress_costs += option_costs[positions[:, column]] * 0.25
+    np.minimum(1.0, progress_values, out=progress_values)
+    
+    choice_values = [stop_values, progress_values]
+    choice_costs = [np.zeros_like(stop_values), progress_costs]
+    if reroll_choice is not None:
+        choice_values.append(reroll_choice[0])
+        choice_costs.append(reroll_choice[1])
+    stacked_values = np.stack(np.broadcast_arrays(*choice_values))
+    stacked_costs = np.stack(np.broadcast_arrays(*choice_costs))
+    scores = stacked_values if objective is None else objective * stacked_values - stacked_costs
+    best_idx = scores.argmax(axis=0)[None]
+    best_values = np.take_along_axis(stacked_values, best_idx, axis=0)[0]
+    best_costs = np.take_along_axis(stacked_costs, best_idx, axis=0)[0]
+    return combo_probs @ best_values, combo_probs @ best_costs, progress_values
+
+def combination_rank(positions: List[int], option_count: int) -> int:
+    """정렬된 옵션 위치 4개가 combinations(range(option_count), 4) 순서에서 몇 번째인지 반환"""
+    k = len(positions)
+    return comb(option_count, k) - 1 - sum(comb(option_count - 1 - position, k - i)
+                                           for i, position in enumerate(positions))
+
+def pack_decisions(decisions: np.ndarray) -> bytes:
+    """(조합 x 목표) 선택 코드 배열을 바이트당 4개씩 2비트로 묶고 zlib으로 압축"""
+    flat = decisions.ravel()
+    flat = np.concatenate((flat, np.zeros(-len(flat) % 4, dtype=np.uint8)))
+    packed = flat[0::4] | flat[1::4] << 2 | flat[2::4] << 4 | flat[3::4] << 6
+    return zlib.compress(packed.tobytes())
+
+# 진행 상황 출력에 표시할 목표와 약칭
+PROGRESS_PRINT_TARGETS = {
+    'sum8+': '8+',
+    'sum9+': '9+',
+    'relic+': 'r+',
+    'ancient+': 'a+',
+    'dealer_complete': 'd_comp',
+    'support_complete': 's_comp'
+}
+
+# 상태 하나 계산될 때마다 진행 상황을 출력할지 여부 (질의 시점 평가에서는 끔)
+PRINT_CALCULATION_PROGRESS = True
+
+def print_calculation_progress(label: str, gem: GemState, probabilities: np.ndarray,
+                               available_count: int, combo_memo: Dict[str, Dict]):
+    """상태 하나의 계산 완료 시 진행 상황 출력"""
+    if not PRINT_CALCULATION_PROGRESS:
+        return
+    total_combo_count = sum(len(combo_probs) for _, _, combo_probs, _ in combo_memo.values())
+    elapsed_time = time.time() - start_time if start_time else 0
+    avg_time_per_state = elapsed_time / calculation_counter if calculation_counter > 0 else 0
+    combo_4_count = comb(available_count, 4) if available_count >= 4 else 0
+    target_summary = ''.join(f"{label_short}: {probabilities[TARGET_INDEX[target]]:.6f}, "
+                             for target, label_short in PROGRESS_PRINT_TARGETS.items() if target in TARGET_INDEX)
+    print(f"{label}: {calculation_counter:>5d}개 상태 ({state_to_key(gem)}) "
+          f"{target_summary}"
+          f"memo_hit: {memo_hit_count:2d}개, combo_memo: {len(combo_memo)}패턴/{total_combo_count}조합, "
+          f"options: {available_count}개, 4조합: {combo_4_count}개, "
+          f"경과시간: {elapsed_time:.2f}s, 평균: {avg_time_per_state * 1000:.3f}s/1000 상태")
+
+def state_successors(gem: GemState, available_options: List[Dict]) -> Tuple[GemState, List[GemState]]:
+    """상태 하나의 계산에 필요한 후속 상태: (리롤 후 상태 또는 None, available_options 순서의 가공 후 상태들)
+
+    기저 조건(남은 시도 횟수 0 또는 사용 가능한 옵션 없음)이면 (None, [])이다.
+    옵션 변경은 apply_processing과 같이 결과 하나만 뽑는다.
+    """
     if gem.remainingAttempts == 0 or not available_options:
-        # 기저 조건에서는 퍼센타일이 모두 현재 확률과 동일
-        base_percentiles = {}
-        for target in targets:
-            base_prob = base_probabilities[target]
-            # 10%, 20%, ..., 90% 모두 동일한 값
-            base_percentiles[target] = {10: base_prob, 20: base_prob, 30: base_prob, 
-                                        40: base_prob, 50: base_prob, 60: base_prob,
-                                        70: base_prob, 80: base_prob, 90: base_prob}
-        
-        # Terminal 상태에서는 모든 목표의 기대 비용이 0
-        terminal_expected_costs = {}
-        for target in targets:
-            terminal_expected_costs[target] = 0.0
-        
-        memo[key] = {
-            'probabilities': base_probabilities,
-            'availableOptions': available_options,
-            'percentiles': base_percentiles,
-            'expectedCosts': terminal_expected_costs
-        }
-        # 새로운 계산 완료 시 진행 상황 출력
-        calculation_counter += 1
-        
-        # 버퍼에 쌓인 메모 히트들을 일괄 처리
-        memo_hit_count = flush_memo_hits_to_visualization()
-        
-        available_options = get_available_options(gem)
-        total_combo_count = sum(len(combos) for combos in combo_memo.values())
-        elapsed_time = time.time() - start_time if start_time else 0
-        avg_time_per_state = elapsed_time / calculation_counter if calculation_counter > 0 else 0
-        available_count = len(available_options)
-        combo_4_count = comb(available_count, 4) if available_count >= 4 else 0
-        print(f"기저 조건: {calculation_counter:>5d}개 상태 ({key}) "
-              f"8+: {base_probabilities['sum8+']:.6f}, 9+: {base_probabilities['sum9+']:.6f}, "
-              f"r+: {base_probabilities['relic+']:.6f}, a+: {base_probabilities['ancient+']:.6f}, "
-              f"d_comp: {base_probabilities['dealer_complete']:.6f}, s_comp: {base_probabilities['support_complete']:.6f}, "
-              f"memo_hit: {memo_hit_count:2d}개, combo_memo: {len(combo_memo)}패턴/{total_combo_count}조합, "
-              f"options: {available_count}개, 4조합: {combo_4_count}개, "
-              f"경과시간: {elapsed_time:.2f}s, 평균: {avg_time_per_state * 1000:.3f}s/1000 상태")
-        
-        # 시각화 업데이트 (기저 조건 계산 완료 시)
-        update_visualization_progress(key, is_memo_hit=False)
-        
-        if visualizer:
-            visualizer.refresh_display()
-            
-        # 중간 영상 저장 (1만개마다)
-        if calculation_counter % 10000 == 0 and visualizer:
-            visualizer.save_current_video(f"checkpoint_{calculation_counter}")
-        
-        return memo[key]
-    
-    # 실제 게임 로직: 4개 조합을 뽑고 그 중 하나를 25% 확률로 선택
-    probabilities = {target: 0.0 for target in targets}
-    expected_costs = {target: 0.0 for target in targets}
+        return None, []
     
     # reroll이 가능한지 확인 (첫 시도에서는 불가능)
-    can_reroll = gem.currentRerollAttempts > 0 and gem.remainingAttempts > 0 and not gem.isFirstProcessing
-    
-    # 리롤 후 상태 미리 준비
     rerolled_gem = None
-    reroll_future_probs = None
-    if can_reroll:
-        actual_reroll_after = gem.currentRerollAttempts - 1
+    if gem.currentRerollAttempts > 0 and not gem.isFirstProcessing:
         rerolled_gem = GemState(
             willpower=gem.willpower,
             corePoint=gem.corePoint,
@@ -888,192 +1447,691 @@ def calculate_probabilities(gem: GemState, memo: Dict[str, Dict], combo_memo: Di
             supportA=gem.supportA,
             supportB=gem.supportB,
             remainingAttempts=gem.remainingAttempts,
-            currentRerollAttempts=actual_reroll_after,
+            currentRerollAttempts=gem.currentRerollAttempts - 1,
             costModifier=gem.costModifier,
             isFirstProcessing=False  # 리롤 후는 당연히 첫 가공이 아닌 상태임
         )
-        reroll_future_data = calculate_probabilities(rerolled_gem, memo, combo_memo)
-        reroll_future_probs = reroll_future_data['probabilities']
-        reroll_future_costs = reroll_future_data['expectedCosts']
+    return rerolled_gem, [apply_processing(gem, option['action']) for option in available_options]
+
+def calculate_probabilities(gem: GemState, memo: Dict[int, StateRecord], combo_memo: Dict[str, Dict],
+                            reroll_cap: int = None, track_progress: bool = True) -> StateRecord:
+    """재귀적으로 확률을 계산. 매우 중요: 여기서의 확률은 아직 옵션 4개를 보지 못한 상태임
+
+    후속 상태를 먼저 재귀로 채운 뒤 compute_state_record로 계산한다. 후속 상태 레코드는 memo에서 다시
+    읽지 않고 직접 넘기므로 memo가 크기 제한된 LRUMemo여서 계산 도중 제거되어도 된다.
+    reroll_cap은 상태 ID의 리롤 횟수 상한이다 (None이면 MAX_REROLL_FOR_MEMOIZATION).
+    테이블 전체를 만들 때는 재귀 없이 calculate_probabilities_in_order를 쓴다.
+    """
+    global memo_hit_count
+    
+    key = state_to_id(gem, reroll_cap)
+    if key in memo:
+        # 메모이제이션 히트 - 이벤트 로그에 기록 (렌더링은 별도)
+        if track_progress:
+            memo_hit_count += 1
+            if progress_log:
+                progress_log.append(key, PROGRESS_EVENT_MEMO_HIT)
+        return memo[key]
+    
+    available_options = get_available_options(gem)
+    rerolled_gem, next_gems = state_successors(gem, available_options)
+    reroll_record = None
+    if rerolled_gem is not None:
+        reroll_record = calculate_probabilities(rerolled_gem, memo, combo_memo, reroll_cap, track_progress)
+    option_records = [calculate_probabilities(next_gem, memo, combo_memo, reroll_cap, track_progress)
+                      for next_gem in next_gems]
+    return compute_state_record(gem, key, available_options, rerolled_gem, next_gems, memo, combo_memo,
+                                track_progress=track_progress, reroll_cap=reroll_cap,
+                                successor_records=(reroll_record, option_records))
+
+def calculate_probabilities_in_order(states, memo: Dict[int, StateRecord], combo_memo: Dict[str, Dict]) -> int:
+    """states를 주어진 순서대로 재귀 없이 계산 (반환값은 새로 계산한 상태 수)
+
+    states는 (remainingAttempts, currentRerollAttempts) 오름차순이어야 한다. 가공 후 상태는 시도 횟수가
+    하나 적고 리롤 후 상태는 리롤 횟수가 하나 적으므로 후속 상태가 항상 먼저 memo에 들어 있다.
+    이미 memo에 있는 상태는 건너뛴다.
+    """
+    computed = 0
+    gem = None
+    try:
+        for gem in states:
+            key = state_to_id(gem)
+            if key in memo:
+                continue
+            available_options = get_available_options(gem)
+            rerolled_gem, next_gems = state_successors(gem, available_options)
+            compute_state_record(gem, key, available_options, rerolled_gem, next_gems, memo, combo_memo)
+            computed += 1
+    except Exception as e:
+        print_state_error(gem, e)
+        # 에러를 다시 발생시켜 프로그램 중단
+        raise
+    return computed
+
+def print_state_error(gem: GemState, error: Exception):
+    """상태 계산 중 에러가 났을 때 젬 상태 출력"""
+    print(f"\n❌ 에러 발생!")
+    print(f"에러 메시지: {error!r}")
+    print(f"현재 젬 상태:")
+    print(f"  - willpower: {gem.willpower}")
+    print(f"  - corePoint: {gem.corePoint}")
+    print(f"  - dealerA: {gem.dealerA}")
+    print(f"  - dealerB: {gem.dealerB}")
+    print(f"  - supportA: {gem.supportA}")
+    print(f"  - supportB: {gem.supportB}")
+    print(f"  - remainingAttempts: {gem.remainingAttempts}")
+    print(f"  - currentRerollAttempts: {gem.currentRerollAttempts}")
+    print(f"  - isFirstProcessing: {gem.isFirstProcessing}")
+    print(f"\n상태 키: {state_to_key(gem)} (ID {state_to_id(gem)})")
+    if isinstance(error, KeyError):
+        print(f"후속 상태가 memo에 없음: states가 의존 순서대로 정렬되어 있는지 확인하세요")
+
+# 스레드 엔진에서 작업 하나가 맡는 상태 수 (층 하나를 스레드 수보다 잘게 나눠 부하를 고르게)
+THREAD_CHUNK_STATES = 256
+
+# GIL 경고는 프로세스에서 한 번만 출력 (저메모리 모드는 층마다 calculate_probabilities_threaded를 호출)
+_gil_warning_shown = False
+
+def _calculate_state_chunk(states: List[GemState], memo: Dict[int, StateRecord], combo_memo: Dict[str, Tuple]) -> List[int]:
+    """스레드 작업 하나: 같은 층의 상태들을 계산 (전역 카운터/출력/이벤트 로그는 건드리지 않음)"""
+    keys = []
+    for gem in states:
+        key = state_to_id(gem)
+        if key in memo:
+            continue
+        try:
+            available_options = get_available_options(gem)
+            rerolled_gem, next_gems = state_successors(gem, available_options)
+            compute_state_record(gem, key, available_options, rerolled_gem, next_gems, memo, combo_memo,
+                                 track_progress=False)
+        except Exception as e:
+            print_state_error(gem, e)
+            raise
+        keys.append(key)
+    return keys
+
+def calculate_probabilities_threaded(states, memo: Dict[int, StateRecord], combo_memo: Dict[str, Tuple],
+                                     threads: int) -> int:
+    """calculate_probabilities_in_order의 스레드 풀 버전 (반환값은 새로 계산한 상태 수)
+
+    (remainingAttempts, currentRerollAttempts)가 같은 층 안의 상태들은 서로 의존하지 않으므로 층마다
+    작업을 나눠 스레드들이 계산하고, 층이 끝날 때까지 기다린 뒤 다음 층으로 넘어간다. memo의 각 키는
+    한 번만 쓰이고 읽기는 이전 층에만 하므로 잠금이 필요 없으며, combo_memo는 setdefault로 먼저 넣은
+    항목을 모두가 쓴다. 계산 카운터, 진행 출력, 이벤트 로그는 층이 끝날 때 메인 스레드에서만 갱신한다.
+    free-threaded 빌드(3.13t 이상)에서는 코어 수만큼 빨라지고, GIL 빌드에서는 순차 계산과 비슷한 속도로 동작한다.
+    """
+    global calculation_counter, _gil_warning_shown
+    if not _gil_warning_shown and getattr(sys, '_is_gil_enabled', lambda: True)():
+        _gil_warning_shown = True
+        print(f"⚠️ GIL이 켜진 인터프리터입니다: 스레드 {threads}개로 계산하지만 순차 계산보다 크게 빠르지 않습니다")
+    
+    computed = 0
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for (remaining_attempts, reroll_attempts), layer in groupby(
+                states, key=lambda gem: (gem.remainingAttempts, gem.currentRerollAttempts)):
+            layer = list(layer)
+            chunks = [layer[i:i + THREAD_CHUNK_STATES] for i in range(0, len(layer), THREAD_CHUNK_STATES)]
+            layer_keys = [key for keys in executor.map(_calculate_state_chunk, chunks, repeat(memo), repeat(combo_memo))
+                          for key in keys]
+            
+            computed += len(layer_keys)
+            calculation_counter += len(layer_keys)
+            if progress_log:
+                for key in layer_keys:
+                    progress_log.append(key, PROGRESS_EVENT_CALCULATED)
+            if PRINT_CALCULATION_PROGRESS:
+                elapsed_time = time.time() - start_time if start_time else 0
+                print(f"층 완료: 시도 {remaining_attempts}, 리롤 {reroll_attempts} - {len(layer_keys)}개 상태 "
+                      f"(누적 {calculation_counter}개, combo_memo: {len(combo_memo)}패턴, 경과시간: {elapsed_time:.2f}s)")
+    return computed
+
+def calculate_probabilities_layer_window(states, memo: Dict[int, StateRecord], combo_memo: Dict[str, Tuple],
+                                         writers: List, threads: int = 1) -> int:
+    """remainingAttempts 층 단위로 계산하며 다 쓴 층을 writers로 내보내고 memo에서 지움 (반환값은 새로 계산한 상태 수)
+
+    층 t는 층 t-1(가공 후 상태)과 층 t 안의 더 적은 리롤 횟수(리롤 후 상태)에만 의존하므로 층 t 계산이
+    끝나면 층 t-1은 더 이상 읽히지 않는다. 그래서 memo에는 많아야 두 층만 남는다. writers는 write(table)를
+    가진 테이블 writer들(JsonTableWriter 등)이며 층마다 계산 순서대로 받는다. close는 호출한 쪽에서 한다.
+    """
+    def write_layer(layer: Dict[int, StateRecord]):
+        for writer in writers:
+            writer.write(layer)
+        for key in layer:
+            del memo[key]
+    
+    computed = 0
+    previous_layer = {}
+    for remaining_attempts, layer_states in groupby(states, key=lambda gem: gem.remainingAttempts):
+        layer_states = list(layer_states)
+        if threads > 1:
+            computed += calculate_probabilities_threaded(layer_states, memo, combo_memo, threads)
+        else:
+            computed += calculate_probabilities_in_order(layer_states, memo, combo_memo)
         
-    # 모든 4개 조합에 대해 실제 확률 계산
-    # 4combo 확률 계산 (메모이제이션 포함)
-    combo_probs = calculate_combo_probabilities_for_gem(gem, available_options, combo_memo)
-    
-    # 역매핑 준비 (effect1 -> dealerA 등)
-    reverse_mapping = {}
-    effect_idx = 1
-    for name, level in sorted(
-        [('dealerA', gem.dealerA), ('dealerB', gem.dealerB), 
-         ('supportA', gem.supportA), ('supportB', gem.supportB)],
-        key=lambda x: -x[1]  # 레벨 내림차순
-    ):
-        if level > 0:
-            reverse_mapping[f'effect{effect_idx}'] = name
-            effect_idx += 1
+        # 층 t-1 내보내기 (층 t가 끝났으므로 더 이상 참조되지 않음)
+        write_layer(previous_layer)
+        previous_layer = {key: memo[key] for key in map(state_to_id, layer_states)}
+        if PRINT_CALCULATION_PROGRESS:
+            print(f"🪟 시도 {remaining_attempts} 층 완료: memo {len(memo)}개 상태 유지")
+    write_layer(previous_layer)
+    return computed
+
+def compute_state_record(gem: GemState, key: int, available_options: List[Dict], rerolled_gem: GemState,
+                         next_gems: List[GemState], memo: Dict[int, StateRecord], combo_memo: Dict[str, Dict],
+                         track_progress: bool = True, reroll_cap: int = None,
+                         successor_records: Tuple[StateRecord, List[StateRecord]] = None) -> StateRecord:
+    """후속 상태(state_successors)가 모두 memo에 있을 때 상태 하나를 계산해 memo[key]에 저장
+
+    track_progress가 False이면 전역 카운터, 진행 출력, 이벤트 로그를 건드리지 않는다 (스레드 작업용).
+    reroll_cap은 후속 상태 ID의 리롤 횟수 상한 (None이면 MAX_REROLL_FOR_MEMOIZATION).
+    successor_records로 (리롤 후 레코드 또는 None, next_gems 순서의 레코드)를 넘기면 memo 대신 그것을 쓴다.
+    """
+    global calculation_counter, memo_hit_count
+    
+    target_count = len(TARGETS)
+    
+    # 현재 상태에서 각 목표 달성 여부를 기본값으로 설정
+    # (이미 달성한 목표는 확률 1.0으로 시작)
+    base_probabilities = target_achievement_vector(gem)
+    option_ids = [OPTION_IDS[opt['action']] for opt in available_options]
+    
+    # 기저 조건: 남은 시도 횟수가 0 또는 사용 가능한 옵션이 없음
+    if gem.remainingAttempts == 0 or not available_options:
+        # 기저 조건에서는 퍼센타일이 모두 현재 확률과 동일하고, 모든 목표의 기대 비용이 0
+        record = memo[key] = StateRecord(
+            base_probabilities,
+            np.zeros(target_count),
+            np.repeat(base_probabilities[:, None], len(PERCENTILE_GRID), axis=1),
+            option_ids,
+            np.zeros(len(option_ids)),
+            (base_probabilities, np.zeros(target_count)) if COST_OBJECTIVE_SUCCESS_VALUE is not None else ()
+        )
+        if sensitivity_store is not None:
+            sensitivity_store[key] = np.zeros((target_count, len(OPTION_ACTIONS)), dtype=np.float32)
+        if track_progress:
+            # 새로운 계산 완료 시 진행 상황 출력
+            calculation_counter += 1
+            print_calculation_progress("기저 조건", gem, base_probabilities, len(available_options), combo_memo)
+            memo_hit_count = 0
             
-    # target별로 combo 데이터를 저장 (퍼센타일 계산용)
-    target_combo_data = {target: [] for target in targets}
+            # 시각화 이벤트 기록 (기저 조건 계산 완료 시)
+            if progress_log:
+                progress_log.append(key, PROGRESS_EVENT_CALCULATED)
+        
+        return record
+    
+    # 분석적 하한/상한이 같은 목표는 값이 정해짐 (비용 효율 정책은 목표 가치가 음수가 아닐 때만 중단이 최선)
+    lower_bounds, upper_bounds = target_probability_bounds(gem)
+    decided = lower_bounds == upper_bounds
+    if COST_OBJECTIVE_SUCCESS_VALUE is not None and COST_OBJECTIVE_SUCCESS_VALUE < 0:
+        decided[:] = False
+    all_decided = bool(decided.all())
     
-    for combo_key, combo_prob in combo_probs.items():
-        # combo_key는 항상 정규화된 액션 튜플
-        combo_options = []
+    # 실제 게임 로직: 4개 조합을 뽑고 그 중 하나를 25% 확률로 선택
+    probabilities = np.zeros(target_count)
+    expected_costs = np.zeros(target_count)
+    
+    # 현재 가공 비용 (costModifier 적용)
+    processing_cost = PROCESSING_COST * (1 + gem.costModifier / 100)
+    
+    # 리롤 후 상태 (후속 상태는 이미 계산되어 있으므로 memo에서 바로 읽음)
+    reroll_probs = None
+    if rerolled_gem is not None:
+        reroll_record = successor_records[0] if successor_records else memo[state_to_id(rerolled_gem, reroll_cap)]
+        reroll_probs = np.minimum(1.0, reroll_record.probabilities)  # 리롤 확률도 클램핑
+        reroll_costs = processing_cost + reroll_record.expected_costs
+    
+    # 비용 효율 정책 누적값 (확률 최대화 정책과 같은 조합 순회에서 함께 계산)
+    cost_policy = COST_OBJECTIVE_SUCCESS_VALUE is not None
+    if cost_policy:
+        cost_policy_probabilities = np.zeros(target_count)
+        cost_policy_costs = np.zeros(target_count)
+        if reroll_probs is not None:
+            cost_policy_reroll_probs = np.minimum(1.0, reroll_record.cost_policy_probabilities)
+            cost_policy_reroll_costs = processing_cost + reroll_record.cost_policy_expected_costs
+    
+    # 각 옵션 적용 후의 미래 확률과 cost (조합마다 반복하지 않도록 옵션별로 한 번만 계산)
+    option_state_ids = [state_to_id(next_gem, reroll_cap) for next_gem in next_gems]
+    option_records = successor_records[1] if successor_records else [memo[state_id] for state_id in option_state_ids]
+    
+    # 민감도 분석 모드: 다음 상태들의 미분 (available_options 순서) 및 조합 위치별 누적 질량
+    option_sensitivities = None
+    if sensitivity_store is not None:
+        option_sensitivities = np.stack([sensitivity_store[state_id] for state_id in option_state_ids])
+        progress_mass = np.zeros((len(available_options), target_count))  # 옵션 위치별 진행 선택 확률 질량
+        reroll_mass = np.zeros(target_count)  # 리롤 선택 확률 질량
         
-        for normalized_action in combo_key:
-            # effect1_+1 -> dealerA_+1 형태로 역변환
-            actual_action = normalized_action
-            for effect_name, original_name in reverse_mapping.items():
-                actual_action = actual_action.replace(effect_name, original_name)
-            
-            # 실제 옵션 찾기
-            for opt in available_options:
-                if opt['action'] == actual_action:
-                    combo_options.append(opt)
-                    break
+    # 모든 4개 조합에 대해 실제 확률 계산
+    # 4combo 확률 계산 (메모이제이션 포함), 패턴의 정규화 옵션 열 -> 이 상태의 옵션 위치는 슬롯 순열 색인으로
+    pattern_option_ids, combo_indices, combo_probs, pattern_selection_probs = calculate_combo_probabilities_for_gem(
+        gem, available_options, combo_memo)
+    column_positions, combo_positions = pattern_combo_positions(gem, option_ids, pattern_option_ids, combo_indices)
+    
+    # 조합별 최적 선택 (내보내기 옵션이 켜진 경우만, 이 상태의 combinations 순서로 저장)
+    combo_decisions = None
+    if decision_store is not None:
+        combo_decisions = np.zeros((comb(len(available_options), 4), target_count), dtype=np.uint8)
+    
+    # 조합별 진행 확률 (퍼센타일 계산용)
+    combo_values = np.zeros((len(combo_probs), target_count))
+    chosen_values = np.zeros((len(combo_probs), target_count)) if option_sensitivities is not None else None
+    stop_costs = np.zeros(target_count)  # 현재 상태에서 중단하면 cost 0 (이미 달성)
+    target_columns = np.arange(target_count)
+    
+    # 모든 목표가 결정된 상태는 조합 순회를 건너뛰고 퍼센타일용 진행 확률만 한 번에 모음 (선택은 모두 중단)
+    combo_iterator = enumerate(zip(combo_positions.tolist(), combo_probs.tolist()))
+    percentile_weights = combo_probs
+    omitted_mass = 0.0
+    if APPROXIMATION_EPSILON is not None and not all_decided:
+        # 근사 모드: 확률 큰 조합만 순회 (생략한 조합은 퍼센타일 가중치도 0)
+        kept_combos, omitted_mass = approximate_combo_selection(gem, combo_probs)
+        if omitted_mass > 0:
+            combo_iterator = zip(kept_combos.tolist(), zip(combo_positions[kept_combos].tolist(),
+                                                           combo_probs[kept_combos].tolist()))
+            percentile_weights = np.zeros_like(combo_probs)
+            percentile_weights[kept_combos] = combo_probs[kept_combos]
+        if chosen_values is None and combo_decisions is None:
+            # 조합별 기록(민감도, 선택 내보내기)이 없으면 남긴 조합을 배열로 한 번에 평가
+            kept_positions = combo_positions[kept_combos]
+            kept_probs = combo_probs[kept_combos]
+            probabilities, expected_costs, combo_values[kept_combos] = evaluate_combo_choices(
+                kept_positions, kept_probs,
+                np.stack([record.probabilities for record in option_records]),
+                np.stack([record.expected_costs for record in option_records]),
+                processing_cost, base_probabilities,
+                (reroll_probs, reroll_costs) if reroll_probs is not None else None)
+            if cost_policy:
+                cost_policy_probabilities, cost_policy_costs, _ = evaluate_combo_choices(
+                    kept_positions, kept_probs,
+                    np.stack([record.cost_policy_probabilities for record in option_records]),
+                    np.stack([record.cost_policy_expected_costs for record in option_records]),
+                    processing_cost, base_probabilities,
+                    (cost_policy_reroll_probs, cost_policy_reroll_costs) if reroll_probs is not None else None,
+                    objective=COST_OBJECTIVE_SUCCESS_VALUE)
+            combo_iterator = ()
+    if all_decided:
+        option_probabilities = np.stack([record.probabilities for record in option_records])
+        for column in range(4):
+            combo_values += option_probabilities[combo_positions[:, column]] * 0.25
+        np.minimum(1.0, combo_values, out=combo_values)
+        combo_iterator = ()
+    
+    for combo_idx, (positions, combo_prob) in combo_iterator:
+        combo_records = [option_records[position] for position in positions]
         
-        # 이 조합의 각 옵션별 미래 확률과 cost 계산
-        combo_future_probs = {}
-        combo_future_costs = {}
-        for option in combo_options:
-            next_gem = apply_processing(gem, option['action'])
-            future_data = calculate_probabilities(next_gem, memo, combo_memo)
-            combo_future_probs[option['action']] = future_data['probabilities']
-            combo_future_costs[option['action']] = future_data['expectedCosts']
+        # 이 조합에서의 진행 확률과 cost (4개 중 균등 선택)
+        combo_progress_value = np.zeros(target_count)
+        combo_progress_cost = np.full(target_count, processing_cost)  # 현재 가공 비용
+        for record in combo_records:
+            combo_progress_value += record.probabilities * 0.25
+            combo_progress_cost += record.expected_costs * 0.25
         
-        # 모든 target에 대해 이 조합의 기여도 계산
-        for target in targets:
-            # 현재 가공 비용 (costModifier 적용)
-            processing_cost = PROCESSING_COST * (1 + gem.costModifier / 100)
-            
-            # 이 조합에서의 진행 확률과 cost (4개 중 균등 선택)
-            combo_progress_value = 0.0
-            combo_progress_cost = processing_cost  # 현재 가공 비용
-            for option in combo_options:
-                combo_progress_value += combo_future_probs[option['action']][target] * 0.25
-                combo_progress_cost += combo_future_costs[option['action']][target] * 0.25
-                        
-            # 확률을 1.0으로 클램핑 (1 초과 방지)
-            combo_progress_value = min(1.0, combo_progress_value)
+        # 확률을 1.0으로 클램핑 (1 초과 방지) - 클램핑된 목표는 미분이 0
+        progress_unclamped = combo_progress_value <= 1.0
+        np.minimum(1.0, combo_progress_value, out=combo_progress_value)
+        
+        # 이 조합에서 최적 선택 (현재 상태에서 중단, 진행, 리롤 중) - 확률 기준
+        if reroll_probs is not None:
+            combo_options_list = np.stack((base_probabilities, combo_progress_value, reroll_probs))
+            combo_costs_list = np.stack((stop_costs, combo_progress_cost, reroll_costs))
+        else:
+            combo_options_list = np.stack((base_probabilities, combo_progress_value))
+            combo_costs_list = np.stack((stop_costs, combo_progress_cost))
+        
+        # 최적 선택 (가장 높은 확률, 동률이면 앞선 선택)
+        best_idx = combo_options_list.argmax(axis=0)
+        best_values = combo_options_list[best_idx, target_columns]
+        probabilities += combo_prob * best_values
+        expected_costs += combo_prob * combo_costs_list[best_idx, target_columns]
+        
+        if cost_policy:
+            combo_cost_policy_value = np.zeros(target_count)
+            combo_cost_policy_cost = np.full(target_count, processing_cost)
+            for record in combo_records:
+                combo_cost_policy_value += record.cost_policy_probabilities * 0.25
+                combo_cost_policy_cost += record.cost_policy_expected_costs * 0.25
+            np.minimum(1.0, combo_cost_policy_value, out=combo_cost_policy_value)
             
-            # 이 조합에서 최적 선택 (현재 상태에서 중단, 진행, 리롤 중) - 확률 기준
-            combo_options_list = [base_probabilities[target], combo_progress_value]
-            combo_costs_list = [0.0, combo_progress_cost]  # 현재 상태에서 중단하면 cost 0 (이미 달성)
+            if reroll_probs is not None:
+                policy_values = np.stack((base_probabilities, combo_cost_policy_value, cost_policy_reroll_probs))
+                policy_costs = np.stack((stop_costs, combo_cost_policy_cost, cost_policy_reroll_costs))
+            else:
+                policy_values = np.stack((base_probabilities, combo_cost_policy_value))
+                policy_costs = np.stack((stop_costs, combo_cost_policy_cost))
             
-            if can_reroll and reroll_future_probs:
-                reroll_prob = min(1.0, reroll_future_probs[target])  # 리롤 확률도 클램핑
-                combo_options_list.append(reroll_prob)
-                combo_costs_list.append(processing_cost + reroll_future_costs[target])
-            
-            # 최적 선택 (가장 높은 확률)
-            best_idx = combo_options_list.index(max(combo_options_list))
-            combo_best = combo_options_list[best_idx]
-            combo_best_cost = combo_costs_list[best_idx]
-            
-            probabilities[target] += combo_prob * combo_best
-            expected_costs[target] += combo_prob * combo_best_cost
-            
-            # 퍼센타일 계산용 데이터 저장
-            target_combo_data[target].append((combo_progress_value, combo_prob))
-    
-    # 각 target에 대한 퍼센타일 계산
-    target_percentiles = calculate_percentiles_from_combo_data(target_combo_data)
-    
-    # 선택 확률 계산 (조합 확률 재사용)
-    selection_probs = {opt['action']: 0.0 for opt in available_options}
-    
-    # combo_probs는 이제 정규화된 액션 튜플이 키이므로 역매핑 필요
-    for combo_key, combo_prob in combo_probs.items():
-        # combo_key는 정규화된 액션 튜플
-        for normalized_action in combo_key:
-            # effect1_+1 -> dealerA_+1 형태로 역변환
-            actual_action = normalized_action
-            for effect_name, original_name in reverse_mapping.items():
-                actual_action = actual_action.replace(effect_name, original_name)
-            
-            # 선택 확률에 추가
-            if actual_action in selection_probs:
-                selection_probs[actual_action] += combo_prob * 0.25
-    
-    # availableOptions에 선택 확률 추가
-    options_with_probs = []
-    for option in available_options:
-        options_with_probs.append({
-            'action': option['action'],
-            'probability': option['probability'],
-            'description': option.get('description', ''),
-            'selectionProbability': selection_probs[option['action']]  # 실제로 더 이상 리롤하지 않았을 때 선택될 확률
-        })   
+            # 가치 - 비용이 가장 큰 선택 (동률이면 앞선 선택, 즉 중단 우선)
+            policy_idx = (COST_OBJECTIVE_SUCCESS_VALUE * policy_values - policy_costs).argmax(axis=0)
+            cost_policy_probabilities += combo_prob * policy_values[policy_idx, target_columns]
+            cost_policy_costs += combo_prob * policy_costs[policy_idx, target_columns]
+        
+        if chosen_values is not None:
+            chosen_values[combo_idx] = best_values
+            progress_share = combo_prob * 0.25 * ((best_idx == 1) & progress_unclamped)
+            for position in positions:
+                progress_mass[position] += progress_share
+            reroll_mass += combo_prob * (best_idx == 2)
+        
+        if combo_decisions is not None:
+            combo_decisions[combination_rank(sorted(positions), len(available_options))] = best_idx
+        
+        # 퍼센타일 계산용 데이터 저장
+        combo_values[combo_idx] = combo_progress_value
+    
+    # 결정된 목표는 분석적 값으로 (달성: 확률 1/비용 0, 도달 불가: 0/0, 중단이 최선이므로 민감도 0)
+    probabilities[decided] = lower_bounds[decided]
+    expected_costs[decided] = 0.0
+    if cost_policy:
+        cost_policy_probabilities[decided] = lower_bounds[decided]
+        cost_policy_costs[decided] = 0.0
+    
+    # 각 target에 대한 퍼센타일 계산 (도달 불가 목표는 진행 확률이 모두 0이므로 0)
+    target_percentiles = calculate_percentiles_from_combo_data(combo_values, percentile_weights,
+                                                               np.flatnonzero(upper_bounds > 0))
+    
+    # 근사 오차 상한: 이 상태에서 생략한 질량 + 후속 상태 오차 상한의 최댓값 (모든 목표가 결정되면 정확)
+    if approximation_error_store is not None:
+        successor_ids = option_state_ids + ([state_to_id(rerolled_gem, reroll_cap)] if rerolled_gem is not None else [])
+        successor_bound = max(approximation_error_store.get(state_id, 0.0) for state_id in successor_ids)
+        approximation_error_store[key] = 0.0 if all_decided else min(1.0, omitted_mass + successor_bound)
+    
+    # 선택 확률 (실제로 더 이상 리롤하지 않았을 때 선택될 확률): 패턴에 캐시된 열별 값을 이 상태의 옵션 위치로
+    selection_probs = np.empty(len(available_options))
+    selection_probs[column_positions] = pattern_selection_probs
+    
+    # 민감도: 선택된 다음 상태 미분의 가중합 + 조합 확률 미분 x 선택된 값
+    if chosen_values is not None:
+        sensitivity = np.einsum('ot,otw->tw', progress_mass, option_sensitivities)
+        if reroll_probs is not None:
+            reroll_mass *= reroll_record.probabilities <= 1.0
+            sensitivity += reroll_mass[:, None] * sensitivity_store[state_to_id(rerolled_gem, reroll_cap)]
+        combo_gradients = calculate_combo_gradients_for_gem(gem, pattern_option_ids, combo_indices)
+        weight_columns = np.array(option_ids)[column_positions]
+        sensitivity[:, weight_columns] += chosen_values.T @ combo_gradients
+        sensitivity[decided] = 0.0
+        sensitivity_store[key] = sensitivity.astype(np.float32)
     
     # 결과를 memo에 저장
-    memo[key] = {
-        'probabilities': probabilities,
-        'availableOptions': options_with_probs,
-        'percentiles': target_percentiles,
-        'expectedCosts': expected_costs
-    }
+    record = memo[key] = StateRecord(probabilities, expected_costs, target_percentiles, option_ids, selection_probs,
+                                     (cost_policy_probabilities, cost_policy_costs) if cost_policy else ())
+    if combo_decisions is not None:
+        decision_store[key] = (len(available_options), pack_decisions(combo_decisions))
        
-    # 새로운 계산 완료 시 진행 상황 출력
-    calculation_counter += 1
-    
-    # 버퍼에 쌓인 메모 히트들을 일괄 처리
-    memo_hit_count = flush_memo_hits_to_visualization()
+    if track_progress:
+        # 새로운 계산 완료 시 진행 상황 출력
+        calculation_counter += 1
+        print_calculation_progress("계산 완료", gem, probabilities, len(available_options), combo_memo)
+        memo_hit_count = 0
         
-    total_combo_count = sum(len(combos) for combos in combo_memo.values())
-    elapsed_time = time.time() - start_time if start_time else 0
-    avg_time_per_state = elapsed_time / calculation_counter if calculation_counter > 0 else 0
-    available_count = len(available_options)
-    combo_4_count = comb(available_count, 4) if available_count >= 4 else 0
-    print(f"계산 완료: {calculation_counter:>5d}개 상태 ({key}) "
-          f"8+: {probabilities['sum8+']:.6f}, 9+: {probabilities['sum9+']:.6f}, "
-          f"r+: {probabilities['relic+']:.6f}, a+: {probabilities['ancient+']:.6f}, "
-          f"d_comp: {probabilities['dealer_complete']:.6f}, s_comp: {probabilities['support_complete']:.6f}, "
-          f"memo_hit: {memo_hit_count:2d}개, combo_memo: {len(combo_memo)}패턴/{total_combo_count}조합, "
-          f"options: {available_count}개, 4조합: {combo_4_count}개, "
-          f"경과시간: {elapsed_time:.2f}s, 평균: {avg_time_per_state * 1000:.3f}s/1000 상태")
+        # 시각화 이벤트 기록 (실제 계산 완료 시)
+        if progress_log:
+            progress_log.append(key, PROGRESS_EVENT_CALCULATED)
     
-    # 시각화 업데이트 (실제 계산 완료 시)
-    update_visualization_progress(key, is_memo_hit=False)
-    
-    # 화면 갱신은 가끔만
-    if visualizer:
-        visualizer.refresh_display()
+    # 전체 데이터 반환 (memo에 저장된 것과 동일, LRUMemo에서 바로 제거되어도 반환은 됨)
+    return record
+
+# 질의 시점 평가 설정
+LAZY_MEMO_MAX_STATES = 200_000  # 호출 간 유지되는 메모이제이션의 최대 상태 수
+STATE_ID_MAX_REROLL = 31  # 상태 ID의 리롤 필드(5비트)로 표현 가능한 최대 리롤 횟수
+
+class LRUMemo(OrderedDict):
+    """크기가 제한된 메모이제이션 (가장 오래 사용되지 않은 상태부터 제거)"""
+
+    def __init__(self, max_size: int):
+        super().__init__()
+        self.max_size = max_size
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        if len(self) > self.max_size:
+            self.popitem(last=False)
+
+# 질의 시점 평가용 메모이제이션 (evaluate_state 호출 간 유지)
+_lazy_memo = None
+_lazy_combo_memo = {}
+
+def evaluate_state(gem: GemState, max_states: int = LAZY_MEMO_MAX_STATES) -> StateRecord:
+    """사전 계산 테이블 밖의 젬 상태 하나를 질의 시점에 평가 (리롤 횟수 상한 없음)
+
+    gem에서 도달 가능한 하위 상태들만 계산하며, 결과는 크기 제한된 LRU 메모이제이션에 남아
+    다음 호출에서 재사용된다. 반환값은 generate_probability_table의 memo 레코드와 같은 StateRecord.
+    """
+    global _lazy_memo
+    
+    if not state_fields_in_range(gem):
+        raise ValueError(f"유효하지 않은 젬 상태입니다: {gem}")
+    # 리롤 +2가 매 가공마다 나와도 상태 ID로 표현 가능해야 함
+    if gem.currentRerollAttempts + 2 * gem.remainingAttempts > STATE_ID_MAX_REROLL:
+        raise ValueError(f"평가 가능한 범위를 넘는 상태입니다: {gem}")
+    
+    if _lazy_memo is None or _lazy_memo.max_size != max_states:
+        _lazy_memo = LRUMemo(max_states)
+    
+    # 메모이제이션 키에서 리롤 횟수를 자르지 않도록 상한은 최대값 (전역 카운터/진행 출력은 건드리지 않음)
+    return calculate_probabilities(gem, _lazy_memo, _lazy_combo_memo, reroll_cap=STATE_ID_MAX_REROLL,
+                                   track_progress=False)
+
+# 가중치 구성 일괄 계산(what-if)에 쓰는 (구성 x OPTION_ACTIONS) 가중치 행렬 (None이면 일괄 모드 아님)
+batch_weight_matrix = None
+
+def load_weight_configs(path: str) -> List[Tuple[str, Dict[str, float]]]:
+    """가중치 구성 JSON 로드: [{"name": "live", "weights": {"willpower_+1": 0.12, ...}}, ...]
+
+    weights에 없는 옵션은 PROCESSING_POSSIBILITIES의 기본 가중치를 쓴다.
+    조합 확률이 dealer/support를 effect로 정규화한 패턴 단위로 공유되므로
+    4개 옵션 슬롯의 같은 액션(dealerA_+1, dealerB_+1, ...)은 가중치가 같아야 한다.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        raw_configs = json.load(f)
+    
+    configs = []
+    for raw_config in raw_configs:
+        name = raw_config['name']
+        unknown_actions = set(raw_config['weights']) - set(PROCESSING_POSSIBILITIES)
+        if unknown_actions:
+            raise ValueError(f"가중치 구성 {name}: 알 수 없는 옵션 {sorted(unknown_actions)}")
         
-    # 중간 영상 저장 (1만개마다)
-    if calculation_counter % 10000 == 0 and visualizer:
-        visualizer.save_current_video(f"checkpoint_{calculation_counter}")
+        weights = {action: config['probability'] for action, config in PROCESSING_POSSIBILITIES.items()}
+        weights.update(raw_config['weights'])
+        for action in weights:
+            if action.startswith('dealerA_'):
+                suffix = action[len('dealerA'):]
+                if len({weights[effect + suffix] for effect in EFFECT_OPTION_NAMES}) > 1:
+                    raise ValueError(f"가중치 구성 {name}: *{suffix} 가중치는 4개 옵션 슬롯이 같아야 합니다")
+        configs.append((name, weights))
+    return configs
+
+def apply_weight_config(weights: Dict[str, float]) -> Dict[str, float]:
+    """PROCESSING_POSSIBILITIES의 가중치를 바꾸고 이전 가중치를 반환 (구성별 내보내기용)"""
+    previous = {action: config['probability'] for action, config in PROCESSING_POSSIBILITIES.items()}
+    for action, probability in weights.items():
+        PROCESSING_POSSIBILITIES[action]['probability'] = probability
+    return previous
+
+class BatchStateRecord:
+    """가중치 구성 일괄 계산용 메모이제이션 레코드
+
+    values는 StateRecord.values와 같은 배치에 구성 축이 앞에 붙은 (구성 수 x 길이) 배열이며,
+    option_ids는 모든 구성이 공유한다.
+    """
+    __slots__ = ('values', 'option_ids')
+
+    def __init__(self, probabilities: np.ndarray, expected_costs: np.ndarray, percentiles: np.ndarray,
+                 option_ids: List[int], selection_probs: np.ndarray):
+        config_count = len(probabilities)
+        self.values = np.concatenate((probabilities, expected_costs, percentiles.reshape(config_count, -1),
+                                      selection_probs), axis=1)
+        self.option_ids = bytes(option_ids)
+
+    @property
+    def probabilities(self) -> np.ndarray:
+        return self.values[:, :len(TARGETS)]
+
+    @property
+    def expected_costs(self) -> np.ndarray:
+        return self.values[:, len(TARGETS):2 * len(TARGETS)]
+
+    def config_record(self, config_idx: int) -> StateRecord:
+        """구성 하나의 StateRecord"""
+        record = StateRecord.__new__(StateRecord)
+        record.values = self.values[config_idx].copy()
+        record.option_ids = self.option_ids
+        return record
+
+def calculate_combo_probabilities_batch_for_gem(gem: GemState, available_options: List[Dict],
+                                                combo_memo: Dict[str, Tuple]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """calculate_combo_probabilities_for_gem의 일괄 버전 (패턴별 메모이제이션)
+
+    반환값: (정규화 옵션 ID 열, 조합 x 4 열 인덱스, 조합 x 구성 조합 확률, 열 x 구성 선택 확률).
+    조합 순서와 조합 안의 옵션 순서는 calculate_combo_probabilities_for_gem과 같다.
+    """
+    generalized_gem_pattern = create_generalized_gem_pattern(gem)
+    if generalized_gem_pattern in combo_memo:
+        return combo_memo[generalized_gem_pattern]
     
-    # 전체 데이터 반환 (memo에 저장된 것과 동일)
-    return memo[key]
+    pattern_option_ids = normalized_option_ids(gem, [OPTION_IDS[opt['action']] for opt in available_options])
+    sort_keys = [NORMALIZED_OPTION_SORT_KEYS[option_id] for option_id in pattern_option_ids]
+    combo_indices = np.array([sorted(combo, key=sort_keys.__getitem__)
+                              for combo in combinations(range(len(available_options)), 4)], dtype=np.intp).reshape(-1, 4)
+    
+    # 모든 조합 x 구성을 한 번에: 4개를 뽑는 24가지 순서마다 (조합 x 구성) 배열로 계산
+    weight_matrix = batch_weight_matrix[:, [OPTION_IDS[opt['action']] for opt in available_options]].T
+    total_weights = weight_matrix.sum(axis=0)
+    combo_probs = np.zeros((len(combo_indices), weight_matrix.shape[1]))
+    for order in permutations(range(4)):
+        perm_prob = np.ones_like(combo_probs)
+        remaining_total = np.broadcast_to(total_weights, combo_probs.shape)
+        for column in order:
+            option_weights = weight_matrix[combo_indices[:, column]]
+            valid = (remaining_total > 0) & (option_weights > 0)
+            perm_prob = np.where(valid, perm_prob * option_weights / np.where(valid, remaining_total, 1.0), 0.0)
+            remaining_total = remaining_total - option_weights
+        combo_probs += perm_prob
+    
+    combo_memo[generalized_gem_pattern] = (pattern_option_ids, combo_indices, combo_probs,
+                                           combo_incidence_matrix(combo_indices, len(pattern_option_ids)) @ combo_probs)
+    return combo_memo[generalized_gem_pattern]
 
-def _generate_probability_table_impl(memo=None, combo_memo=None, enable_visualization=True):
-    """확률 테이블 생성 구현부 (메모이제이션 외부 제공 가능)"""
-    print("🎲 확률 테이블 생성 시작...")
+def compute_batch_state_record(gem: GemState, key: int, available_options: List[Dict], rerolled_gem: GemState,
+                               next_gems: List[GemState], memo: Dict[int, BatchStateRecord],
+                               combo_memo: Dict[str, Tuple]) -> BatchStateRecord:
+    """compute_state_record를 batch_weight_matrix의 모든 가중치 구성에 대해 한 번에 계산
+
+    상태 순회, 다음 상태 구조, 조합 인덱스는 공유하고 가중치와 값만 구성 축으로 늘린다.
+    조합 축까지 배열로 계산하므로 (조합 x 구성 x 목표) 배열에서 최적 선택을 고른다.
+    후속 상태(rerolled_gem, next_gems)는 memo에 이미 있어야 한다 (calculate_probabilities_batch_in_order).
+    """
+    global calculation_counter
     
-    # 전역 카운터 초기화
-    global calculation_counter, visualizer, start_time
-    calculation_counter = 0
-    start_time = time.time()  # 전역 시작 시간 설정
+    config_count = len(batch_weight_matrix)
+    target_count = len(TARGETS)
+    base_probabilities = target_achievement_vector(gem)
+    option_ids = [OPTION_IDS[opt['action']] for opt in available_options]
     
-    # 시각화 초기화
-    if enable_visualization:
-        try:
-            visualizer = ProgressVisualizer(max_attempts=10, max_rerolls=MAX_REROLL_ATTEMPTS)
-            print("📊 진행 상황 시각화 활성화")
-            time.sleep(3)
-        except Exception as e:
-            print(f"⚠️ 시각화 초기화 실패: {e}")
-            visualizer = None
+    # 기저 조건: 남은 시도 횟수가 0 또는 사용 가능한 옵션이 없음
+    if gem.remainingAttempts == 0 or not available_options:
+        base_batch = np.tile(base_probabilities, (config_count, 1))
+        memo[key] = BatchStateRecord(
+            base_batch,
+            np.zeros((config_count, target_count)),
+            np.repeat(base_batch[:, :, None], len(PERCENTILE_GRID), axis=2),
+            option_ids,
+            np.zeros((config_count, len(option_ids)))
+        )
+        calculation_counter += 1
+        return memo[key]
     
-    # 메모이제이션 초기화 또는 외부에서 제공받은 것 사용
-    if memo is None:
-        memo = {}
-    if combo_memo is None:
-        combo_memo = {}  # 조합 메모이제이션
-    total_states = 0
+    processing_cost = PROCESSING_COST * (1 + gem.costModifier / 100)
+    can_reroll = rerolled_gem is not None
     
-    # 모든 가능한 상태 순회 (Bottom-up: reroll부터, 그다음 remainingAttempts가 작은 것부터). 5*10*3*5*5*6*5*5+a=562500+a
-    for currentRerollAttempts in range(MAX_REROLL_ATTEMPTS):  # 0~(MAX_REROLL_ATTEMPTS-1) (리롤 횟수를 가장 먼저)
-        for remainingAttempts in range(10):  # 0~9 (JavaScript와 일치)
+    # 선택지별 (조합 x 구성 x 목표) 값: 중단, 진행, (리롤)
+    candidate_values = [np.broadcast_to(base_probabilities, (config_count, target_count))]
+    candidate_costs = [np.zeros((config_count, target_count))]
+    if can_reroll:
+        reroll_record = memo[state_to_id(rerolled_gem)]
+        reroll_probs = np.minimum(1.0, reroll_record.probabilities)  # 리롤 확률도 클램핑
+        reroll_costs = processing_cost + reroll_record.expected_costs
+    
+    # 각 옵션 적용 후의 (옵션 x 구성 x 목표) 미래 확률과 cost
+    next_records = [memo[state_to_id(next_gem)] for next_gem in next_gems]
+    next_probs = np.stack([record.probabilities for record in next_records])
+    next_costs = np.stack([record.expected_costs for record in next_records])
+    
+    # 패턴의 정규화 옵션 열 -> 이 상태의 옵션 위치
+    pattern_option_ids, combo_indices, combo_probs, pattern_selection_probs = calculate_combo_probabilities_batch_for_gem(
+        gem, available_options, combo_memo)
+    column_positions, positions = pattern_combo_positions(gem, option_ids, pattern_option_ids, combo_indices)
+    
+    # 조합별 진행 확률과 cost (4개 중 균등 선택)
+    combo_progress_value = np.zeros((len(positions), config_count, target_count))
+    combo_progress_cost = np.full((len(positions), config_count, target_count), processing_cost)
+    for column in range(4):
+        combo_progress_value += next_probs[positions[:, column]] * 0.25
+        combo_progress_cost += next_costs[positions[:, column]] * 0.25
+    np.minimum(1.0, combo_progress_value, out=combo_progress_value)
+    
+    candidate_values.append(combo_progress_value)
+    candidate_costs.append(combo_progress_cost)
+    if can_reroll:
+        candidate_values.append(reroll_probs)
+        candidate_costs.append(reroll_costs)
+    
+    # 최적 선택 (가장 높은 확률, 동률이면 앞선 선택)
+    candidate_shape = combo_progress_value.shape
+    stacked_values = np.stack([np.broadcast_to(values, candidate_shape) for values in candidate_values])
+    stacked_costs = np.stack([np.broadcast_to(costs, candidate_shape) for costs in candidate_costs])
+    best_idx = stacked_values.argmax(axis=0)[None]
+    best_values = np.take_along_axis(stacked_values, best_idx, axis=0)[0]
+    best_costs = np.take_along_axis(stacked_costs, best_idx, axis=0)[0]
+    probabilities = np.einsum('nk,nkt->kt', combo_probs, best_values)
+    expected_costs = np.einsum('nk,nkt->kt', combo_probs, best_costs)
+    
+    # 구성별 퍼센타일과 선택 확률
+    target_percentiles = np.stack([calculate_percentiles_from_combo_data(combo_progress_value[:, config_idx],
+                                                                         combo_probs[:, config_idx])
+                                   for config_idx in range(config_count)])
+    selection_probs = np.empty((len(available_options), config_count))
+    selection_probs[column_positions] = pattern_selection_probs
+    
+    memo[key] = BatchStateRecord(probabilities, expected_costs, target_percentiles, option_ids, selection_probs.T)
+    calculation_counter += 1
+    return memo[key]
+
+def calculate_probabilities_batch_in_order(states, memo: Dict[int, BatchStateRecord], combo_memo: Dict[str, Tuple]) -> int:
+    """calculate_probabilities_in_order의 가중치 구성 일괄 버전 (반환값은 새로 계산한 상태 수)
+
+    states는 (remainingAttempts, currentRerollAttempts) 오름차순이어야 하며 재귀 없이 순서대로 계산한다.
+    """
+    computed = 0
+    gem = None
+    try:
+        for gem in states:
+            key = state_to_id(gem)
+            if key in memo:
+                continue
+            available_options = get_available_options(gem)
+            rerolled_gem, next_gems = state_successors(gem, available_options)
+            compute_batch_state_record(gem, key, available_options, rerolled_gem, next_gems, memo, combo_memo)
+            computed += 1
+    except Exception as e:
+        print_state_error(gem, e)
+        raise
+    return computed
+
+def enumerate_all_states():
+    """테이블에 들어가는 모든 젬 상태를 bottom-up 순서로 생성
+
+    (remainingAttempts, currentRerollAttempts) 오름차순이므로 calculate_probabilities_in_order로
+    순서대로 계산하면 후속 상태는 항상 먼저 계산되어 있다.
+    """
+    # 모든 가능한 상태 순회 (Bottom-up: remainingAttempts가 작은 것부터, 그다음 reroll이 작은 것부터). 5*10*3*5*5*6*5*5+a=562500+a
+    for remainingAttempts in range(MAX_REMAINING_ATTEMPTS + 1):  # 0~MAX_REMAINING_ATTEMPTS (기본 9, JavaScript와 일치)
+        for currentRerollAttempts in range(MAX_REROLL_ATTEMPTS):  # 0~(MAX_REROLL_ATTEMPTS-1)
             for costModifier in [-100, 0, 100]:  # 가능한 비용 수정값
                 for willpower in range(1, 6):
                     for corePoint in range(1, 6):
@@ -1098,64 +2156,165 @@ def _generate_probability_table_impl(memo=None, combo_memo=None, enable_visualiz
                                         )
                                         possible_first = [True, False] if is_valid_first else [False]
                                         for isFirstProcessing in possible_first:
-                                            try:
-                                                gem = GemState(
-                                                    willpower=willpower,
-                                                    corePoint=corePoint,
-                                                    dealerA=dealerA,
-                                                    dealerB=dealerB,
-                                                    supportA=supportA,
-                                                    supportB=supportB,
-                                                    remainingAttempts=remainingAttempts,
-                                                    currentRerollAttempts=currentRerollAttempts,
-                                                    costModifier=costModifier,
-                                                    isFirstProcessing=isFirstProcessing
-                                                )
-                                                # 확률 계산
-                                                _ = calculate_probabilities(gem, memo, combo_memo)
-                                                
-                                                # 상태 키 생성 및 저장 (확률 + 사용가능 옵션)
-                                                state_key = state_to_key(gem)
-                                                # memo에 결과가 자동으로 저장됨 (calculate_probabilities에서)
-                                                total_states += 1
-                                                
-                                            except Exception as e:
-                                                print(f"\n❌ 에러 발생!")
-                                                print(f"에러 메시지: {e}")
-                                                print(f"현재 젬 상태:")
-                                                print(f"  - willpower: {gem.willpower}")
-                                                print(f"  - corePoint: {gem.corePoint}")
-                                                print(f"  - dealerA: {gem.dealerA}")
-                                                print(f"  - dealerB: {gem.dealerB}")
-                                                print(f"  - supportA: {gem.supportA}")
-                                                print(f"  - supportB: {gem.supportB}")
-                                                print(f"  - remainingAttempts: {gem.remainingAttempts}")
-                                                print(f"  - currentRerollAttempts: {gem.currentRerollAttempts}")
-                                                print(f"  - isFirstProcessing: {gem.isFirstProcessing}")
-                                                
-                                                state_key = state_to_key(gem)
-                                                print(f"\n상태 키: {state_key}")
-                                                
-                                                if state_key in memo:
-                                                    print(f"memo[{state_key}] 내용:")
-                                                    print(f"  - keys: {memo[state_key].keys()}")
-                                                    if 'probabilities' in memo[state_key]:
-                                                        print(f"  - probabilities: {memo[state_key]['probabilities']}")
-                                                    if 'availableOptions' in memo[state_key]:
-                                                        print(f"  - availableOptions 개수: {len(memo[state_key]['availableOptions'])}")
-                                                else:
-                                                    print(f"memo에 {state_key} 키가 없음")
-                                                
-                                                # 에러를 다시 발생시켜 프로그램 중단
-                                                raise
+                                            yield GemState(
+                                                willpower=willpower,
+                                                corePoint=corePoint,
+                                                dealerA=dealerA,
+                                                dealerB=dealerB,
+                                                supportA=supportA,
+                                                supportB=supportB,
+                                                remainingAttempts=remainingAttempts,
+                                                currentRerollAttempts=currentRerollAttempts,
+                                                costModifier=costModifier,
+                                                isFirstProcessing=isFirstProcessing
+                                            )
+
+# 옵션 변경 액션 -> 원래 옵션 필드
+CHANGE_ACTIONS = {
+    'dealerA_change': 'dealerA',
+    'dealerB_change': 'dealerB',
+    'supportA_change': 'supportA',
+    'supportB_change': 'supportB'
+}
+
+def apply_processing_outcomes(gem: GemState, action: str) -> List[GemState]:
+    """가공 옵션 적용 시 나올 수 있는 모든 결과 상태 (옵션 변경은 비활성 옵션 각각으로 이동)"""
+    if action not in CHANGE_ACTIONS:
+        return [apply_processing(gem, action)]
+    
+    source = CHANGE_ACTIONS[action]
+    level = getattr(gem, source)
+    inactive_options = [opt for opt in ('dealerA', 'dealerB', 'supportA', 'supportB') if getattr(gem, opt) == 0]
+    outcomes = []
+    for inactive in inactive_options:
+        new_gem = apply_processing(gem, 'maintain')  # 시도 횟수 차감 등 공통 처리만 적용
+        setattr(new_gem, source, 0)
+        setattr(new_gem, inactive, level)
+        outcomes.append(new_gem)
+    return outcomes or [apply_processing(gem, 'maintain')]
+
+def capped_state(gem: GemState) -> GemState:
+    """리롤 횟수를 메모이제이션 상한으로 자른 대표 상태 (state_to_id가 같음)"""
+    if gem.currentRerollAttempts <= MAX_REROLL_FOR_MEMOIZATION:
+        return gem
+    return replace(gem, currentRerollAttempts=MAX_REROLL_FOR_MEMOIZATION)
+
+def enumerate_reachable_states() -> List[GemState]:
+    """VALID_FIRST_PROCESSING_COMBINATIONS의 초기 젬에서 도달 가능한 상태만 bottom-up 순서로 반환
+
+    초기 젬(의지력/질서혼돈/활성 옵션 2개 모두 1레벨, 비용 0, 첫 가공)에서 가공과 리롤을 따라
+    전방 탐색한다. 결과는 (remainingAttempts, currentRerollAttempts) 오름차순이므로
+    순서대로 계산하면 후속 상태는 항상 먼저 계산되어 있다.
+    """
+    effect_names = ('dealerA', 'dealerB', 'supportA', 'supportB')
+    frontier = []
+    for remainingAttempts, currentRerollAttempts in VALID_FIRST_PROCESSING_COMBINATIONS:
+        if currentRerollAttempts > MAX_REROLL_FOR_MEMOIZATION:
+            continue
+        for active in combinations(effect_names, 2):
+            levels = {name: (1 if name in active else 0) for name in effect_names}
+            frontier.append(GemState(willpower=1, corePoint=1, **levels,
+                                     remainingAttempts=remainingAttempts,
+                                     currentRerollAttempts=currentRerollAttempts,
+                                     costModifier=0, isFirstProcessing=True))
+    
+    reachable = {state_to_id(gem): gem for gem in frontier}
+    while frontier:
+        gem = frontier.pop()
+        if gem.remainingAttempts == 0:
+            continue
+        
+        successors = []
+        if gem.currentRerollAttempts > 0 and not gem.isFirstProcessing:
+            successors.append(replace(gem, currentRerollAttempts=gem.currentRerollAttempts - 1))
+        for option in get_available_options(gem):
+            successors.extend(apply_processing_outcomes(gem, option['action']))
+        
+        for successor in successors:
+            successor = capped_state(successor)
+            state_id = state_to_id(successor)
+            if state_id not in reachable:
+                reachable[state_id] = successor
+                frontier.append(successor)
+    
+    return sorted(reachable.values(), key=lambda gem: (gem.remainingAttempts, gem.currentRerollAttempts))
+
+def _generate_probability_table_impl(memo=None, combo_memo=None, enable_visualization=True,
+                                     progress_log_path=DEFAULT_PROGRESS_LOG_PATH, decisions=None,
+                                     reachable_only=False, sensitivities=None, threads=1, layer_writers=None,
+                                     approximation_errors=None):
+    """확률 테이블 생성 구현부 (메모이제이션 외부 제공 가능)
+
+    반환값은 상태 ID -> StateRecord memo이며, 기존 dict 형태는 내보낼 때(iter_table_items) 만든다.
+    decisions에 dict를 넘기면 상태별 조합 x 목표 최적 선택을 기록한다 (save_decision_table로 저장).
+    reachable_only이면 초기 젬에서 도달 가능한 상태만 계산한다 (enumerate_reachable_states).
+    sensitivities에 dict를 넘기면 상태별 목표 x 옵션 가중치 미분을 기록한다 (save_sensitivity_table로 저장).
+    threads가 2 이상이면 층별 스레드 풀로 계산한다 (calculate_probabilities_threaded).
+    layer_writers에 테이블 writer 목록을 넘기면 저메모리 모드로 계산한다 (calculate_probabilities_layer_window):
+    다 쓴 층은 writer들로 바로 내보내고 memo에서 지우므로 반환되는 memo는 비어 있다.
+    approximation_errors에 dict를 넘기면 근사 모드(APPROXIMATION_EPSILON)의 상태별 오차 상한을 기록한다
+    (save_approximation_table로 저장).
+    """
+    print("🎲 확률 테이블 생성 시작...")
     
+    # 전역 카운터 초기화
+    global calculation_counter, memo_hit_count, progress_log, decision_store, sensitivity_store, start_time
+    global approximation_error_store
+    calculation_counter = 0
+    memo_hit_count = 0
+    decision_store = decisions
+    sensitivity_store = sensitivities
+    approximation_error_store = approximation_errors
+    start_time = time.time()  # 전역 시작 시간 설정
+    
+    # 시각화 초기화 (생성 중에는 이벤트 로그만 기록, 영상은 render_progress_log로 별도 렌더링)
+    if enable_visualization:
+        try:
+            progress_log = ProgressEventLog(progress_log_path, max_attempts=MAX_REMAINING_ATTEMPTS + 1,
+                                           max_rerolls=MAX_REROLL_ATTEMPTS)
+            print(f"📊 진행 상황 이벤트 로그 기록: {progress_log_path}")
+        except Exception as e:
+            print(f"⚠️ 시각화 초기화 실패: {e}")
+            progress_log = None
+    
+    # 메모이제이션 초기화 또는 외부에서 제공받은 것 사용
+    if memo is None:
+        memo = {}
+    if combo_memo is None:
+        combo_memo = {}  # 조합 메모이제이션
+    
+    # 계산할 상태 순서: 전체 상태 (또는 초기 상태에서 도달 가능한 상태만)
+    if reachable_only:
+        states = enumerate_reachable_states()
+        print(f"🧭 도달 가능한 상태만 계산: {len(states)}개")
+    else:
+        states = enumerate_all_states()
+    
+    # 의존 순서대로 재귀 없이 계산 (후속 상태는 memo에서 바로 읽음)
+    if layer_writers is not None:
+        print(f"🪟 저메모리 모드: 시도 횟수 층 2개만 메모리에 유지하고 다 쓴 층은 바로 저장")
+        total_states = calculate_probabilities_layer_window(states, memo, combo_memo, layer_writers, threads)
+    elif threads > 1:
+        print(f"🧵 스레드 {threads}개로 층별 병렬 계산")
+        total_states = calculate_probabilities_threaded(states, memo, combo_memo, threads)
+    else:
+        total_states = calculate_probabilities_in_order(states, memo, combo_memo)
+
     end_time = time.time()
     elapsed_time = end_time - start_time
     
-    # 최종 시각화 업데이트
-    if visualizer:
-        visualizer.refresh_display()
-        print("📊 시각화 완료 - 창을 닫으려면 아무 키나 누르세요")
+    # 이벤트 로그 마무리
+    if progress_log:
+        progress_log.close()
+        progress_log = None
+    decision_store = None
+    sensitivity_store = None
+    approximation_error_store = None
+    
+    if approximation_errors:
+        bounds = np.fromiter(approximation_errors.values(), dtype=float, count=len(approximation_errors))
+        print(f"🧮 근사 모드 (ε={APPROXIMATION_EPSILON:g}): 목표 확률 오차 상한 최대 {bounds.max():.3g}, "
+              f"평균 {bounds.mean():.3g} ({np.count_nonzero(bounds)}/{len(bounds)}개 상태가 근사)")
     
     print(f"\n✅ 완료!")
     print(f"총 {total_states}개 상태 계산 완료")
@@ -1164,13 +2323,164 @@ def _generate_probability_table_impl(memo=None, combo_memo=None, enable_visualiz
     
     return memo
 
-def generate_probability_table_with_shared_memo(shared_memo: dict, shared_combo_memo: dict, enable_visualization: bool = True) -> dict:
+def generate_probability_table_with_shared_memo(shared_memo: dict, shared_combo_memo: dict, enable_visualization: bool = True,
+                                                progress_log_path: str = DEFAULT_PROGRESS_LOG_PATH,
+                                                decisions: dict = None, reachable_only: bool = False,
+                                                sensitivities: dict = None, threads: int = 1,
+                                                layer_writers: list = None, approximation_errors: dict = None) -> dict:
     """메모이제이션을 공유하며 확률 테이블 생성"""
-    return _generate_probability_table_impl(shared_memo, shared_combo_memo, enable_visualization)
+    return _generate_probability_table_impl(shared_memo, shared_combo_memo, enable_visualization, progress_log_path,
+                                            decisions, reachable_only, sensitivities, threads, layer_writers,
+                                            approximation_errors)
 
-def generate_probability_table(enable_visualization: bool = True) -> dict:
+def generate_probability_table(enable_visualization: bool = True, progress_log_path: str = DEFAULT_PROGRESS_LOG_PATH,
+                               reachable_only: bool = False) -> dict:
     """기본 확률 테이블 생성 (독립적인 메모이제이션 사용)"""
-    return _generate_probability_table_impl(None, None, enable_visualization)
+    return _generate_probability_table_impl(None, None, enable_visualization, progress_log_path,
+                                            reachable_only=reachable_only)
+
+def generate_probability_tables_for_weight_configs(weight_configs: List[Tuple[str, Dict[str, float]]],
+                                                   reachable_only: bool = False) -> List[dict]:
+    """여러 가중치 구성의 확률 테이블을 한 번의 상태 순회로 생성 (구성마다 상태 ID -> StateRecord memo 하나씩)
+
+    결정 기록, 민감도, 진행 이벤트 로그는 일괄 모드에서 지원하지 않는다.
+    """
+    global batch_weight_matrix, calculation_counter, start_time
+    print(f"🎲 가중치 구성 {len(weight_configs)}개 일괄 생성 시작: {', '.join(name for name, _ in weight_configs)}")
+    batch_weight_matrix = np.array([[weights[action] for action in OPTION_ACTIONS] for _, weights in weight_configs])
+    calculation_counter = 0
+    start_time = time.time()
+    
+    memo = {}
+    combo_memo = {}
+    states = enumerate_reachable_states() if reachable_only else enumerate_all_states()
+    calculate_probabilities_batch_in_order(states, memo, combo_memo)
+    
+    tables = [{state_id: record.config_record(config_idx) for state_id, record in memo.items()}
+              for config_idx in range(len(weight_configs))]
+    batch_weight_matrix = None
+    
+    elapsed_time = time.time() - start_time
+    print(f"✅ 일괄 생성 완료: {len(memo)}개 상태 x {len(weight_configs)}개 구성, "
+          f"{len(combo_memo)}개 조합 패턴, 소요시간: {elapsed_time:.2f}s")
+    return tables
+
+# 내보내기 정밀도 (--precision): float64는 원래 값 그대로
+EXPORT_PRECISIONS = ('float64', 'float32', 'float16', 'fixed')
+FIXED_POINT_SCALES = {'probability': 1_000_000, 'cost': 100}  # 고정소수점: 확률 1e-6, 비용 0.01골드 단위 정수
+PRECISION_SIGNIFICANT_DIGITS = {'float32': 8, 'float16': 4}  # JSON/SQLite에 쓰는 유효 자릿수
+PRECISION_DTYPES = {'float64': '<f8', 'float32': '<f4', 'float16': '<f2', 'fixed': '<u4'}
+
+def quantize_values(values: np.ndarray, precision: str, cost_mask) -> Tuple[np.ndarray, np.ndarray]:
+    """값 배열을 내보내기 정밀도로 양자화 -> (바이너리 저장 배열, JSON/SQLite에 쓸 float64 값)
+
+    cost_mask가 True인 위치는 비용(고정소수점 0.01골드), 나머지는 확률(1e-6) 단위다.
+    float32/float16은 변환 후 유효 자릿수로 반올림해 텍스트 표현을 짧게 만든다 (k / 10^m 꼴이라 repr이 짧음).
+    """
+    if precision == 'float64':
+        return values.astype('<f8'), values
+    if precision == 'fixed':
+        scales = np.where(cost_mask, FIXED_POINT_SCALES['cost'], FIXED_POINT_SCALES['probability'])
+        encoded = np.round(values * scales)
+        return encoded.astype('<u4'), encoded / scales
+    
+    encoded = values.astype(PRECISION_DTYPES[precision])
+    decoded = encoded.astype(np.float64)
+    nonzero = decoded != 0
+    magnitude = np.floor(np.log10(np.abs(decoded, where=nonzero, out=np.ones_like(decoded))))
+    decimals = np.clip(PRECISION_SIGNIFICANT_DIGITS[precision] - 1 - magnitude, -20, 20)
+    scales = 10.0 ** decimals
+    return encoded, np.where(nonzero, np.round(decoded * scales) / scales, 0.0)
+
+class QuantizationReport:
+    """양자화한 값의 목표별 최대 절대 오차 (확률, 퍼센타일, 기대 비용) 및 옵션 선택 확률 최대 오차"""
+
+    def __init__(self, precision: str):
+        self.precision = precision
+        self.max_errors = {kind: np.zeros(len(TARGETS)) for kind in ('probability', 'percentile', 'cost')}
+        self.max_selection_error = 0.0
+
+    def update_values(self, errors: np.ndarray, has_cost_policy: bool):
+        """(상태 x [확률 T | 기대 비용 T | 퍼센타일 T*P | (비용 효율 정책 2T)]) 절대 오차 반영"""
+        target_count = len(TARGETS)
+        percentile_end = target_count * (2 + len(PERCENTILE_GRID))
+        blocks = {
+            'probability': [errors[:, :target_count]],
+            'cost': [errors[:, target_count:2 * target_count]],
+            'percentile': [errors[:, 2 * target_count:percentile_end].reshape(len(errors), target_count, -1).max(axis=2)]
+        }
+        if has_cost_policy:
+            blocks['probability'].append(errors[:, percentile_end:percentile_end + target_count])
+            blocks['cost'].append(errors[:, percentile_end + target_count:])
+        for kind, kind_blocks in blocks.items():
+            for block in kind_blocks:
+                if len(block):
+                    np.maximum(self.max_errors[kind], block.max(axis=0), out=self.max_errors[kind])
+
+    def update_selection(self, errors: np.ndarray):
+        """옵션 선택 확률 절대 오차 반영"""
+        if len(errors):
+            self.max_selection_error = max(self.max_selection_error, float(errors.max()))
+
+    def to_dict(self) -> Dict[str, Dict[str, float]]:
+        """목표 -> {'probability', 'percentile', 'cost'} 최대 절대 오차"""
+        return {target: {kind: float(errors[i]) for kind, errors in self.max_errors.items()}
+                for i, target in enumerate(TARGETS)}
+
+    def print_summary(self):
+        print(f"🔢 내보내기 정밀도 {self.precision}: 목표별 최대 절대 오차 (확률 / 퍼센타일 / 기대 비용)")
+        for target, errors in self.to_dict().items():
+            print(f"  - {target}: {errors['probability']:.3g} / {errors['percentile']:.3g} / {errors['cost']:.3g}")
+        print(f"  - 옵션 선택 확률: {self.max_selection_error:.3g}")
+
+def iter_table_items(table: dict, precision: str = 'float64', report: QuantizationReport = None):
+    """테이블을 (상태 키 문자열, 기존 memo 형태 dict) 쌍으로 하나씩 변환하며 순회
+
+    StateRecord는 여기서만 dict로 만들어지므로 전체 테이블을 dict로 펼치지 않는다.
+    precision이 float64가 아니면 값을 양자화해서 내보낸다 (report에 오차 누적).
+    JSON에서 읽은 기존 dict 테이블은 양자화 없이 그대로 통과시킨다.
+    """
+    for key, record in table.items():
+        if isinstance(record, StateRecord):
+            if precision != 'float64':
+                record = record.quantized(precision, report)
+            yield state_id_to_key(key), record.to_dict()
+        else:
+            yield key, record
+
+class JsonTableWriter:
+    """확률 테이블 JSON 파일을 상태 묶음 단위로 이어 쓰는 writer (precision으로 값 양자화)
+
+    save_to_json과 저메모리 생성(--low-memory: calculate_probabilities_layer_window에 layer_writers로 전달)이 함께 쓴다.
+    """
+
+    def __init__(self, json_path: str, precision: str = 'float64'):
+        self.precision = precision
+        self.report = QuantizationReport(precision) if precision != 'float64' else None
+        self.state_count = 0
+        self.file = open(json_path, 'w', encoding='utf-8')
+        self.file.write('{')
+
+    def write(self, table: dict):
+        """상태 묶음 하나를 이어 씀 (table 순서대로)"""
+        for state_key, state_data in iter_table_items(table, self.precision, self.report):
+            entry = json.dumps(state_data, ensure_ascii=False, indent=2).replace('\n', '\n  ')
+            self.file.write(f'{"," if self.state_count else ""}\n  {json.dumps(state_key)}: {entry}')
+            self.state_count += 1
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.file.write('\n}')
+        self.file.close()
+        if self.report:
+            self.report.print_summary()
+
+def save_to_json(table: dict, json_path: str, precision: str = 'float64'):
+    """확률 테이블을 JSON 파일로 저장 (상태 단위로 스트리밍, precision으로 값 양자화)"""
+    writer = JsonTableWriter(json_path, precision)
+    writer.write(table)
+    writer.close()
 
 def create_database_schema(db_path: str):
     """SQLite 데이터베이스 스키마 생성"""
@@ -1178,6 +2488,8 @@ def create_database_schema(db_path: str):
     cursor = conn.cursor()
     
     # 목표별 확률 테이블
+    probability_columns = ',\n            '.join(f"{definition['column']} REAL NOT NULL"
+                                             for definition in TARGET_DEFINITIONS)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS goal_probabilities (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -1191,23 +2503,12 @@ def create_database_schema(db_path: str):
             currentRerollAttempts INTEGER NOT NULL,
             costModifier INTEGER NOT NULL,
             isFirstProcessing BOOLEAN NOT NULL,
-            -- 확률들
-            prob_5_5 REAL NOT NULL,
-            prob_5_4 REAL NOT NULL,
-            prob_4_5 REAL NOT NULL,
-            prob_5_3 REAL NOT NULL,
-            prob_4_4 REAL NOT NULL,
-            prob_3_5 REAL NOT NULL,
-            prob_sum8 REAL NOT NULL,
-            prob_sum9 REAL NOT NULL,
-            prob_relic REAL NOT NULL,
-            prob_ancient REAL NOT NULL,
-            prob_dealer_complete REAL NOT NULL,
-            prob_support_complete REAL NOT NULL,
+            -- 확률들 (TARGET_DEFINITIONS에서 자동 생성)
+            {probability_columns},
             UNIQUE(willpower, corePoint, dealerA, dealerB, supportA, supportB, 
                    remainingAttempts, currentRerollAttempts, costModifier, isFirstProcessing)
         )
-    """)
+    """.format(probability_columns=probability_columns))
     
     # 목표별 확률 분포 테이블 (CDF/percentile 데이터)
     cursor.execute("""
@@ -1240,12 +2541,29 @@ def create_database_schema(db_path: str):
             gem_state_id INTEGER NOT NULL,
             target TEXT NOT NULL,
             expected_cost_to_goal REAL NOT NULL,
+            -- 비용 효율 정책 (COST_OBJECTIVE_SUCCESS_VALUE로 생성한 경우만, 아니면 NULL)
+            cost_optimal_probability REAL,
+            cost_optimal_expected_cost REAL,
             FOREIGN KEY (gem_state_id) REFERENCES goal_probabilities (id),
             PRIMARY KEY (gem_state_id, target)
         )
     """)
     
+    # 상태별 내용 해시 (증분 갱신에서 바뀐 상태만 다시 쓰기 위함)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS state_hashes (
+            gem_state_id INTEGER PRIMARY KEY,
+            hash BLOB NOT NULL,
+            FOREIGN KEY (gem_state_id) REFERENCES goal_probabilities (id)
+        )
+    """)
+    
     # 인덱스 생성
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_available_options_state
+        ON available_options (gem_state_id)
+    """)
+    
     cursor.execute("""
         CREATE INDEX IF NOT EXISTS idx_willpower_corepoint 
         ON goal_probabilities (willpower, corePoint)
@@ -1256,13 +2574,133 @@ def create_database_schema(db_path: str):
         ON expected_costs (target, expected_cost_to_goal)
     """)
     
+    # 이미 있던 DB는 CREATE TABLE IF NOT EXISTS로 컬럼이 바뀌지 않으므로 따로 맞춤
+    if not migrate_database_schema(cursor):
+        conn.close()
+        os.remove(db_path)
+        create_database_schema(db_path)
+        return
+    
     conn.commit()
     conn.close()
     print(f"📋 데이터베이스 스키마 생성 완료: {db_path}")
 
-def save_to_database(table: dict, db_path: str):
-    """확률 테이블을 SQLite 데이터베이스에 저장"""
-    print(f"💾 데이터베이스에 저장 중: {db_path}")
+def migrate_database_schema(cursor) -> bool:
+    """예전 스키마로 만든 DB에 빠진 컬럼(목표 확률, 비용 효율 정책)을 추가
+
+    기존 행의 새 목표 확률은 0으로 채워지고, 내용 해시가 달라지므로 증분 갱신에서도 다시 쓰인다.
+    현재 목표 정의에 없는 목표 확률 컬럼이 남아 있으면 (NOT NULL이라 새 행을 넣을 수 없음) False를 반환한다.
+    """
+    table_columns = {table: {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+                     for table in ('goal_probabilities', 'expected_costs')}
+    target_columns = [definition['column'] for definition in TARGET_DEFINITIONS]
+    stale_columns = sorted(column for column in table_columns['goal_probabilities']
+                           if column.startswith('prob_') and column not in target_columns)
+    if stale_columns:
+        print(f"⚠️ 기존 DB에 현재 목표 정의에 없는 컬럼이 있어 새로 만듭니다: {', '.join(stale_columns)}")
+        return False
+    
+    added_columns = []
+    for column in target_columns:
+        if column not in table_columns['goal_probabilities']:
+            cursor.execute(f"ALTER TABLE goal_probabilities ADD COLUMN {column} REAL NOT NULL DEFAULT 0")
+            added_columns.append(column)
+    for column in ('cost_optimal_probability', 'cost_optimal_expected_cost'):
+        if column not in table_columns['expected_costs']:
+            cursor.execute(f"ALTER TABLE expected_costs ADD COLUMN {column} REAL")
+            added_columns.append(column)
+    if added_columns:
+        print(f"🔧 기존 DB 스키마에 컬럼 추가: {', '.join(added_columns)}")
+    return True
+
+def state_data_hash(state_data: Dict[str, Any]) -> bytes:
+    """내보내는 상태 dict 하나의 내용 해시 (양자화 후 값 기준이므로 정밀도 아래의 변화는 무시됨)"""
+    return hashlib.blake2b(json.dumps(state_data, sort_keys=True).encode('utf-8'), digest_size=16).digest()
+
+# 상태 하나에 딸린 행들 (증분 갱신 시 바뀐 상태는 지우고 다시 씀)
+STATE_CHILD_TABLES = ('goal_probability_distributions', 'available_options', 'expected_costs', 'state_hashes')
+
+def insert_state_child_rows(cursor, gem_state_id: int, state_data: Dict[str, Any], state_hash: bytes):
+    """상태 하나의 퍼센타일, 옵션, 기대 비용, 해시 행 저장"""
+    # CDF 데이터 저장
+    for target, percentile_data in state_data.get('percentiles', {}).items():
+        if isinstance(percentile_data, dict):
+            for percentile, value in percentile_data.items():
+                cursor.execute("""
+                    INSERT OR REPLACE INTO goal_probability_distributions (
+                        gem_state_id, target, percentile, value
+                    ) VALUES (?, ?, ?, ?)
+                """, (gem_state_id, target, percentile, value))
+    
+    # 사용 가능한 옵션들 저장
+    for option in state_data.get('availableOptions', []):
+        cursor.execute("""
+            INSERT INTO available_options (
+                gem_state_id, action, probability, description, selectionProbability
+            ) VALUES (?, ?, ?, ?, ?)
+        """, (
+            gem_state_id,
+            option.get('action', ''),
+            option.get('probability', 0.0),
+            option.get('description', ''),
+            option.get('selectionProbability', 0.0)
+        ))
+    
+    # Expected costs 저장 (비용 효율 정책 값이 있으면 같은 행에)
+    expected_costs = state_data.get('expectedCosts', {})
+    cost_optimal = state_data.get('costOptimal', {})
+    for target, cost in expected_costs.items():
+        cursor.execute("""
+            INSERT INTO expected_costs (
+                gem_state_id, target, expected_cost_to_goal,
+                cost_optimal_probability, cost_optimal_expected_cost
+            ) VALUES (?, ?, ?, ?, ?)
+        """, (gem_state_id, target, cost,
+              cost_optimal.get('probabilities', {}).get(target),
+              cost_optimal.get('expectedCosts', {}).get(target)))
+    
+    cursor.execute("INSERT OR REPLACE INTO state_hashes (gem_state_id, hash) VALUES (?, ?)", (gem_state_id, state_hash))
+
+def delete_state_child_rows(cursor, gem_state_id: int):
+    for child_table in STATE_CHILD_TABLES:
+        cursor.execute(f"DELETE FROM {child_table} WHERE gem_state_id = ?", (gem_state_id,))
+
+def goal_probability_insert_sql() -> str:
+    """goal_probabilities 행 INSERT 문 (상태 필드 10개 + TARGET_DEFINITIONS 순서의 목표 확률)"""
+    probability_columns = [definition['column'] for definition in TARGET_DEFINITIONS]
+    return f"""
+            INSERT OR REPLACE INTO goal_probabilities (
+                willpower, corePoint, dealerA, dealerB, supportA, supportB,
+                remainingAttempts, currentRerollAttempts, costModifier, isFirstProcessing,
+                {', '.join(probability_columns)}
+            ) VALUES ({', '.join(['?'] * (10 + len(probability_columns)))})
+        """
+
+def save_export_precision(cursor, report: QuantizationReport, precision: str):
+    """양자화 정확도 기록 (목표별 최대 절대 오차) 후 요약 출력"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS export_precision (
+            target TEXT PRIMARY KEY,
+            precision TEXT NOT NULL,
+            max_probability_error REAL NOT NULL,
+            max_percentile_error REAL NOT NULL,
+            max_cost_error REAL NOT NULL
+        )
+    """)
+    cursor.executemany("INSERT OR REPLACE INTO export_precision VALUES (?, ?, ?, ?, ?)",
+                       [(target, precision, errors['probability'], errors['percentile'], errors['cost'])
+                        for target, errors in report.to_dict().items()])
+    report.print_summary()
+
+def save_to_database(table: dict, db_path: str, precision: str = 'float64', incremental: bool = False):
+    """확률 테이블을 SQLite 데이터베이스에 저장
+
+    precision이 float64가 아니면 값을 양자화해서 저장하고, 목표별 최대 절대 오차를 export_precision 테이블에 기록한다.
+    incremental이면 기존 DB의 상태별 내용 해시(state_hashes)와 비교해 바뀐 상태의 행만 다시 쓰고,
+    새 테이블에 없는 상태는 지운다. 해시가 없는 예전 DB는 모든 상태를 바뀐 것으로 본다
+    (예전 스키마의 빠진 컬럼은 create_database_schema가 먼저 추가해 둔다).
+    """
+    print(f"💾 데이터베이스에 {'증분 ' if incremental else ''}저장 중: {db_path}")
     
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
@@ -1270,7 +2708,27 @@ def save_to_database(table: dict, db_path: str):
     total_states = len(table)
     processed = 0
     
-    for state_key, state_data in table.items():
+    # 목표 확률 컬럼은 TARGET_DEFINITIONS 순서
+    probability_columns = [definition['column'] for definition in TARGET_DEFINITIONS]
+    insert_state_sql = goal_probability_insert_sql()
+    update_state_sql = f"""
+            UPDATE goal_probabilities SET {', '.join(f'{column} = ?' for column in probability_columns)}
+            WHERE id = ?
+        """
+    
+    # 증분 갱신: 상태 키 -> (행 ID, 저장된 해시)
+    existing_states = {}
+    if incremental:
+        for row in cursor.execute("""
+            SELECT g.id, g.willpower, g.corePoint, g.dealerA, g.dealerB, g.supportA, g.supportB,
+                   g.remainingAttempts, g.currentRerollAttempts, g.costModifier, g.isFirstProcessing, h.hash
+            FROM goal_probabilities g LEFT JOIN state_hashes h ON h.gem_state_id = g.id
+        """):
+            existing_states[','.join(map(str, row[1:11]))] = (row[0], row[11])
+    change_counts = {'unchanged': 0, 'updated': 0, 'inserted': 0, 'deleted': 0}
+    
+    report = QuantizationReport(precision) if precision != 'float64' else None
+    for state_key, state_data in iter_table_items(table, precision, report):
         # 상태 키 파싱
         parts = state_key.split(',')
         if len(parts) != 10:
@@ -1280,76 +2738,49 @@ def save_to_database(table: dict, db_path: str):
         isFirstProcessing = bool(isFirst)
         
         probabilities = state_data['probabilities']
-        available_options = state_data.get('availableOptions', [])
-        
-        # 퍼센타일 정보 추출
-        percentiles = state_data.get('percentiles', {})
-        
-        # 젬 상태 저장
-        cursor.execute("""
-            INSERT OR REPLACE INTO goal_probabilities (
-                willpower, corePoint, dealerA, dealerB, supportA, supportB,
-                remainingAttempts, currentRerollAttempts, costModifier, isFirstProcessing,
-                prob_5_5, prob_5_4, prob_4_5, prob_5_3, prob_4_4, prob_3_5,
-                prob_sum8, prob_sum9, prob_relic, prob_ancient, prob_dealer_complete, prob_support_complete
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            wp, cp, dealerA, dealerB, supportA, supportB,
-            attempts, reroll, cost, isFirstProcessing,
-            probabilities.get('5/5', 0.0),
-            probabilities.get('5/4', 0.0),
-            probabilities.get('4/5', 0.0),
-            probabilities.get('5/3', 0.0),
-            probabilities.get('4/4', 0.0),
-            probabilities.get('3/5', 0.0),
-            probabilities.get('sum8+', 0.0),
-            probabilities.get('sum9+', 0.0),
-            probabilities.get('relic+', 0.0),
-            probabilities.get('ancient+', 0.0),
-            probabilities.get('dealer_complete', 0.0),
-            probabilities.get('support_complete', 0.0)
-        ))
-        
-        gem_state_id = cursor.lastrowid
-        
-        # CDF 데이터 저장
-        for target, percentile_data in percentiles.items():
-            if isinstance(percentile_data, dict):
-                for percentile, value in percentile_data.items():
-                    cursor.execute("""
-                        INSERT OR REPLACE INTO goal_probability_distributions (
-                            gem_state_id, target, percentile, value
-                        ) VALUES (?, ?, ?, ?)
-                    """, (gem_state_id, target, percentile, value))
+        probability_values = [probabilities.get(definition['name'], 0.0) for definition in TARGET_DEFINITIONS]
+        state_hash = state_data_hash(state_data)
+        processed += 1
         
-        # 사용 가능한 옵션들 저장
-        for option in available_options:
-            cursor.execute("""
-                INSERT INTO available_options (
-                    gem_state_id, action, probability, description, selectionProbability
-                ) VALUES (?, ?, ?, ?, ?)
-            """, (
-                gem_state_id,
-                option.get('action', ''),
-                option.get('probability', 0.0),
-                option.get('description', ''),
-                option.get('selectionProbability', 0.0)
+        if state_key in existing_states:
+            # 기존 상태: 내용이 같으면 건너뛰고, 바뀌었으면 같은 행 ID로 다시 씀
+            gem_state_id, stored_hash = existing_states.pop(state_key)
+            if stored_hash == state_hash:
+                change_counts['unchanged'] += 1
+                continue
+            cursor.execute(update_state_sql, (*probability_values, gem_state_id))
+            delete_state_child_rows(cursor, gem_state_id)
+            change_counts['updated'] += 1
+        else:
+            # 젬 상태 저장
+            cursor.execute(insert_state_sql, (
+                wp, cp, dealerA, dealerB, supportA, supportB,
+                attempts, reroll, cost, isFirstProcessing,
+                *probability_values
             ))
+            gem_state_id = cursor.lastrowid
+            change_counts['inserted'] += 1
         
-        # Expected costs 저장
-        expected_costs = state_data.get('expectedCosts', {})
-        for target, cost in expected_costs.items():
-            cursor.execute("""
-                INSERT INTO expected_costs (
-                    gem_state_id, target, expected_cost_to_goal
-                ) VALUES (?, ?, ?)
-            """, (gem_state_id, target, cost))
+        insert_state_child_rows(cursor, gem_state_id, state_data, state_hash)
         
-        processed += 1
         if processed % 1000 == 0:
             print(f"진행: {processed}/{total_states} ({processed/total_states*100:.1f}%)")
             conn.commit()
     
+    # 새 테이블에 없는 상태 삭제
+    for gem_state_id, _ in existing_states.values():
+        delete_state_child_rows(cursor, gem_state_id)
+        cursor.execute("DELETE FROM goal_probabilities WHERE id = ?", (gem_state_id,))
+        change_counts['deleted'] += 1
+    if incremental:
+        print(f"🔁 증분 갱신: 변경 {change_counts['updated']}개, 추가 {change_counts['inserted']}개, "
+              f"삭제 {change_counts['deleted']}개, 동일 {change_counts['unchanged']}개 "
+              f"({(change_counts['updated'] + change_counts['inserted']) / max(total_states, 1) * 100:.1f}% 다시 씀)")
+    
+    # 양자화 정확도 기록 (목표별 최대 절대 오차)
+    if report:
+        save_export_precision(cursor, report, precision)
+    
     conn.commit()
     conn.close()
     
@@ -1357,19 +2788,1119 @@ def save_to_database(table: dict, db_path: str):
     file_size_mb = os.path.getsize(db_path) / 1024 / 1024
     print(f"💾 데이터베이스 저장 완료: {db_path} ({file_size_mb:.1f} MB)")
 
+class DatabaseTableWriter:
+    """create_database_schema로 새로 만든 DB에 상태 묶음 단위로 이어 쓰는 writer (저메모리 생성용, 증분 갱신 없음)"""
+
+    def __init__(self, db_path: str, precision: str = 'float64'):
+        print(f"💾 데이터베이스에 묶음 단위로 저장 중: {db_path}")
+        self.db_path = db_path
+        self.precision = precision
+        self.report = QuantizationReport(precision) if precision != 'float64' else None
+        self.state_count = 0
+        self.insert_state_sql = goal_probability_insert_sql()
+        self.conn = sqlite3.connect(db_path)
+        self.cursor = self.conn.cursor()
+
+    def write(self, table: dict):
+        """상태 묶음 하나를 저장하고 커밋"""
+        for state_key, state_data in iter_table_items(table, self.precision, self.report):
+            wp, cp, dealerA, dealerB, supportA, supportB, attempts, reroll, cost, isFirst = map(int, state_key.split(','))
+            probabilities = state_data['probabilities']
+            self.cursor.execute(self.insert_state_sql, (
+                wp, cp, dealerA, dealerB, supportA, supportB, attempts, reroll, cost, bool(isFirst),
+                *(probabilities.get(definition['name'], 0.0) for definition in TARGET_DEFINITIONS)
+            ))
+            insert_state_child_rows(self.cursor, self.cursor.lastrowid, state_data, state_data_hash(state_data))
+            self.state_count += 1
+        self.conn.commit()
+
+    def close(self):
+        if self.conn is None:
+            return
+        if self.report:
+            save_export_precision(self.cursor, self.report, self.precision)
+        self.conn.commit()
+        self.conn.close()
+        self.conn = None
+        file_size_mb = os.path.getsize(self.db_path) / 1024 / 1024
+        print(f"💾 데이터베이스 저장 완료: {self.db_path} ({self.state_count}개 상태, {file_size_mb:.1f} MB)")
+
+# 상태 ID 키 레이아웃 DB: 메인/하위 테이블 모두 WITHOUT ROWID로 상태 ID 순서대로 클러스터링
+KEYED_DB_BATCH_STATES = 1000  # executemany로 한 번에 넣는 상태 수
+
+def create_keyed_database_schema(db_path: str):
+    """상태 ID 키 레이아웃의 SQLite 스키마 생성 (조회 전용 내보내기, 기존 파일은 새로 만듦)
+
+    goal_probabilities.id가 state_to_id의 상태 ID 자체라서 10개 컬럼 UNIQUE 인덱스를 거치지 않고
+    기본 키 B-tree 한 번으로 찾는다. 하위 테이블도 (gem_state_id, ...) 기본 키의 WITHOUT ROWID라서
+    한 상태의 행들이 같은 페이지에 모여 있다. server.js가 쓰지 않는 보조 인덱스는 만들지 않는다.
+    """
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    # 목표별 확률 테이블 (상태 필드 컬럼은 server.js 응답 형태를 위해 유지, 인덱스 없음)
+    probability_columns = ',\n            '.join(f"{definition['column']} REAL NOT NULL"
+                                             for definition in TARGET_DEFINITIONS)
+    cursor.execute("""
+        CREATE TABLE goal_probabilities (
+            id INTEGER PRIMARY KEY,
+            willpower INTEGER NOT NULL,
+            corePoint INTEGER NOT NULL,
+            dealerA INTEGER NOT NULL,
+            dealerB INTEGER NOT NULL,
+            supportA INTEGER NOT NULL,
+            supportB INTEGER NOT NULL,
+            remainingAttempts INTEGER NOT NULL,
+            currentRerollAttempts INTEGER NOT NULL,
+            costModifier INTEGER NOT NULL,
+            isFirstProcessing BOOLEAN NOT NULL,
+            {probability_columns}
+        ) WITHOUT ROWID
+    """.format(probability_columns=probability_columns))
+    
+    cursor.execute("""
+        CREATE TABLE goal_probability_distributions (
+            gem_state_id INTEGER NOT NULL,
+            target TEXT NOT NULL,
+            percentile INTEGER NOT NULL,
+            value REAL NOT NULL,
+            PRIMARY KEY (gem_state_id, target, percentile)
+        ) WITHOUT ROWID
+    """)
+    
+    # 옵션은 상태 내 순서(option_index)로 기본 키 구성
+    cursor.execute("""
+        CREATE TABLE available_options (
+            gem_state_id INTEGER NOT NULL,
+            option_index INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            probability REAL NOT NULL,
+            description TEXT NOT NULL,
+            selectionProbability REAL NOT NULL,
+            PRIMARY KEY (gem_state_id, option_index)
+        ) WITHOUT ROWID
+    """)
+    
+    cursor.execute("""
+        CREATE TABLE expected_costs (
+            gem_state_id INTEGER NOT NULL,
+            target TEXT NOT NULL,
+            expected_cost_to_goal REAL NOT NULL,
+            cost_optimal_probability REAL,
+            cost_optimal_expected_cost REAL,
+            PRIMARY KEY (gem_state_id, target)
+        ) WITHOUT ROWID
+    """)
+    
+    # 레이아웃 정보 (server.js가 상태 ID를 직접 계산할지 판단)
+    cursor.execute("""
+        CREATE TABLE table_layout (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        ) WITHOUT ROWID
+    """)
+    cursor.executemany("INSERT INTO table_layout VALUES (?, ?)",
+                       [('layout', 'state_id'), ('reroll_cap', str(MAX_REROLL_FOR_MEMOIZATION))])
+    
+    conn.commit()
+    conn.close()
+    print(f"📋 상태 ID 키 데이터베이스 스키마 생성 완료: {db_path}")
+
+class KeyedDatabaseTableWriter:
+    """상태 ID 키 레이아웃 DB(create_keyed_database_schema)에 상태 묶음 단위로 이어 쓰는 writer
+
+    묶음 안에서는 B-tree에 키 순서대로 붙여 쓰도록 상태 ID 순으로 넣는다.
+    """
+
+    def __init__(self, db_path: str, precision: str = 'float64'):
+        print(f"💾 상태 ID 키 데이터베이스에 저장 중: {db_path}")
+        self.db_path = db_path
+        self.precision = precision
+        self.report = QuantizationReport(precision) if precision != 'float64' else None
+        self.state_count = 0
+        probability_columns = [definition['column'] for definition in TARGET_DEFINITIONS]
+        self.insert_state_sql = f"""
+            INSERT INTO goal_probabilities (
+                id, willpower, corePoint, dealerA, dealerB, supportA, supportB,
+                remainingAttempts, currentRerollAttempts, costModifier, isFirstProcessing,
+                {', '.join(probability_columns)}
+            ) VALUES ({', '.join(['?'] * (11 + len(probability_columns)))})
+        """
+        self.batches = {'states': [], 'percentiles': [], 'options': [], 'costs': []}
+        self.conn = sqlite3.connect(db_path)
+        self.cursor = self.conn.cursor()
+
+    def flush_batches(self):
+        self.cursor.executemany(self.insert_state_sql, self.batches['states'])
+        self.cursor.executemany("INSERT INTO goal_probability_distributions VALUES (?, ?, ?, ?)", self.batches['percentiles'])
+        self.cursor.executemany("INSERT INTO available_options VALUES (?, ?, ?, ?, ?, ?)", self.batches['options'])
+        self.cursor.executemany("INSERT INTO expected_costs VALUES (?, ?, ?, ?, ?)", self.batches['costs'])
+        for rows in self.batches.values():
+            rows.clear()
+
+    def write(self, table: dict):
+        """상태 묶음 하나를 상태 ID 순으로 저장하고 커밋"""
+        # 상태 ID 순으로 정렬한 얕은 사본 (값 객체는 공유)
+        state_id_of = (lambda key: key) if all(isinstance(key, int) for key in table) else state_key_to_id
+        sorted_table = {key: table[key] for key in sorted(table, key=state_id_of)}
+        
+        batches = self.batches
+        for state_key, state_data in iter_table_items(sorted_table, self.precision, self.report):
+            fields = tuple(map(int, state_key.split(',')))
+            gem_state_id = state_key_to_id(state_key)
+            probabilities = state_data['probabilities']
+            batches['states'].append((gem_state_id, *fields[:9], bool(fields[9]),
+                                      *(probabilities.get(definition['name'], 0.0) for definition in TARGET_DEFINITIONS)))
+            
+            for target, percentile_data in state_data.get('percentiles', {}).items():
+                if isinstance(percentile_data, dict):
+                    batches['percentiles'].extend((gem_state_id, target, int(percentile), value)
+                                                  for percentile, value in percentile_data.items())
+            
+            batches['options'].extend((gem_state_id, option_index, option.get('action', ''), option.get('probability', 0.0),
+                                       option.get('description', ''), option.get('selectionProbability', 0.0))
+                                      for option_index, option in enumerate(state_data.get('availableOptions', [])))
+            
+            cost_optimal = state_data.get('costOptimal', {})
+            batches['costs'].extend((gem_state_id, target, cost,
+                                     cost_optimal.get('probabilities', {}).get(target),
+                                     cost_optimal.get('expectedCosts', {}).get(target))
+                                    for target, cost in state_data.get('expectedCosts', {}).items())
+            
+            self.state_count += 1
+            if self.state_count % KEYED_DB_BATCH_STATES == 0:
+                self.flush_batches()
+        self.flush_batches()
+        self.conn.commit()
+
+    def close(self):
+        if self.conn is None:
+            return
+        if self.report:
+            save_export_precision(self.cursor, self.report, self.precision)
+        self.conn.commit()
+        self.conn.close()
+        self.conn = None
+        file_size_mb = os.path.getsize(self.db_path) / 1024 / 1024
+        print(f"💾 상태 ID 키 데이터베이스 저장 완료: {self.db_path} ({self.state_count}개 상태, {file_size_mb:.1f} MB)")
+
+def save_to_keyed_database(table: dict, db_path: str, precision: str = 'float64'):
+    """확률 테이블을 상태 ID 키 레이아웃 DB에 저장 (create_keyed_database_schema로 만든 파일)"""
+    writer = KeyedDatabaseTableWriter(db_path, precision)
+    writer.write(table)
+    writer.close()
+
+def database_uses_state_id_keys(conn) -> bool:
+    """create_keyed_database_schema로 만든 DB인지 (table_layout.layout = 'state_id')"""
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'table_layout'").fetchone():
+        return False
+    row = conn.execute("SELECT value FROM table_layout WHERE name = 'layout'").fetchone()
+    return bool(row) and row[0] == 'state_id'
+
+def benchmark_database_lookups(db_paths: List[str], samples: int = 2000, seed: int = 0):
+    """DB 레이아웃별 server.js 단건 조회(/api/gem-probabilities와 같은 쿼리 4개) 지연 시간 비교
+
+    첫 DB에서 상태를 무작위로 뽑아 모든 DB에 같은 순서로 조회한다. rowid 레이아웃은 10개 상태 컬럼 조건,
+    상태 ID 키 레이아웃은 파이썬에서 계산한 상태 ID로 찾는다. 조회 1회 = 메인 행 + 하위 테이블 3개이며,
+    메인 행 조회만의 지연 시간도 따로 보고한다 (배율은 첫 DB 대비).
+    """
+    with sqlite3.connect(db_paths[0]) as conn:
+        states = conn.execute("""
+            SELECT willpower, corePoint, dealerA, dealerB, supportA, supportB,
+                   remainingAttempts, currentRerollAttempts, costModifier, isFirstProcessing
+            FROM goal_probabilities
+        """).fetchall()
+    random.Random(seed).shuffle(states)
+    states = states[:samples]
+    print(f"⏱️ DB 조회 벤치마크: {len(states)}개 상태 x {len(db_paths)}개 DB")
+    
+    baseline = None  # 첫 DB의 (전체 조회, 메인 행) 평균, 배율 기준
+    for db_path in db_paths:
+        conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+        probability_columns = [row[1] for row in conn.execute("PRAGMA table_info(goal_probabilities)")
+                               if row[1].startswith('prob_')]
+        keyed = database_uses_state_id_keys(conn)
+        if keyed:
+            reroll_cap = int(conn.execute("SELECT value FROM table_layout WHERE name = 'reroll_cap'").fetchone()[0])
+            state_query = f"SELECT id, {', '.join(probability_columns)} FROM goal_probabilities WHERE id = ?"
+            lookup_params = [(int(state_ids_from_fields(*state, reroll_cap=reroll_cap)),) for state in states]
+        else:
+            state_query = f"""
+                SELECT id, {', '.join(probability_columns)} FROM goal_probabilities
+                WHERE willpower = ? AND corePoint = ? AND dealerA = ? AND dealerB = ? AND supportA = ? AND supportB = ?
+                  AND remainingAttempts = ? AND currentRerollAttempts = ? AND costModifier = ? AND isFirstProcessing = ?
+            """
+            lookup_params = states
+        child_queries = (
+            "SELECT target, percentile, value FROM goal_probability_distributions WHERE gem_state_id = ? ORDER BY target, percentile",
+            "SELECT action, probability, description, selectionProbability FROM available_options WHERE gem_state_id = ? ORDER BY selectionProbability DESC",
+            "SELECT target, expected_cost_to_goal FROM expected_costs WHERE gem_state_id = ?",
+        )
+        
+        # 앞쪽 100개 조회로 페이지 캐시를 데운 뒤 측정
+        for params in lookup_params[:100]:
+            conn.execute(state_query, params).fetchone()
+        latencies = np.empty(len(lookup_params))
+        state_latencies = np.empty(len(lookup_params))
+        missing = 0
+        for lookup_idx, params in enumerate(lookup_params):
+            lookup_start = time.perf_counter()
+            row = conn.execute(state_query, params).fetchone()
+            state_latencies[lookup_idx] = time.perf_counter() - lookup_start
+            if row:
+                for child_query in child_queries:
+                    conn.execute(child_query, (row[0],)).fetchall()
+            else:
+                missing += 1
+            latencies[lookup_idx] = time.perf_counter() - lookup_start
+        conn.close()
+        
+        mean_us, state_mean_us = latencies.mean() * 1e6, state_latencies.mean() * 1e6
+        baseline = baseline or (mean_us, state_mean_us)
+        baseline_mean, baseline_state_mean = baseline
+        p50_us, p99_us = np.quantile(latencies, (0.5, 0.99)) * 1e6
+        file_size_mb = os.path.getsize(db_path) / 1024 / 1024
+        print(f"  - {db_path} ({'상태 ID 키' if keyed else 'rowid'}, {file_size_mb:.1f} MB): "
+              f"메인 행 평균 {state_mean_us:.1f}µs (x{baseline_state_mean / state_mean_us:.2f}), "
+              f"전체 조회 평균 {mean_us:.1f}µs, p50 {p50_us:.1f}µs, p99 {p99_us:.1f}µs "
+              f"(x{baseline_mean / mean_us:.2f}){f', 없는 상태 {missing}개' if missing else ''}")
+
+# 바이너리 테이블 파일: 헤더 + 구간별 배열 + 메타데이터 JSON(끝, 구간 위치/정밀도/오차 포함)
+TABLE_BINARY_MAGIC = b'GEMTAB01'
+TABLE_BINARY_HEADER = struct.Struct('<8sIQI')  # 매직, 상태 수, 메타데이터 오프셋, 메타데이터 길이
+TABLE_BINARY_CHUNK_STATES = 65536  # 값 구간을 쓸 때 한 번에 양자화하는 상태 수
+
+def table_value_layout(has_cost_policy: bool) -> Tuple[int, np.ndarray]:
+    """바이너리 값 행의 열 수와 비용 열 마스크 ([확률 T | 기대 비용 T | 퍼센타일 T*P | (비용 효율 정책 2T)])"""
+    target_count = len(TARGETS)
+    value_columns = target_count * (2 + len(PERCENTILE_GRID)) + (2 * target_count if has_cost_policy else 0)
+    cost_mask = np.zeros(value_columns, dtype=bool)
+    cost_mask[target_count:2 * target_count] = True
+    if has_cost_policy:
+        cost_mask[value_columns - target_count:] = True
+    return value_columns, cost_mask
+
+def decode_table_values(encoded: np.ndarray, precision: str, cost_mask) -> np.ndarray:
+    """바이너리에 저장된 값을 float64로 복원 (fixed는 열별 단위로 나눔)"""
+    if precision == 'fixed':
+        return encoded / np.where(cost_mask, FIXED_POINT_SCALES['cost'], FIXED_POINT_SCALES['probability'])
+    return encoded.astype(np.float64)
+
+def encode_table_rows(records: List[StateRecord], precision: str, has_cost_policy: bool,
+                      report: QuantizationReport) -> Dict[str, np.ndarray]:
+    """레코드들을 바이너리 행 배열로 양자화 -> values, optionCounts, optionIds, selectionProbs
+
+    report에는 바이너리 독자가 보게 될 값(유효 자릿수 반올림 전)의 오차를 누적한다.
+    """
+    value_columns, cost_mask = table_value_layout(has_cost_policy)
+    head_columns = len(TARGETS) * (2 + len(PERCENTILE_GRID))
+    values = np.stack([np.concatenate((record.values[:head_columns], record.values[len(record.values) - 2 * len(TARGETS):]))
+                       if has_cost_policy else record.values[:value_columns]
+                       for record in records])
+    encoded_values, _ = quantize_values(values, precision, cost_mask)
+    report.update_values(np.abs(decode_table_values(encoded_values, precision, cost_mask) - values), has_cost_policy)
+    
+    selection = np.concatenate([record.selection_probs for record in records])
+    encoded_selection, _ = quantize_values(selection, precision, False)
+    report.update_selection(np.abs(decode_table_values(encoded_selection, precision, False) - selection))
+    
+    return {
+        'values': encoded_values,
+        'optionCounts': np.array([len(record.option_ids) for record in records], dtype=np.int64),
+        'optionIds': np.frombuffer(b''.join(record.option_ids for record in records), dtype=np.uint8),
+        'selectionProbs': encoded_selection
+    }
+
+def table_metadata(precision: str, has_cost_policy: bool, report: QuantizationReport) -> Dict[str, Any]:
+    """바이너리 테이블/아카이브 공통 메타데이터"""
+    return {
+        'rerollCap': MAX_REROLL_FOR_MEMOIZATION,
+        'targets': TARGETS,
+        'columns': [definition['column'] for definition in TARGET_DEFINITIONS],
+        'percentiles': PERCENTILE_GRID,
+        'optionActions': OPTION_ACTIONS,
+        'hasCostPolicy': has_cost_policy,
+        'valueColumns': table_value_layout(has_cost_policy)[0],
+        'precision': precision,
+        'dtype': PRECISION_DTYPES[precision],
+        'fixedPointScales': FIXED_POINT_SCALES,
+        'maxAbsError': report.to_dict(),
+        'maxSelectionError': report.max_selection_error
+    }
+
+def save_to_binary(table: Dict[int, StateRecord], path: str, precision: str = 'float64'):
+    """확률 테이블을 상태 ID로 정렬된 배열 구간들로 저장 (BinaryTable로 조회)
+
+    구간: stateIds(u4), values(상태 x [확률 T | 기대 비용 T | 퍼센타일 T*P | (비용 효율 정책 2T)]),
+    optionOffsets(u4, 상태 수 + 1), optionIds(u1), selectionProbs. 값 구간은 precision의 dtype
+    (fixed는 FIXED_POINT_SCALES 단위 정수)이며, 목표별 최대 절대 오차는 메타데이터에 기록된다.
+    """
+    state_ids = np.array(sorted(table), dtype='<u4')
+    records = [table[state_id] for state_id in state_ids.tolist()]
+    has_cost_policy = bool(records) and records[0].has_cost_policy
+    report = QuantizationReport(precision)
+    
+    # 상태 묶음 단위로 양자화 (구간별로 이어 쓰기 위해 인코딩된 배열만 보관)
+    chunks = [encode_table_rows(records[start:start + TABLE_BINARY_CHUNK_STATES], precision, has_cost_policy, report)
+              for start in range(0, len(records), TABLE_BINARY_CHUNK_STATES)]
+    option_offsets = np.zeros(len(records) + 1, dtype='<u4')
+    if chunks:
+        np.cumsum(np.concatenate([chunk['optionCounts'] for chunk in chunks]), out=option_offsets[1:])
+    
+    sections = {}
+    with open(path, 'wb') as f:
+        f.write(TABLE_BINARY_HEADER.pack(TABLE_BINARY_MAGIC, len(state_ids), 0, 0))
+        for name, arrays in (('stateIds', [state_ids]),
+                             ('values', [chunk['values'] for chunk in chunks]),
+                             ('optionOffsets', [option_offsets]),
+                             ('optionIds', [chunk['optionIds'] for chunk in chunks]),
+                             ('selectionProbs', [chunk['selectionProbs'] for chunk in chunks])):
+            sections[name] = f.tell()
+            for array_part in arrays:
+                f.write(array_part.tobytes())
+        
+        metadata = table_metadata(precision, has_cost_policy, report)
+        metadata.update({'optionCount': int(option_offsets[-1]), 'sections': sections})
+        metadata = json.dumps(metadata, ensure_ascii=False).encode('utf-8')
+        metadata_offset = f.tell()
+        f.write(metadata)
+        f.seek(0)
+        f.write(TABLE_BINARY_HEADER.pack(TABLE_BINARY_MAGIC, len(state_ids), metadata_offset, len(metadata)))
+    
+    file_size_mb = os.path.getsize(path) / 1024 / 1024
+    print(f"📦 바이너리 테이블 저장 완료: {path} ({len(state_ids)}개 상태, {precision}, {file_size_mb:.1f} MB)")
+    if precision != 'float64':
+        report.print_summary()
+
+class TableRows:
+    """상태 ID로 정렬된 바이너리 행 배열 묶음 조회 (BinaryTable 전체, 또는 압축 아카이브의 청크 하나)"""
+
+    def __init__(self, metadata: Dict[str, Any], state_ids: np.ndarray, values: np.ndarray,
+                 option_offsets: np.ndarray, option_ids: np.ndarray, selection_probs: np.ndarray):
+        self.metadata = metadata
+        self.targets = metadata['targets']
+        self.percentiles = metadata['percentiles']
+        self.reroll_cap = metadata['rerollCap']
+        self.state_ids = state_ids
+        self.values = values
+        self.option_offsets = option_offsets
+        self.option_ids = option_ids
+        self.selection_probs = selection_probs
+        
+        # fixed는 열마다 단위가 다름 (비용 열만 0.01골드)
+        self.value_scales = np.ones(metadata['valueColumns'])
+        self.selection_scale = 1.0
+        if metadata['precision'] == 'fixed':
+            _, cost_mask = table_value_layout(metadata['hasCostPolicy'])
+            scales = metadata['fixedPointScales']
+            self.value_scales = np.where(cost_mask, scales['cost'], scales['probability'])
+            self.selection_scale = scales['probability']
+
+    def __len__(self) -> int:
+        return len(self.state_ids)
+
+    def index_of(self, state_id: int) -> int:
+        """상태 ID의 행 번호 (없으면 KeyError)"""
+        i = int(np.searchsorted(self.state_ids, state_id))
+        if i >= len(self.state_ids) or self.state_ids[i] != state_id:
+            raise KeyError(f"테이블에 없는 상태 ID입니다: {state_id}")
+        return i
+
+    def row_values(self, i: int) -> np.ndarray:
+        """행 하나의 값 (float64로 복원)"""
+        return self.values[i].astype(np.float64) / self.value_scales
+
+    def state_data(self, i: int) -> Dict[str, Any]:
+        """행 하나를 기존 memo 형태 dict로 변환 (StateRecord.to_dict와 같은 모양)"""
+        target_count = len(self.targets)
+        values = self.row_values(i)
+        start, stop = int(self.option_offsets[i]), int(self.option_offsets[i + 1])
+        option_ids = self.option_ids[start:stop].tolist()
+        selection = (self.selection_probs[start:stop].astype(np.float64) / self.selection_scale).tolist()
+        percentiles = values[2 * target_count:target_count * (2 + len(self.percentiles))].reshape(target_count, -1)
+        state_data = {
+            'probabilities': dict(zip(self.targets, values[:target_count].tolist())),
+            'availableOptions': [{
+                'action': OPTION_ACTIONS[option_id],
+                'probability': PROCESSING_POSSIBILITIES[OPTION_ACTIONS[option_id]]['probability'],
+                'description': OPTION_DESCRIPTIONS.get(OPTION_ACTIONS[option_id], OPTION_ACTIONS[option_id]),
+                'selectionProbability': selection_prob
+            } for option_id, selection_prob in zip(option_ids, selection)],
+            'percentiles': {target: dict(zip(self.percentiles, row))
+                            for target, row in zip(self.targets, percentiles.tolist())},
+            'expectedCosts': dict(zip(self.targets, values[target_count:2 * target_count].tolist()))
+        }
+        if self.metadata['hasCostPolicy']:
+            state_data['costOptimal'] = {
+                'probabilities': dict(zip(self.targets, values[-2 * target_count:-target_count].tolist())),
+                'expectedCosts': dict(zip(self.targets, values[-target_count:].tolist()))
+            }
+        return state_data
+
+    def lookup(self, gem: GemState) -> Dict[str, Any]:
+        """젬 상태 하나 조회 (없거나 범위를 벗어난 상태면 KeyError)"""
+        if not state_fields_in_range(gem):
+            raise KeyError(f"유효 범위를 벗어난 젬 상태입니다: {gem}")
+        return self.state_data(self.index_of(state_to_id(gem, reroll_cap=self.reroll_cap)))
+
+    def rows_of(self, state_ids) -> Tuple[np.ndarray, np.ndarray]:
+        """상태 ID 배열의 행 번호 배열과 존재 마스크 (없는 ID의 행 번호는 0)"""
+        state_ids = np.asarray(state_ids, dtype=np.uint32)
+        rows = np.minimum(np.searchsorted(self.state_ids, state_ids), max(len(self.state_ids) - 1, 0))
+        found = self.state_ids[rows] == state_ids if len(self.state_ids) else np.zeros(state_ids.shape, dtype=bool)
+        return np.where(found, rows, 0), found
+
+    def lookup_many(self, state_ids) -> Dict[str, np.ndarray]:
+        """상태 ID 배열 묶음 조회 -> found (N,), probabilities/expectedCosts (N, T), percentiles (N, T, P)
+
+        행 번호는 searchsorted 한 번으로 구하고 값은 팬시 인덱싱으로 모으므로 memmap에서도
+        필요한 페이지만 읽는다. 테이블에 없는 상태의 값은 NaN이며, 열 순서는 self.targets/self.percentiles를 따른다.
+        비용 효율 정책이 있으면 costOptimalProbabilities/costOptimalExpectedCosts (N, T)도 함께 반환한다.
+        """
+        rows, found = self.rows_of(state_ids)
+        values = self.values[rows.ravel()].astype(np.float64) / self.value_scales
+        values[~found.ravel()] = np.nan
+        values = values.reshape(rows.shape + (-1,))
+        target_count = len(self.targets)
+        result = {
+            'found': found,
+            'probabilities': values[..., :target_count],
+            'expectedCosts': values[..., target_count:2 * target_count],
+            'percentiles': values[..., 2 * target_count:target_count * (2 + len(self.percentiles))].reshape(
+                rows.shape + (target_count, len(self.percentiles)))
+        }
+        if self.metadata['hasCostPolicy']:
+            result['costOptimalProbabilities'] = values[..., -2 * target_count:-target_count]
+            result['costOptimalExpectedCosts'] = values[..., -target_count:]
+        return result
+
+    def lookup_fields(self, **fields) -> Dict[str, np.ndarray]:
+        """GemState 필드 이름의 배열들로 묶음 조회 (state_ids_from_fields + lookup_many)"""
+        return self.lookup_many(state_ids_from_fields(**fields, reroll_cap=self.reroll_cap))
+
+class BinaryTable(TableRows):
+    """save_to_binary로 저장한 테이블 조회 (구간들을 memmap으로 열고 상태 ID는 searchsorted로 찾음)"""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            magic, state_count, metadata_offset, metadata_length = TABLE_BINARY_HEADER.unpack(
+                f.read(TABLE_BINARY_HEADER.size))
+            if magic != TABLE_BINARY_MAGIC:
+                raise ValueError(f"바이너리 테이블 형식이 아닙니다: {path}")
+            f.seek(metadata_offset)
+            metadata = json.loads(f.read(metadata_length).decode('utf-8'))
+        
+        sections = metadata['sections']
+        dtype = np.dtype(metadata['dtype'])
+        option_count = metadata['optionCount']
+        super().__init__(
+            metadata,
+            np.memmap(path, dtype='<u4', mode='r', offset=sections['stateIds'], shape=(state_count,)),
+            np.memmap(path, dtype=dtype, mode='r', offset=sections['values'],
+                      shape=(state_count, metadata['valueColumns'])),
+            np.memmap(path, dtype='<u4', mode='r', offset=sections['optionOffsets'], shape=(state_count + 1,)),
+            np.memmap(path, dtype=np.uint8, mode='r', offset=sections['optionIds'], shape=(option_count,)),
+            np.memmap(path, dtype=dtype, mode='r', offset=sections['selectionProbs'], shape=(option_count,))
+        )
+
+# 청크 압축 아카이브: 헤더 + (remainingAttempts, 리롤, 비용) 청크별 압축 블록 + 청크 인덱스 + 메타데이터 JSON
+TABLE_ARCHIVE_MAGIC = b'GEMARC01'
+TABLE_ARCHIVE_HEADER = struct.Struct('<8sIIQI')  # 매직, 청크 수, 상태 수, 메타데이터 오프셋, 메타데이터 길이
+TABLE_ARCHIVE_INDEX_DTYPE = np.dtype([('key', '<u4'), ('state_count', '<u4'), ('first_id', '<u4'),
+                                      ('last_id', '<u4'), ('offset', '<u8'), ('length', '<u4')])
+ARCHIVE_COMPRESSIONS = {
+    'zlib': (lambda data: zlib.compress(data, 9), zlib.decompress),
+    'lzma': (lzma.compress, lzma.decompress)
+}
+
+def archive_chunk_key(state_id):
+    """상태 ID의 아카이브 청크 키: remainingAttempts | 리롤 << 5 | 비용 인덱스 << 10 (상태 ID의 18~29비트)"""
+    return (state_id >> 18) & 0xFFF
+
+def save_to_archive(table: Dict[int, StateRecord], path: str, compression: str = 'zlib', precision: str = 'float64'):
+    """확률 테이블을 (remainingAttempts, 리롤, 비용) 청크마다 독립 압축해 저장 (TableArchive로 조회)
+
+    청크 블록은 [stateIds u4 | values | optionOffsets u4 | optionIds u1 | selectionProbs]를 압축한 것이며,
+    인덱스는 청크 키 순으로 (키, 상태 수, 첫/마지막 상태 ID, 바이트 오프셋, 길이)를 담는다.
+    """
+    compress, _ = ARCHIVE_COMPRESSIONS[compression]
+    state_ids = np.array(sorted(table), dtype='<u4')
+    chunk_keys = archive_chunk_key(state_ids)
+    order = np.lexsort((state_ids, chunk_keys))
+    state_ids, chunk_keys = state_ids[order], chunk_keys[order]
+    boundaries = np.flatnonzero(np.diff(chunk_keys)) + 1
+    has_cost_policy = len(state_ids) > 0 and table[int(state_ids[0])].has_cost_policy
+    report = QuantizationReport(precision)
+    
+    index = np.zeros(len(boundaries) + 1 if len(state_ids) else 0, dtype=TABLE_ARCHIVE_INDEX_DTYPE)
+    raw_size = 0
+    with open(path, 'wb') as f:
+        f.write(TABLE_ARCHIVE_HEADER.pack(TABLE_ARCHIVE_MAGIC, len(index), len(state_ids), 0, 0))
+        for chunk_idx, chunk_ids in enumerate(np.split(state_ids, boundaries) if len(state_ids) else []):
+            rows = encode_table_rows([table[state_id] for state_id in chunk_ids.tolist()], precision, has_cost_policy, report)
+            option_offsets = np.zeros(len(chunk_ids) + 1, dtype='<u4')
+            np.cumsum(rows['optionCounts'], out=option_offsets[1:])
+            payload = b''.join(part.tobytes() for part in (chunk_ids, rows['values'], option_offsets,
+                                                           rows['optionIds'], rows['selectionProbs']))
+            block = compress(payload)
+            raw_size += len(payload)
+            index[chunk_idx] = (archive_chunk_key(int(chunk_ids[0])), len(chunk_ids), chunk_ids[0], chunk_ids[-1],
+                                f.tell(), len(block))
+            f.write(block)
+        
+        metadata = table_metadata(precision, has_cost_policy, report)
+        metadata.update({'compression': compression, 'indexOffset': f.tell()})
+        f.write(index.tobytes())
+        metadata = json.dumps(metadata, ensure_ascii=False).encode('utf-8')
+        metadata_offset = f.tell()
+        f.write(metadata)
+        f.seek(0)
+        f.write(TABLE_ARCHIVE_HEADER.pack(TABLE_ARCHIVE_MAGIC, len(index), len(state_ids), metadata_offset, len(metadata)))
+    
+    file_size_mb = os.path.getsize(path) / 1024 / 1024
+    print(f"🗜️ 압축 아카이브 저장 완료: {path} ({len(index)}개 청크, {len(state_ids)}개 상태, {compression}, "
+          f"{raw_size / 1024 / 1024:.1f} MB -> {file_size_mb:.1f} MB)")
+    if precision != 'float64':
+        report.print_summary()
+
+class TableArchive:
+    """save_to_archive로 저장한 아카이브 조회 (요청한 상태가 속한 청크만 읽어 압축 해제, 최근 청크는 캐시)"""
+
+    def __init__(self, path: str, cached_chunks: int = 8):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, chunk_count, self.state_count, metadata_offset, metadata_length = TABLE_ARCHIVE_HEADER.unpack(
+                f.read(TABLE_ARCHIVE_HEADER.size))
+            if magic != TABLE_ARCHIVE_MAGIC:
+                raise ValueError(f"압축 아카이브 형식이 아닙니다: {path}")
+            f.seek(metadata_offset)
+            self.metadata = json.loads(f.read(metadata_length).decode('utf-8'))
+            f.seek(self.metadata['indexOffset'])
+            self.index = np.frombuffer(f.read(chunk_count * TABLE_ARCHIVE_INDEX_DTYPE.itemsize),
+                                       dtype=TABLE_ARCHIVE_INDEX_DTYPE)
+        self.reroll_cap = self.metadata['rerollCap']
+        self.chunks = LRUMemo(cached_chunks)
+
+    def __len__(self) -> int:
+        return self.state_count
+
+    def chunk(self, key: int) -> TableRows:
+        """청크 키의 행 배열 (압축 해제 결과는 LRU 캐시)"""
+        if key in self.chunks:
+            return self.chunks[key]
+        i = int(np.searchsorted(self.index['key'], key))
+        if i >= len(self.index) or self.index['key'][i] != key:
+            raise KeyError(f"아카이브에 없는 청크입니다: {key}")
+        entry = self.index[i]
+        with open(self.path, 'rb') as f:
+            f.seek(int(entry['offset']))
+            payload = ARCHIVE_COMPRESSIONS[self.metadata['compression']][1](f.read(int(entry['length'])))
+        
+        # 압축 해제한 블록을 구간별 배열로 나눔
+        state_count = int(entry['state_count'])
+        dtype = np.dtype(self.metadata['dtype'])
+        position = 0
+        arrays = []
+        for array_dtype, count in (('<u4', state_count), (dtype, state_count * self.metadata['valueColumns']),
+                                   ('<u4', state_count + 1)):
+            arrays.append(np.frombuffer(payload, dtype=array_dtype, count=count, offset=position))
+            position += arrays[-1].nbytes
+        option_count = int(arrays[2][-1])
+        for array_dtype in (np.uint8, dtype):
+            arrays.append(np.frombuffer(payload, dtype=array_dtype, count=option_count, offset=position))
+            position += arrays[-1].nbytes
+        arrays[1] = arrays[1].reshape(state_count, self.metadata['valueColumns'])
+        
+        self.chunks[key] = TableRows(self.metadata, *arrays)
+        return self.chunks[key]
+
+    def lookup(self, gem: GemState) -> Dict[str, Any]:
+        """젬 상태 하나 조회 (해당 청크만 압축 해제, 없거나 범위를 벗어난 상태면 KeyError)"""
+        if not state_fields_in_range(gem):
+            raise KeyError(f"유효 범위를 벗어난 젬 상태입니다: {gem}")
+        state_id = state_to_id(gem, reroll_cap=self.reroll_cap)
+        rows = self.chunk(archive_chunk_key(state_id))
+        return rows.state_data(rows.index_of(state_id))
+
+# 조회 서비스 (--serve): server.js와 같은 API를 메모리 배열에서 바로 응답
+SERVE_MAX_BATCH_STATES = 10000  # 일괄 조회 요청 하나의 최대 상태 수
+SERVE_MAX_BODY_BYTES = 4 * 1024 * 1024
+SERVE_RESPONSE_CACHE_STATES = 65536  # 상태별 직렬화된 응답 캐시 크기 (JSON 직렬화가 조회 비용 대부분)
+HTTP_STATUS_TEXT = {200: 'OK', 204: 'No Content', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                    413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+def parse_state_param(state_param: str) -> GemState:
+    """server.js의 s 파라미터("2_1_1_2_0_0_6_2_100_0")를 GemState로 (빠진 값과 숫자가 아닌 값은 0)"""
+    values = []
+    for part in state_param.split('_'):
+        try:
+            values.append(int(float(part)))
+        except ValueError:
+            values.append(0)
+    values += [0] * (10 - len(values))
+    wp, cp, dealerA, dealerB, supportA, supportB, attempts, reroll, cost, isFirst = values[:10]
+    return GemState(wp, cp, dealerA, dealerB, supportA, supportB, attempts, reroll, cost, bool(isFirst))
+
+class TableLookupService:
+    """save_to_binary 테이블을 메모리 배열로 한 번 읽어 두고 server.js와 같은 모양으로 응답하는 조회 서비스
+
+    요청마다 DB 질의 없이 상태 ID를 searchsorted로 찾아 행 하나만 변환한다.
+    """
+
+    def __init__(self, table_path: str):
+        table = BinaryTable(table_path)
+        # memmap을 메모리로 한 번만 복사 (이후 조회는 디스크 접근 없음)
+        self.rows = TableRows(table.metadata, np.array(table.state_ids), np.array(table.values),
+                              np.array(table.option_offsets), np.array(table.option_ids),
+                              np.array(table.selection_probs))
+        self.columns = table.metadata['columns']
+        self.table_path = table_path
+        self.response_cache = LRUMemo(SERVE_RESPONSE_CACHE_STATES)
+
+    def gem_probabilities(self, gem: GemState):
+        """/api/gem-probabilities 응답: {prob_* 컬럼..., percentiles, availableOptions, expectedCosts} (없으면 None)
+
+        범위를 벗어난 필드는 상태 ID에서 다른 상태와 겹치므로 server.js처럼 조회하지 않고 None.
+        """
+        if not state_fields_in_range(gem):
+            return None
+        try:
+            state_data = self.rows.lookup(gem)
+        except KeyError:
+            return None
+        response = dict(zip(self.columns, state_data['probabilities'].values()))
+        response['percentiles'] = state_data['percentiles']
+        response['availableOptions'] = sorted(state_data['availableOptions'],
+                                              key=lambda option: -option['selectionProbability'])
+        response['expectedCosts'] = state_data['expectedCosts']
+        return response
+
+    def gem_probabilities_json(self, gem: GemState) -> bytes:
+        """gem_probabilities 응답의 JSON 바이트 (상태 ID별 LRU 캐시)"""
+        if not state_fields_in_range(gem):
+            return b'null'
+        state_id = state_to_id(gem, reroll_cap=self.rows.reroll_cap)
+        if state_id in self.response_cache:
+            return self.response_cache[state_id]
+        response = json.dumps(self.gem_probabilities(gem), ensure_ascii=False).encode('utf-8')
+        self.response_cache[state_id] = response
+        return response
+
+    def gem_all_probabilities(self, gem: GemState) -> Dict[str, Any]:
+        """/api/gem-all-probabilities 응답: 현재 상태, 리롤 상태들, 옵션 적용 후 상태들을 한 번에"""
+        def prob_data(state: GemState):
+            state_response = self.gem_probabilities(state)
+            if state_response is None:
+                return None
+            return {
+                'gem': {**{field: getattr(state, field) for field in GemState.__slots__},
+                        'isFirstProcessing': int(state.isFirstProcessing)},
+                'probabilities': {column: state_response[column] for column in self.columns},
+                'percentiles': state_response['percentiles'],
+                'expectedCosts': state_response['expectedCosts'],
+                'availableOptions': state_response['availableOptions']
+            }
+        
+        available_options = [{key: option[key] for key in ('action', 'probability', 'description')}
+                             for option in get_available_options(gem)]
+        result = {'current': prob_data(gem), 'rerolls': [], 'options': [], 'availableOptions': available_options}
+        seen = {state_to_key(gem)}
+        
+        rerolled_gem = gem
+        reroll_depth = 1
+        while rerolled_gem.currentRerollAttempts > 0:
+            rerolled_gem = replace(rerolled_gem, currentRerollAttempts=rerolled_gem.currentRerollAttempts - 1,
+                                   isFirstProcessing=False)
+            if state_to_key(rerolled_gem) not in seen:
+                seen.add(state_to_key(rerolled_gem))
+                data = prob_data(rerolled_gem)
+                if data is not None:
+                    result['rerolls'].append({'rerollDepth': reroll_depth, **data})
+            reroll_depth += 1
+        
+        for option in available_options:
+            applied_gem = apply_processing(gem, option['action'])
+            if state_to_key(applied_gem) not in seen:
+                seen.add(state_to_key(applied_gem))
+                data = prob_data(applied_gem)
+                if data is not None:
+                    result['options'].append({'action': option['action'], **data})
+        return result
+
+    def route(self, method: str, path: str, query: Dict[str, str], body: bytes) -> Tuple[int, Any]:
+        """요청 하나 처리 -> (HTTP 상태 코드, JSON으로 보낼 값 또는 이미 직렬화된 bytes)"""
+        if path == '/health':
+            return 200, {'status': 'OK', 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}
+        if path == '/api/stats':
+            return 200, {'total_states': len(self.rows)}
+        if path in ('/api/gem-probabilities', '/api/gem-all-probabilities'):
+            if method != 'GET':
+                return 405, {'error': f'Method {method} not allowed'}
+            if not query.get('s'):
+                return 400, {'error': 'Missing required parameter: s'}
+            gem = parse_state_param(query['s'])
+            if path == '/api/gem-probabilities':
+                return 200, self.gem_probabilities_json(gem)
+            return 200, self.gem_all_probabilities(gem)
+        if path == '/api/gem-probabilities/batch':
+            # 일괄 조회: {"states": ["2_1_1_2_0_0_6_2_100_0", ...]} -> 같은 순서의 응답 목록 (없는 상태는 null)
+            if method != 'POST':
+                return 405, {'error': f'Method {method} not allowed'}
+            try:
+                states = json.loads(body or b'{}')['states']
+            except (ValueError, KeyError, TypeError):
+                return 400, {'error': 'Body must be {"states": ["wp_cp_dA_dB_sA_sB_attempts_reroll_cost_first", ...]}'}
+            if not isinstance(states, list) or len(states) > SERVE_MAX_BATCH_STATES:
+                return 400, {'error': f'states must be a list of at most {SERVE_MAX_BATCH_STATES} entries'}
+            return 200, b'[' + b','.join(self.gem_probabilities_json(parse_state_param(str(state)))
+                                         for state in states) + b']'
+        return 404, {'error': f'Not found: {path}'}
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """HTTP/1.1 연결 하나 처리 (keep-alive로 여러 요청)"""
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    break
+                request_line, *header_lines = head.decode('latin-1').split('\r\n')
+                method, target, version = (request_line.split(' ') + ['', ''])[:3]
+                headers = {}
+                for line in header_lines:
+                    if ':' in line:
+                        name, value = line.split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+                
+                content_length = int(headers.get('content-length', 0) or 0)
+                if content_length > SERVE_MAX_BODY_BYTES:
+                    status, payload = 413, {'error': 'Request body too large'}
+                    body = b''
+                else:
+                    body = await reader.readexactly(content_length) if content_length else b''
+                    parsed = urllib.parse.urlsplit(target)
+                    query = dict(urllib.parse.parse_qsl(parsed.query))
+                    if method == 'OPTIONS':
+                        status, payload = 204, None
+                    else:
+                        try:
+                            status, payload = self.route(method, parsed.path, query, body)
+                        except Exception as e:
+                            status, payload = 500, {'error': str(e)}
+                
+                if status == 204:
+                    response_body = b''
+                elif isinstance(payload, bytes):
+                    response_body = payload
+                else:
+                    response_body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+                writer.write((f"HTTP/1.1 {status} {HTTP_STATUS_TEXT.get(status, '')}\r\n"
+                              f"Content-Type: application/json; charset=utf-8\r\n"
+                              f"Content-Length: {len(response_body)}\r\n"
+                              f"Access-Control-Allow-Origin: *\r\n"
+                              f"Access-Control-Allow-Methods: GET, POST, OPTIONS\r\n"
+                              f"Access-Control-Allow-Headers: Content-Type\r\n"
+                              f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode('latin-1')
+                             + response_body)
+                await writer.drain()
+                if not keep_alive or status == 413:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+async def serve_lookup_table(table_path: str, host: str = '127.0.0.1', port: int = 3001, socket_path: str = None):
+    """조회 서비스를 TCP(host:port) 또는 유닉스 소켓(socket_path)으로 실행"""
+    service = TableLookupService(table_path)
+    if socket_path:
+        server = await asyncio.start_unix_server(service.handle_connection, path=socket_path)
+        address = f"unix:{socket_path}"
+    else:
+        server = await asyncio.start_server(service.handle_connection, host=host, port=port)
+        address = f"http://{host}:{port}"
+    print(f"🛰️ 조회 서비스 시작: {address} ({len(service.rows)}개 상태, {table_path})")
+    async with server:
+        await server.serve_forever()
+
+# 최적 선택 테이블 파일: 헤더 + 목표 이름(JSON) + 상태 ID 정렬 인덱스 + 상태별 압축 블록
+DECISION_TABLE_MAGIC = b'GEMDEC01'
+DECISION_TABLE_HEADER = struct.Struct('<8sHHII')  # 매직, 리롤 상한, 목표 수, 목표 이름 JSON 길이, 상태 수
+
+def save_decision_table(decisions: dict, path: str):
+    """조합별 최적 선택 기록을 바이너리 파일로 저장
+
+    상태마다 (조합 순위 * 목표 수 + 목표 인덱스) 위치에 2비트 선택 코드(DECISION_NAMES)가 들어 있으며,
+    조합 순위는 사용 가능한 옵션 목록(get_available_options 순서)에 대한 combinations 순서이다.
+    """
+    state_ids = np.array(sorted(decisions), dtype='<u4')
+    option_counts = np.array([decisions[state_id][0] for state_id in state_ids.tolist()], dtype=np.uint8)
+    blobs = [decisions[state_id][1] for state_id in state_ids.tolist()]
+    offsets = np.zeros(len(blobs) + 1, dtype='<u8')
+    np.cumsum([len(blob) for blob in blobs], out=offsets[1:])
+    target_names = json.dumps(TARGETS, ensure_ascii=False).encode('utf-8')
+    
+    with open(path, 'wb') as f:
+        f.write(DECISION_TABLE_HEADER.pack(DECISION_TABLE_MAGIC, MAX_REROLL_FOR_MEMOIZATION, len(TARGETS),
+                                           len(target_names), len(state_ids)))
+        f.write(target_names)
+        f.write(state_ids.tobytes())
+        f.write(option_counts.tobytes())
+        f.write(offsets.tobytes())
+        for blob in blobs:
+            f.write(blob)
+    
+    file_size_mb = os.path.getsize(path) / 1024 / 1024
+    print(f"🧭 최적 선택 테이블 저장 완료: {path} ({len(state_ids)}개 상태, {file_size_mb:.1f} MB)")
+
+class DecisionTable:
+    """save_decision_table로 저장한 최적 선택 테이블 조회 (상태 하나당 압축 블록 하나만 읽음)"""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            magic, self.reroll_cap, target_count, names_length, state_count = DECISION_TABLE_HEADER.unpack(
+                f.read(DECISION_TABLE_HEADER.size))
+            if magic != DECISION_TABLE_MAGIC:
+                raise ValueError(f"최적 선택 테이블 형식이 아닙니다: {path}")
+            self.targets = json.loads(f.read(names_length).decode('utf-8'))
+            self.state_ids = np.frombuffer(f.read(4 * state_count), dtype='<u4')
+            self.option_counts = np.frombuffer(f.read(state_count), dtype=np.uint8)
+            self.offsets = np.frombuffer(f.read(8 * (state_count + 1)), dtype='<u8')
+            data_start = f.tell()
+        self.data = np.memmap(path, dtype=np.uint8, mode='r', offset=data_start)
+        self.target_index = {target: i for i, target in enumerate(self.targets)}
+
+    def lookup(self, gem: GemState, offer_actions: List[str], target: str) -> str:
+        """젬 상태에서 옵션 4개(offer_actions)가 제시됐을 때의 최적 선택 ('stop', 'progress', 'reroll')"""
+        if not state_fields_in_range(gem):
+            raise KeyError(f"유효 범위를 벗어난 젬 상태입니다: {gem}")
+        state_id = state_to_id(gem, reroll_cap=self.reroll_cap)
+        i = int(np.searchsorted(self.state_ids, state_id))
+        if i >= len(self.state_ids) or self.state_ids[i] != state_id:
+            raise KeyError(f"최적 선택이 기록되지 않은 상태입니다: {state_to_key(gem)}")
+        
+        available_actions = [option['action'] for option in get_available_options(gem)]
+        if len(available_actions) != self.option_counts[i]:
+            raise ValueError(f"옵션 수가 테이블과 다릅니다: {len(available_actions)} != {self.option_counts[i]}")
+        positions = sorted(available_actions.index(action) for action in offer_actions)
+        
+        blob = zlib.decompress(self.data[int(self.offsets[i]):int(self.offsets[i + 1])].tobytes())
+        flat_idx = combination_rank(positions, len(available_actions)) * len(self.targets) + self.target_index[target]
+        code = blob[flat_idx >> 2] >> (2 * (flat_idx & 3)) & 3
+        return DECISION_NAMES[code]
+
+SENSITIVITY_TABLE_MAGIC = b'GEMSEN01'
+SENSITIVITY_TABLE_HEADER = struct.Struct('<8sHHHII')  # 매직, 리롤 상한, 목표 수, 가중치 수, 이름 JSON 길이, 상태 수
+
+def save_sensitivity_table(sensitivities: dict, path: str):
+    """상태별 가중치 민감도를 바이너리 파일로 저장
+
+    상태 ID 오름차순으로 (상태 x 목표 x OPTION_ACTIONS) float32 배열을 그대로 기록하며,
+    값은 PROCESSING_POSSIBILITIES의 probability(가중치) 1 단위당 목표 확률 변화율이다.
+    """
+    state_ids = np.array(sorted(sensitivities), dtype='<u4')
+    names = json.dumps({'targets': TARGETS, 'weights': OPTION_ACTIONS}, ensure_ascii=False).encode('utf-8')
+    
+    with open(path, 'wb') as f:
+        f.write(SENSITIVITY_TABLE_HEADER.pack(SENSITIVITY_TABLE_MAGIC, MAX_REROLL_FOR_MEMOIZATION, len(TARGETS),
+                                              len(OPTION_ACTIONS), len(names), len(state_ids)))
+        f.write(names)
+        f.write(state_ids.tobytes())
+        for state_id in state_ids.tolist():
+            f.write(sensitivities[state_id].astype('<f4').tobytes())
+    
+    file_size_mb = os.path.getsize(path) / 1024 / 1024
+    print(f"📐 가중치 민감도 테이블 저장 완료: {path} ({len(state_ids)}개 상태, {file_size_mb:.1f} MB)")
+
+# 근사 오차 상한 파일: 헤더 + 상태 ID(u4, 오름차순) + 오차 상한(f8)
+APPROXIMATION_TABLE_MAGIC = b'GEMAPX01'
+APPROXIMATION_TABLE_HEADER = struct.Struct('<8sHdI')  # 매직, 리롤 상한, 엡실론, 상태 수
+
+def save_approximation_table(errors: dict, path: str):
+    """근사 모드의 상태별 목표 확률 오차 상한을 바이너리 파일로 저장 (read_approximation_table로 읽음)"""
+    state_ids = np.array(sorted(errors), dtype='<u4')
+    bounds = np.array([errors[state_id] for state_id in state_ids.tolist()], dtype='<f8')
+    with open(path, 'wb') as f:
+        f.write(APPROXIMATION_TABLE_HEADER.pack(APPROXIMATION_TABLE_MAGIC, MAX_REROLL_FOR_MEMOIZATION,
+                                                APPROXIMATION_EPSILON or 0.0, len(state_ids)))
+        f.write(state_ids.tobytes())
+        f.write(bounds.tobytes())
+    print(f"🧮 근사 오차 상한 저장 완료: {path} ({len(state_ids)}개 상태, 최대 {bounds.max(initial=0.0):.3g})")
+
+def read_approximation_table(path: str) -> Tuple[float, np.ndarray, np.ndarray]:
+    """근사 오차 상한 파일을 읽어 (엡실론, 상태 ID 배열, 오차 상한 배열) 반환"""
+    with open(path, 'rb') as f:
+        magic, _, epsilon, state_count = APPROXIMATION_TABLE_HEADER.unpack(f.read(APPROXIMATION_TABLE_HEADER.size))
+        if magic != APPROXIMATION_TABLE_MAGIC:
+            raise ValueError(f"근사 오차 상한 파일 형식이 아닙니다: {path}")
+        state_ids = np.frombuffer(f.read(4 * state_count), dtype='<u4')
+        bounds = np.frombuffer(f.read(8 * state_count), dtype='<f8')
+    return epsilon, state_ids, bounds
+
+class SensitivityTable:
+    """save_sensitivity_table로 저장한 가중치 민감도 테이블 조회 (값은 memmap으로 필요한 상태만 읽음)"""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            magic, self.reroll_cap, target_count, weight_count, names_length, state_count = SENSITIVITY_TABLE_HEADER.unpack(
+                f.read(SENSITIVITY_TABLE_HEADER.size))
+            if magic != SENSITIVITY_TABLE_MAGIC:
+                raise ValueError(f"가중치 민감도 테이블 형식이 아닙니다: {path}")
+            names = json.loads(f.read(names_length).decode('utf-8'))
+            self.targets, self.weights = names['targets'], names['weights']
+            self.state_ids = np.frombuffer(f.read(4 * state_count), dtype='<u4')
+            data_start = f.tell()
+        self.values = np.memmap(path, dtype='<f4', mode='r', offset=data_start,
+                                shape=(state_count, target_count, weight_count))
+        self.target_index = {target: i for i, target in enumerate(self.targets)}
+
+    def lookup(self, gem: GemState) -> np.ndarray:
+        """젬 상태의 (목표 x 가중치) 민감도 배열 (없거나 범위를 벗어난 상태면 KeyError)"""
+        if not state_fields_in_range(gem):
+            raise KeyError(f"유효 범위를 벗어난 젬 상태입니다: {gem}")
+        state_id = state_to_id(gem, reroll_cap=self.reroll_cap)
+        i = int(np.searchsorted(self.state_ids, state_id))
+        if i >= len(self.state_ids) or self.state_ids[i] != state_id:
+            raise KeyError(f"민감도가 기록되지 않은 상태입니다: {state_to_key(gem)}")
+        return np.asarray(self.values[i])
+
+    def ranking(self, gem: GemState, target: str, top: int = 10) -> List[Tuple[str, float]]:
+        """목표 확률에 가장 큰 영향을 주는 가중치 순위 [(옵션 액션, 미분값), ...] (절댓값 내림차순)"""
+        row = self.lookup(gem)[self.target_index[target]]
+        order = np.argsort(-np.abs(row), kind='stable')[:top]
+        return [(self.weights[i], float(row[i])) for i in order]
+
 if __name__ == "__main__":
     # 명령줄 인자 파싱
     import argparse
+    import multiprocessing
     parser = argparse.ArgumentParser(description='젬 가공 확률 테이블 생성')
     parser.add_argument('--max-reroll', type=int, default=2, 
                         help='최대 리롤 횟수 (기본값: 2)')
     parser.add_argument('--max-reroll-range', type=str, default=None,
                         help='리롤 횟수 범위 (예: "2-7")')
+    parser.add_argument('--max-attempts', type=int, default=MAX_REMAINING_ATTEMPTS,
+                        help=f'전체 상태 생성 시 최대 남은 가공 횟수 (기본값: {MAX_REMAINING_ATTEMPTS}, 최대 31)')
     parser.add_argument('--no-viz', action='store_true',
                         help='시각화 비활성화')
+    parser.add_argument('--viz-fps', type=int, default=60,
+                        help='진행 영상 프레임레이트 (기본값: 60)')
+    parser.add_argument('--viz-states-per-frame', type=int, default=1,
+                        help='영상 프레임 하나당 계산 완료 상태 수 (기본값: 1)')
+    parser.add_argument('--percentile-step', type=int, default=10,
+                        help='퍼센타일 격자 간격 %% (기본값: 10 -> 10, 20, ..., 90)')
+    parser.add_argument('--targets-config', type=str, default=None,
+                        help='목표 정의 JSON 파일 (기본값: TARGET_DEFINITIONS)')
+    parser.add_argument('--export-decisions', action='store_true',
+                        help='상태/조합/목표별 최적 선택(중단/진행/리롤)을 .decisions.bin으로 함께 저장')
+    parser.add_argument('--export-sensitivity', action='store_true',
+                        help='목표 확률의 옵션 가중치별 미분(최적 선택 고정)을 .sensitivity.bin으로 함께 저장 (상태당 목표 x 옵션 float32)')
+    parser.add_argument('--weight-configs', type=str, default=None, metavar='JSON',
+                        help='가중치 구성 목록 JSON으로 구성별 테이블을 한 번에 생성 (예: [{"name": "live", "weights": {...}}], '
+                             '비용 효율 정책/결정/민감도/스레드 미지원)')
+    parser.add_argument('--cost-objective', type=float, default=None, metavar='GOLD',
+                        help='목표 달성 1회를 GOLD 골드로 보고 (가치 * 확률 - 기대 비용)을 최대화하는 정책도 함께 계산 (costOptimal)')
+    parser.add_argument('--precision', choices=EXPORT_PRECISIONS, default='float64',
+                        help='JSON/SQLite/바이너리 내보내기 값 정밀도 (float32, float16, fixed: 확률 1e-6/비용 0.01골드 정수), '
+                             '목표별 최대 절대 오차를 출력하고 기록함 (기본값: float64)')
+    parser.add_argument('--incremental-db', action='store_true',
+                        help='기존 .db가 있으면 새로 만들지 않고 상태별 해시를 비교해 바뀐 상태의 행만 갱신')
+    parser.add_argument('--export-keyed-db', action='store_true',
+                        help='상태 ID를 기본 키로 하는 WITHOUT ROWID 조회용 DB(.keyed.db)도 함께 저장')
+    parser.add_argument('--benchmark-db', type=str, nargs='+', default=None, metavar='DB',
+                        help='테이블 생성 없이 DB들의 단건 조회 지연 시간 비교 (예: X.db X.keyed.db)')
+    parser.add_argument('--benchmark-samples', type=int, default=2000,
+                        help='--benchmark-db에서 조회할 상태 수 (기본값: 2000)')
+    parser.add_argument('--export-binary', action='store_true',
+                        help='상태 ID 정렬 배열 형식의 바이너리 테이블(.table.bin)도 함께 저장')
+    parser.add_argument('--export-archive', choices=sorted(ARCHIVE_COMPRESSIONS), default=None,
+                        help='(remainingAttempts, 리롤, 비용) 청크별로 독립 압축한 아카이브(.archive.bin)도 함께 저장')
+    parser.add_argument('--reachable-only', action='store_true',
+                        help='초기 젬(첫 가공 상태)에서 도달 가능한 상태만 계산')
+    parser.add_argument('--approx-epsilon', type=float, default=None, metavar='EPS',
+                        help='근사 생성: 상태마다 확률 큰 조합부터 남은 조합 질량이 EPS 미만이 될 때까지만 순회하고 '
+                             '상태별 목표 확률 오차 상한을 .approx.bin으로 저장 (빠른 탐색용)')
+    parser.add_argument('--low-memory', action='store_true',
+                        help='시도 횟수 층 2개만 메모리에 두고 다 쓴 층은 JSON/DB로 바로 저장 (바이너리/아카이브/결정/민감도/증분 저장 미지원)')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='층별 스레드 풀 계산에 쓸 스레드 수 (free-threaded 빌드에서 효과적, 기본값: 1)')
+    parser.add_argument('--evaluate', type=str, default=None, metavar='STATE',
+                        help='테이블 생성 없이 상태 하나만 평가 (예: "3,4,2,0,3,0,9,10,0,0", 리롤 상한 없음)')
+    parser.add_argument('--serve', type=str, default=None, metavar='TABLE_BIN',
+                        help='테이블 생성 없이 바이너리 테이블(.table.bin)을 메모리에 올려 server.js와 같은 조회 API 제공')
+    parser.add_argument('--serve-host', type=str, default='127.0.0.1',
+                        help='조회 서비스 주소 (기본값: 127.0.0.1)')
+    parser.add_argument('--serve-port', type=int, default=3001,
+                        help='조회 서비스 포트 (기본값: 3001)')
+    parser.add_argument('--serve-socket', type=str, default=None, metavar='PATH',
+                        help='TCP 대신 유닉스 소켓으로 조회 서비스 제공')
+    parser.add_argument('--render-progress', type=str, default=None, metavar='LOG',
+                        help='테이블 생성 없이 기존 진행 이벤트 로그를 영상으로 렌더링')
     args = parser.parse_args()
     
+    if args.render_progress:
+        render_progress_log(args.render_progress, args.render_progress.replace('.bin', '.mp4'),
+                            fps=args.viz_fps, states_per_frame=args.viz_states_per_frame)
+        sys.exit(0)
+    
+    if args.benchmark_db:
+        benchmark_database_lookups(args.benchmark_db, samples=args.benchmark_samples)
+        sys.exit(0)
+    
+    if args.serve:
+        asyncio.run(serve_lookup_table(args.serve, args.serve_host, args.serve_port, args.serve_socket))
+        sys.exit(0)
+    
+    if args.evaluate:
+        if args.targets_config:
+            set_target_definitions(load_target_definitions(args.targets_config))
+        set_percentile_grid(args.percentile_step)
+        wp, cp, dealerA, dealerB, supportA, supportB, attempts, reroll, cost, isFirst = map(int, args.evaluate.split(','))
+        eval_start = time.time()
+        record = evaluate_state(GemState(wp, cp, dealerA, dealerB, supportA, supportB, attempts, reroll, cost, bool(isFirst)))
+        print(json.dumps(record.to_dict(), ensure_ascii=False, indent=2))
+        print(f"⏱️ 평가 완료: {time.time() - eval_start:.2f}초 ({len(_lazy_memo)}개 상태 계산)")
+        sys.exit(0)
+    
+    if args.low_memory:
+        unsupported = [flag for flag, enabled in (('--export-binary', args.export_binary),
+                                                  ('--export-archive', args.export_archive),
+                                                  ('--export-decisions', args.export_decisions),
+                                                  ('--export-sensitivity', args.export_sensitivity),
+                                                  ('--incremental-db', args.incremental_db),
+                                                  ('--approx-epsilon', args.approx_epsilon is not None),
+                                                  ('--weight-configs', args.weight_configs)) if enabled]
+        if unsupported:
+            parser.error(f"--low-memory는 {', '.join(unsupported)}와 함께 쓸 수 없습니다 (전체 테이블이 메모리에 필요)")
+    
+    if args.weight_configs:
+        unsupported = [flag for flag, enabled in (('--cost-objective', args.cost_objective is not None),
+                                                  ('--export-decisions', args.export_decisions),
+                                                  ('--export-sensitivity', args.export_sensitivity),
+                                                  ('--threads', args.threads > 1)) if enabled]
+        if unsupported:
+            parser.error(f"--weight-configs는 {', '.join(unsupported)}와 함께 쓸 수 없습니다 (일괄 계산은 확률 최대화 정책만 순차 계산)")
+    
+    if args.approx_epsilon is not None:
+        if not 0 < args.approx_epsilon < 1:
+            parser.error("--approx-epsilon은 0과 1 사이여야 합니다")
+        if args.export_decisions or args.export_sensitivity or args.weight_configs:
+            parser.error("--approx-epsilon은 --export-decisions, --export-sensitivity, --weight-configs와 함께 쓸 수 없습니다")
+    
     enable_viz = not args.no_viz
+    set_percentile_grid(args.percentile_step)
+    if not 0 < args.max_attempts <= 31:
+        parser.error("--max-attempts는 1~31이어야 합니다 (상태 ID의 시도 횟수 필드는 5비트)")
+    MAX_REMAINING_ATTEMPTS = args.max_attempts
+    if args.targets_config:
+        set_target_definitions(load_target_definitions(args.targets_config))
+        print(f"🎯 목표 정의 로드: {args.targets_config} ({len(TARGETS)}개 목표)")
+    weight_configs = load_weight_configs(args.weight_configs) if args.weight_configs else None
+    COST_OBJECTIVE_SUCCESS_VALUE = args.cost_objective
+    APPROXIMATION_EPSILON = args.approx_epsilon
     
     # 리롤 범위 결정
     if args.max_reroll_range:
@@ -1383,6 +3914,9 @@ if __name__ == "__main__":
     # combo 메모이제이션만 공유 (일반 memo는 각각 독립)
     shared_combo_memo = {}
     
+    # 진행 영상 렌더링 프로세스들 (생성과 병렬로 백그라운드 실행)
+    render_processes = []
+    
     try:
         for max_reroll in reroll_values:
             # 전역 변수 업데이트
@@ -1391,19 +3925,112 @@ if __name__ == "__main__":
             
             print(f"\n🎯 리롤 {max_reroll} 계산 시작...")
             
+            # 가중치 구성 일괄 생성: 구성마다 JSON/DB 하나씩 (내보내는 옵션 가중치도 구성 값)
+            if weight_configs:
+                tables = generate_probability_tables_for_weight_configs(weight_configs, reachable_only=args.reachable_only)
+                for (config_name, weights), config_table in zip(weight_configs, tables):
+                    config_suffix = re.sub(r'\W+', '_', config_name)
+                    previous_weights = apply_weight_config(weights)
+                    try:
+                        json_file = f"./probability_table_reroll_{max_reroll}_{config_suffix}.json"
+                        save_to_json(config_table, json_file, precision=args.precision)
+                        print(f"✅ JSON 파일 저장 완료: {json_file}")
+                        db_file = f"./probability_table_reroll_{max_reroll}_{config_suffix}.db"
+                        create_database_schema(db_file)
+                        save_to_database(config_table, db_file, precision=args.precision, incremental=args.incremental_db)
+                        if args.export_keyed_db:
+                            keyed_db_file = db_file.replace('.db', '.keyed.db')
+                            create_keyed_database_schema(keyed_db_file)
+                            save_to_keyed_database(config_table, keyed_db_file, precision=args.precision)
+                        if args.export_binary:
+                            save_to_binary(config_table, db_file.replace('.db', '.table.bin'), precision=args.precision)
+                        if args.export_archive:
+                            save_to_archive(config_table, db_file.replace('.db', '.archive.bin'),
+                                            compression=args.export_archive, precision=args.precision)
+                    finally:
+                        apply_weight_config(previous_weights)
+                continue
+            
             # 확률 테이블 생성 (combo 메모이제이션만 공유)
-            table = generate_probability_table_with_shared_memo(None, shared_combo_memo, enable_visualization=enable_viz) # type: ignore
+            progress_log_file = f"./gem_calculation_progress_reroll_{max_reroll}.bin"
+            
+            # 저메모리 모드: 층이 끝날 때마다 JSON/DB에 바로 저장
+            if args.low_memory:
+                json_file = f"./probability_table_reroll_{max_reroll}.json"
+                db_file = f"./probability_table_reroll_{max_reroll}.db"
+                create_database_schema(db_file)
+                layer_writers = [JsonTableWriter(json_file, precision=args.precision),
+                                 DatabaseTableWriter(db_file, precision=args.precision)]
+                if args.export_keyed_db:
+                    keyed_db_file = f"./probability_table_reroll_{max_reroll}.keyed.db"
+                    create_keyed_database_schema(keyed_db_file)
+                    layer_writers.append(KeyedDatabaseTableWriter(keyed_db_file, precision=args.precision))
+                generate_probability_table_with_shared_memo(None, shared_combo_memo, enable_visualization=enable_viz, # type: ignore
+                                                            progress_log_path=progress_log_file,
+                                                            reachable_only=args.reachable_only,
+                                                            threads=args.threads,
+                                                            layer_writers=layer_writers)
+                for writer in layer_writers:
+                    writer.close()
+                print(f"✅ JSON 파일 저장 완료: {json_file}")
+                if enable_viz:
+                    render_process = multiprocessing.Process(
+                        target=render_progress_log,
+                        args=(progress_log_file, progress_log_file.replace('.bin', '.mp4')),
+                        kwargs={'fps': args.viz_fps, 'states_per_frame': args.viz_states_per_frame}
+                    )
+                    render_process.start()
+                    render_processes.append(render_process)
+                continue
+
+            decisions = {} if args.export_decisions else None
+            sensitivities = {} if args.export_sensitivity else None
+            approximation_errors = {} if args.approx_epsilon is not None else None
+            table = generate_probability_table_with_shared_memo(None, shared_combo_memo, enable_visualization=enable_viz, # type: ignore
+                                                                progress_log_path=progress_log_file,
+                                                                decisions=decisions,
+                                                                reachable_only=args.reachable_only,
+                                                                sensitivities=sensitivities,
+                                                                approximation_errors=approximation_errors,
+                                                                threads=args.threads)
+            
+            if enable_viz:
+                render_process = multiprocessing.Process(
+                    target=render_progress_log,
+                    args=(progress_log_file, progress_log_file.replace('.bin', '.mp4')),
+                    kwargs={'fps': args.viz_fps, 'states_per_frame': args.viz_states_per_frame}
+                )
+                render_process.start()
+                render_processes.append(render_process)
             
             # JSON 파일로도 저장
             json_file = f"./probability_table_reroll_{max_reroll}.json"
-            with open(json_file, 'w', encoding='utf-8') as f:
-                json.dump(table, f, ensure_ascii=False, indent=2)
+            save_to_json(table, json_file, precision=args.precision)
             print(f"✅ JSON 파일 저장 완료: {json_file}")
             
             # SQLite 데이터베이스로 저장
             db_file = f"./probability_table_reroll_{max_reroll}.db"
             create_database_schema(db_file)
-            save_to_database(table, db_file)
+            save_to_database(table, db_file, precision=args.precision, incremental=args.incremental_db)
+            if args.export_keyed_db:
+                keyed_db_file = f"./probability_table_reroll_{max_reroll}.keyed.db"
+                create_keyed_database_schema(keyed_db_file)
+                save_to_keyed_database(table, keyed_db_file, precision=args.precision)
+            
+            # 바이너리 테이블 저장
+            if args.export_binary:
+                save_to_binary(table, f"./probability_table_reroll_{max_reroll}.table.bin", precision=args.precision)
+            if args.export_archive:
+                save_to_archive(table, f"./probability_table_reroll_{max_reroll}.archive.bin",
+                                compression=args.export_archive, precision=args.precision)
+            
+            # 최적 선택 테이블 저장
+            if decisions is not None:
+                save_decision_table(decisions, f"./probability_table_reroll_{max_reroll}.decisions.bin")
+            if sensitivities is not None:
+                save_sensitivity_table(sensitivities, f"./probability_table_reroll_{max_reroll}.sensitivity.bin")
+            if approximation_errors is not None:
+                save_approximation_table(approximation_errors, f"./probability_table_reroll_{max_reroll}.approx.bin")
                 
         print(f"\n🚀 사용법:")
         print(f"JSON: {json_file}")
@@ -1411,7 +4038,10 @@ if __name__ == "__main__":
         print(f"예: SELECT * FROM gem_states WHERE prob_ancient > 0.8 ORDER BY prob_ancient DESC;")
         
     finally:
-        # 시각화 정리
-        if visualizer:
-            print("🎬 시각화 완료!")
-            visualizer.close()
\ No newline at end of file
+        # 시각화 정리 (백그라운드 렌더링 완료 대기)
+        if progress_log:
+            progress_log.close()
+        for render_process in render_processes:
+            render_process.join()
+        if render_processes:
+            print("🎬 시각화 완료!")
\ No newline at end of file
@@ -22,6 +22,43 @@ const PORT = process.env.PORT || 3001;
 // SQLite 데이터베이스 연결
 let db = null;
 
+// 목표 확률 컬럼 목록 (prob_* 컬럼은 생성기의 TARGET_DEFINITIONS에 따라 자동 생성되므로 DB에서 읽음)
+let probColumns = [];
+
+// 상태 ID 키 레이아웃 DB(--export-keyed-db)면 상태 ID의 리롤 상한, 아니면 null
+let stateIdRerollCap = null;
+
+// 생성기의 state_to_id와 같은 31비트 상태 ID (리롤 횟수는 상한까지만)
+const COST_MODIFIER_TO_INDEX = { '-100': 0, '0': 1, '100': 2 };
+// 필드별 허용 범위 (벗어난 값은 다른 상태의 ID로 겹쳐 들어가므로 조회하지 않음)
+const STATE_ID_FIELD_RANGES = {
+  willpower: [1, 5], corePoint: [1, 5],
+  dealerA: [0, 5], dealerB: [0, 5], supportA: [0, 5], supportB: [0, 5],
+  remainingAttempts: [0, 31], currentRerollAttempts: [0, Number.MAX_SAFE_INTEGER]
+};
+function packStateId(gem) {
+  // 범위를 벗어난 상태는 null (컬럼 비교 조회와 마찬가지로 일치하는 행 없음)
+  for (const [field, [min, max]] of Object.entries(STATE_ID_FIELD_RANGES)) {
+    if (!Number.isInteger(gem[field]) || gem[field] < min || gem[field] > max) {
+      return null;
+    }
+  }
+  if (!Object.hasOwn(COST_MODIFIER_TO_INDEX, gem.costModifier)
+      || ![0, 1, false, true].includes(gem.isFirstProcessing)) {
+    return null;
+  }
+  return (gem.willpower
+    | gem.corePoint << 3
+    | gem.dealerA << 6
+    | gem.dealerB << 9
+    | gem.supportA << 12
+    | gem.supportB << 15
+    | gem.remainingAttempts << 18
+    | Math.min(stateIdRerollCap, gem.currentRerollAttempts) << 23
+    | COST_MODIFIER_TO_INDEX[gem.costModifier] << 28
+    | (gem.isFirstProcessing ? 1 : 0) << 30);
+}
+
 // 미들웨어 설정
 app.use(cors());
 app.use(express.json());
@@ -48,7 +85,33 @@ function initDatabase() {
           }
         });
         
-        resolve();
+        db.all("PRAGMA table_info(goal_probabilities)", (err, columns) => {
+          if (err) {
+            reject(err);
+            return;
+          }
+          probColumns = columns.map(column => column.name).filter(name => name.startsWith('prob_'));
+          console.log(`🎯 목표 확률 컬럼: ${probColumns.length}개`);
+          
+          db.all("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'table_layout'", (err, tables) => {
+            if (err || tables.length === 0) {
+              resolve();
+              return;
+            }
+            db.all("SELECT name, value FROM table_layout", (err, rows) => {
+              if (err) {
+                reject(err);
+                return;
+              }
+              const layout = Object.fromEntries(rows.map(row => [row.name, row.value]));
+              if (layout.layout === 'state_id') {
+                stateIdRerollCap = parseInt(layout.reroll_cap);
+                console.log(`🔑 상태 ID 키 레이아웃 (리롤 상한 ${stateIdRerollCap})`);
+              }
+              resolve();
+            });
+          });
+        });
       }
     });
   });
@@ -87,10 +150,8 @@ app.get('/api/gem-probabilities', (req, res) => {
   const [willpower, corePoint, dealerA, dealerB, supportA, supportB,
          remainingAttempts, currentRerollAttempts = 0, costModifier = 0, isFirstProcessing = 0] = values;
   
-  const query = `
-    SELECT id, prob_5_5, prob_5_4, prob_4_5, prob_5_3, prob_4_4, prob_3_5,
-           prob_sum8, prob_sum9, prob_relic, prob_ancient, 
-           prob_dealer_complete, prob_support_complete
+  let query = `
+    SELECT id, ${probColumns.join(', ')}
     FROM goal_probabilities 
     WHERE willpower = ? AND corePoint = ? 
       AND dealerA = ? AND dealerB = ? AND supportA = ? AND supportB = ?
@@ -98,7 +159,7 @@ app.get('/api/gem-probabilities', (req, res) => {
       AND costModifier = ? AND isFirstProcessing = ?
   `;
   
-  const params = [
+  let params = [
     parseInt(willpower) || 0,
     parseInt(corePoint) || 0,
     parseInt(dealerA) || 0,
@@ -111,6 +172,20 @@ app.get('/api/gem-probabilities', (req, res) => {
     parseInt(isFirstProcessing) || 0
   ];
   
+  // 상태 ID 키 레이아웃: 기본 키로 바로 조회
+  if (stateIdRerollCap !== null) {
+    const [wp, cp, dA, dB, sA, sB, attempts, reroll, cost, isFirst] = params;
+    const stateId = packStateId({
+      willpower: wp, corePoint: cp, dealerA: dA, dealerB: dB, supportA: sA, supportB: sB,
+      remainingAttempts: attempts, currentRerollAttempts: reroll, costModifier: cost, isFirstProcessing: isFirst
+    });
+    if (stateId === null) {
+      return res.json(null);
+    }
+    query = `SELECT id, ${probColumns.join(', ')} FROM goal_probabilities WHERE id = ?`;
+    params = [stateId];
+  }
+  
   db.get(query, params, (err, row) => {
     if (err) {
       res.status(500).json({ error: err.message });
@@ -302,19 +377,23 @@ app.get('/api/gem-all-probabilities', (req, res) => {
     );
   }
   
-  const query = `
-    SELECT id, willpower, corePoint, dealerA, dealerB, supportA, supportB,
+  const stateColumns = `id, willpower, corePoint, dealerA, dealerB, supportA, supportB,
            remainingAttempts, currentRerollAttempts, costModifier, isFirstProcessing,
-           prob_5_5, prob_5_4, prob_4_5, prob_5_3, prob_4_4, prob_3_5,
-           prob_sum8, prob_sum9, prob_relic, prob_ancient,
-           prob_dealer_complete, prob_support_complete
+           ${probColumns.join(', ')}`;
+  const query = stateIdRerollCap !== null ? `
+    SELECT ${stateColumns}
+    FROM goal_probabilities 
+    WHERE id IN (${states.map(() => '?').join(',')})
+  ` : `
+    SELECT ${stateColumns}
     FROM goal_probabilities 
     WHERE (willpower, corePoint, dealerA, dealerB, supportA, supportB, 
            remainingAttempts, currentRerollAttempts, costModifier, isFirstProcessing) 
     IN (VALUES ${placeholders})
   `;
   
-  db.all(query, params, async (err, rows) => {
+  // 범위를 벗어난 상태의 ID는 null로 바인딩되어 어떤 행과도 일치하지 않음
+  db.all(query, stateIdRerollCap !== null ? states.map(state => packStateId(state.gem)) : params, async (err, rows) => {
     if (err) {
       res.status(500).json({ error: err.message });
     } else {
@@ -392,20 +471,7 @@ app.get('/api/gem-all-probabilities', (req, res) => {
             
             const probData = {
               gem: state.gem,
-              probabilities: {
-                prob_5_5: row.prob_5_5,
-                prob_5_4: row.prob_5_4,
-                prob_4_5: row.prob_4_5,
-                prob_5_3: row.prob_5_3,
-                prob_4_4: row.prob_4_4,
-                prob_3_5: row.prob_3_5,
-                prob_sum8: row.prob_sum8,
-                prob_sum9: row.prob_sum9,
-                prob_relic: row.prob_relic,
-                prob_ancient: row.prob_ancient,
-                prob_dealer_complete: row.prob_dealer_complete,
-                prob_support_complete: row.prob_support_complete
-              },
+              probabilities: Object.fromEntries(probColumns.map(column => [column, row[column]])),
               percentiles,
               expectedCosts,
               availableOptions
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+질의 시점 평가(evaluate_state) 테스트: LRU 메모이제이션이 계산 도중 상태를 제거해도 결과가 같아야 함
+generate_probability_table.py의 함수들을 직접 import해서 사용
+"""
+
+import numpy as np
+import generate_probability_table as gpt
+from generate_probability_table import GemState, evaluate_state
+
+# 도달 가능한 하위 상태(약 230개)가 작은 LRU 크기보다 많은 젬
+QUERY_GEM = GemState(3, 3, 1, 1, 0, 0, 2, 0, 0, False)
+
+def evaluate_fresh(gem: GemState, max_states: int):
+    """호출 간 유지되는 메모이제이션을 비우고 평가"""
+    gpt._lazy_memo = None
+    return evaluate_state(gem, max_states=max_states)
+
+def test_small_lru_matches_unbounded_memo():
+    saved_settings = (gpt.MAX_REROLL_FOR_MEMOIZATION, gpt.PRINT_CALCULATION_PROGRESS)
+    bounded = evaluate_fresh(QUERY_GEM, max_states=50)
+    assert len(gpt._lazy_memo) == 50
+    unbounded = evaluate_fresh(QUERY_GEM, max_states=10**6)
+    assert len(gpt._lazy_memo) > 50
+    assert np.array_equal(bounded.values, unbounded.values)
+    assert bounded.option_ids == unbounded.option_ids
+    # 전역 설정은 건드리지 않음
+    assert (gpt.MAX_REROLL_FOR_MEMOIZATION, gpt.PRINT_CALCULATION_PROGRESS) == saved_settings
+
+def main():
+    test_small_lru_matches_unbounded_memo()
+    print("✅ test_small_lru_matches_unbounded_memo")
+
+if __name__ == "__main__":
+    main()
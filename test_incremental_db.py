@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+예전 스키마로 만든 DB에 대한 증분 저장(--incremental-db) 테스트
+generate_probability_table.py의 함수들을 직접 import해서 사용
+"""
+
+import contextlib
+import io
+import os
+import sqlite3
+import tempfile
+import generate_probability_table as gpt
+from generate_probability_table import (
+    GemState,
+    TARGET_DEFINITIONS,
+    calculate_probabilities,
+    create_database_schema,
+    save_to_database,
+)
+
+# 상태 해시/비용 효율 정책 이전의 DB 스키마
+OLD_SCHEMA = """
+    CREATE TABLE goal_probabilities (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        willpower INTEGER NOT NULL,
+        corePoint INTEGER NOT NULL,
+        dealerA INTEGER NOT NULL,
+        dealerB INTEGER NOT NULL,
+        supportA INTEGER NOT NULL,
+        supportB INTEGER NOT NULL,
+        remainingAttempts INTEGER NOT NULL,
+        currentRerollAttempts INTEGER NOT NULL,
+        costModifier INTEGER NOT NULL,
+        isFirstProcessing BOOLEAN NOT NULL,
+        {probability_columns},
+        UNIQUE(willpower, corePoint, dealerA, dealerB, supportA, supportB,
+               remainingAttempts, currentRerollAttempts, costModifier, isFirstProcessing)
+    );
+    CREATE TABLE goal_probability_distributions (
+        gem_state_id INTEGER NOT NULL,
+        target TEXT NOT NULL,
+        percentile INTEGER NOT NULL,
+        value REAL NOT NULL,
+        FOREIGN KEY (gem_state_id) REFERENCES goal_probabilities (id),
+        PRIMARY KEY (gem_state_id, target, percentile)
+    );
+    CREATE TABLE available_options (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        gem_state_id INTEGER NOT NULL,
+        action TEXT NOT NULL,
+        probability REAL NOT NULL,
+        description TEXT NOT NULL,
+        selectionProbability REAL NOT NULL,
+        FOREIGN KEY (gem_state_id) REFERENCES goal_probabilities (id)
+    );
+    CREATE TABLE expected_costs (
+        gem_state_id INTEGER NOT NULL,
+        target TEXT NOT NULL,
+        expected_cost_to_goal REAL NOT NULL,
+        FOREIGN KEY (gem_state_id) REFERENCES goal_probabilities (id),
+        PRIMARY KEY (gem_state_id, target)
+    );
+"""
+
+# 예전 DB에만 있는 상태 (증분 저장 후 지워져야 함)
+STALE_STATE = (1, 1, 0, 0, 0, 0, 3, 0, 0, False)
+
+def build_small_table() -> dict:
+    """리롤 없이 시도 1회 남은 젬에서 도달 가능한 상태들만 계산한 작은 테이블"""
+    saved_reroll_cap = gpt.MAX_REROLL_FOR_MEMOIZATION
+    gpt.MAX_REROLL_FOR_MEMOIZATION = 0
+    try:
+        memo = {}
+        with contextlib.redirect_stdout(io.StringIO()):
+            calculate_probabilities(GemState(4, 4, 1, 1, 0, 0, 1, 0, 0, False), memo, {})
+    finally:
+        gpt.MAX_REROLL_FOR_MEMOIZATION = saved_reroll_cap
+    return memo
+
+def create_old_database(db_path: str, probability_columns):
+    """예전 스키마 DB를 만들고 STALE_STATE 행 하나를 넣어 둠"""
+    conn = sqlite3.connect(db_path)
+    conn.executescript(OLD_SCHEMA.format(
+        probability_columns=',\n        '.join(f"{column} REAL NOT NULL" for column in probability_columns)))
+    conn.execute(f"INSERT INTO goal_probabilities VALUES (NULL, {', '.join(['?'] * (10 + len(probability_columns)))})",
+                 (*STALE_STATE, *([0.5] * len(probability_columns))))
+    conn.execute("INSERT INTO expected_costs VALUES (1, 'sum8+', 123.0)")
+    conn.commit()
+    conn.close()
+
+def dump_database(db_path: str):
+    """행 ID를 뺀 상태별 내용 (목표 확률 행, 퍼센타일, 기대 비용, 옵션) 정렬 목록"""
+    conn = sqlite3.connect(db_path)
+    states = {row[0]: [row[1:]] for row in conn.execute("SELECT * FROM goal_probabilities")}
+    for sql in ("SELECT gem_state_id, target, percentile, value FROM goal_probability_distributions ORDER BY 1, 2, 3",
+                "SELECT gem_state_id, target, expected_cost_to_goal, cost_optimal_probability, "
+                "cost_optimal_expected_cost FROM expected_costs ORDER BY 1, 2",
+                "SELECT gem_state_id, action, probability, description, selectionProbability "
+                "FROM available_options ORDER BY id"):
+        for row in conn.execute(sql):
+            states[row[0]].append(row[1:])
+    conn.close()
+    return sorted(states.values())
+
+def save_quietly(table: dict, db_path: str, incremental: bool):
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        create_database_schema(db_path)
+        save_to_database(table, db_path, incremental=incremental)
+    return output.getvalue()
+
+def check_incremental_update(probability_columns):
+    """예전 스키마 DB에 증분 저장한 결과가 새 DB에 전체 저장한 결과와 같은지 확인"""
+    table = build_small_table()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        old_db = os.path.join(tmp_dir, 'old.db')
+        fresh_db = os.path.join(tmp_dir, 'fresh.db')
+        create_old_database(old_db, probability_columns)
+        save_quietly(table, old_db, incremental=True)
+        save_quietly(table, fresh_db, incremental=False)
+        assert dump_database(old_db) == dump_database(fresh_db)
+
+        # 두 번째 증분 저장은 모든 상태가 해시로 동일 판정되어야 함
+        output = save_quietly(table, old_db, incremental=True)
+        assert f"동일 {len(table)}개" in output, output
+        assert dump_database(old_db) == dump_database(fresh_db)
+    return len(table)
+
+def test_incremental_update_of_old_schema_db():
+    """현재 목표 컬럼 일부가 빠진 예전 스키마: 컬럼을 추가하고 제자리에서 갱신"""
+    columns = [definition['column'] for definition in TARGET_DEFINITIONS]
+    check_incremental_update(columns[:-2])
+
+def test_incremental_update_with_removed_target_column():
+    """현재 목표 정의에 없는 목표 컬럼이 남은 DB: 새로 만들어 전체 저장"""
+    columns = [definition['column'] for definition in TARGET_DEFINITIONS]
+    check_incremental_update(columns + ['prob_removed_target'])
+
+def main():
+    for test in (test_incremental_update_of_old_schema_db, test_incremental_update_with_removed_target_column):
+        test()
+        print(f"✅ {test.__name__}")
+
+if __name__ == "__main__":
+    main()
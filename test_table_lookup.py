@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+바이너리 테이블 조회 테스트: 범위를 벗어난 필드가 다른 상태의 ID로 겹쳐 조회되지 않아야 함
+generate_probability_table.py의 함수들을 직접 import해서 사용
+"""
+
+import contextlib
+import io
+import os
+import tempfile
+import numpy as np
+from generate_probability_table import (
+    BinaryTable,
+    GemState,
+    calculate_probabilities,
+    save_to_binary,
+    state_ids_from_fields,
+)
+
+# 시도 1회 남은 젬 (도달 가능한 상태 16개)
+SMALL_TABLE_GEM = GemState(4, 4, 1, 1, 0, 0, 1, 0, 0, False)
+
+# 비트 폭을 넘거나 음수인 필드: 예전에는 (1,3,...), (..., 시도 1, 리롤 1, ...) 등 다른 상태의 ID가 됐음
+OUT_OF_RANGE_FIELDS = [
+    dict(willpower=9, corePoint=3),
+    dict(willpower=0, corePoint=4),
+    dict(dealerA=6),
+    dict(supportB=-1),
+    dict(remainingAttempts=33),
+    dict(remainingAttempts=-1),
+    dict(currentRerollAttempts=-2),
+    dict(costModifier=50),
+]
+
+def save_small_table(table_path: str):
+    memo = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        calculate_probabilities(SMALL_TABLE_GEM, memo, {})
+        save_to_binary(memo, table_path)
+
+def gem_fields(gem: GemState, **overrides):
+    fields = {field: getattr(gem, field) for field in GemState.__slots__}
+    fields.update(overrides)
+    return fields
+
+def test_out_of_range_fields_are_not_found():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        table_path = os.path.join(tmp_dir, 'small.table.bin')
+        save_small_table(table_path)
+        table = BinaryTable(table_path)
+
+        # 기준 상태는 찾아야 함
+        found = table.lookup_fields(**gem_fields(SMALL_TABLE_GEM))
+        assert found['found'].all()
+
+        # 범위 밖 상태: 묶음 조회는 found=False/NaN, 단일 조회는 KeyError
+        requests = [gem_fields(SMALL_TABLE_GEM, **overrides) for overrides in OUT_OF_RANGE_FIELDS]
+        batch = table.lookup_fields(**{field: np.array([request[field] for request in requests])
+                                       for field in GemState.__slots__})
+        assert not batch['found'].any()
+        assert np.isnan(batch['probabilities']).all()
+        for request in requests:
+            try:
+                table.lookup(GemState(**request))
+            except KeyError:
+                continue
+            raise AssertionError(f"범위 밖 상태가 조회됨: {request}")
+        del table
+
+def test_out_of_range_ids_do_not_alias():
+    assert state_ids_from_fields(9, 3, 0, 0, 0, 0, 5, 0, 0, 0) != state_ids_from_fields(1, 3, 0, 0, 0, 0, 5, 0, 0, 0)
+    assert state_ids_from_fields(3, 3, 0, 0, 0, 0, 33, 0, 0, 0) != state_ids_from_fields(3, 3, 0, 0, 0, 0, 1, 1, 0, 0)
+
+def main():
+    for test in (test_out_of_range_fields_are_not_found, test_out_of_range_ids_do_not_alias):
+        test()
+        print(f"✅ {test.__name__}")
+
+if __name__ == "__main__":
+    main()